@@ -0,0 +1,101 @@
+# backend/adaptive_controller.py
+import time
+import logging
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger("AdaptiveController")
+
+# 质量档位：从 0 (满质量) 到最后一档 (最大降级)，每一档是对会话配置的覆盖。
+# 先拉大步长 (少推理几帧)，再缩小模型输入 (单帧更快)，最后限制处理帧率。
+QUALITY_LADDER = [
+    {},
+    {"stride": 2},
+    {"stride": 2, "imgsz": 480},
+    {"stride": 3, "imgsz": 480},
+    {"stride": 3, "imgsz": 320},
+    {"stride": 4, "imgsz": 320, "max_fps": 10},
+    {"stride": 4, "imgsz": 320, "max_fps": 5},
+]
+
+
+class AdaptiveController:
+    """
+    单个会话的闭环质量控制器。
+    每收到一个推理结果就记录 d_an (全链路延迟) 和 inference_time (模型负载)，
+    滚动窗口的 p90 超过 SLO 时降一档，持续远低于 SLO 时再升一档 (滞回 + 冷却时间，避免来回抖动)。
+    控制器只产出参数覆盖 (overrides)，会话的基础配置保持不变，关闭后立即恢复原参数。
+    """
+    def __init__(self, slo_ms=250.0, window=30, min_samples=8,
+                 upgrade_ratio=0.6, degrade_cooldown=1.0, upgrade_cooldown=5.0, allow_imgsz=True):
+        self.slo_ms = float(slo_ms)
+        self.min_samples = min_samples
+        self.upgrade_ratio = upgrade_ratio          # p90 低于 slo * upgrade_ratio 才考虑升档
+        self.degrade_cooldown = degrade_cooldown    # 两次降档之间的最短间隔 (秒)
+        self.upgrade_cooldown = upgrade_cooldown    # 升档更保守
+        # 静态形状的引擎 (如 TorchScript) 不能改输入尺寸，档位里的 imgsz 被忽略
+        self.allow_imgsz = allow_imgsz
+
+        self.level = 0
+        self.changes = 0
+        self.overrides = {}
+        self._d_an = deque(maxlen=window)
+        self._inference = deque(maxlen=window)
+        self._last_change = 0.0
+
+    def set_slo(self, slo_ms):
+        self.slo_ms = float(slo_ms)
+
+    def _level_overrides(self, level):
+        overrides = dict(QUALITY_LADDER[level])
+        if not self.allow_imgsz:
+            overrides.pop("imgsz", None)
+        return overrides
+
+    def _set_level(self, level, reason, now):
+        previous = self.level
+        self.level = level
+        self.overrides = self._level_overrides(level)
+        self.changes += 1
+        self._last_change = now
+        # 新档位下的延迟分布不同，旧样本不再有参考意义
+        self._d_an.clear()
+        self._inference.clear()
+        return {"from": previous, "to": level, "reason": reason}
+
+    def observe(self, d_an, inference_time, now=None):
+        """
+        记录一个推理结果，必要时调整档位。
+        返回写入 ai_result["adaptive"] 的状态 (本次发生调整时带 change 字段)。
+        """
+        now = time.time() if now is None else now
+        self._d_an.append(d_an)
+        self._inference.append(inference_time)
+
+        change = None
+        if len(self._d_an) >= self.min_samples:
+            p90 = float(np.percentile(self._d_an, 90))
+            infer_p90 = float(np.percentile(self._inference, 90))
+            since_change = now - self._last_change
+            if p90 > self.slo_ms and self.level < len(QUALITY_LADDER) - 1 and since_change >= self.degrade_cooldown:
+                change = self._set_level(self.level + 1, f"p90 d_an {p90:.0f}ms > SLO {self.slo_ms:.0f}ms", now)
+            elif (p90 < self.slo_ms * self.upgrade_ratio and infer_p90 < self.slo_ms * self.upgrade_ratio / 2
+                  and self.level > 0 and since_change >= self.upgrade_cooldown):
+                change = self._set_level(self.level - 1, f"p90 d_an {p90:.0f}ms < {self.upgrade_ratio:.0%} of SLO", now)
+
+        state = self.state()
+        if change is not None:
+            state["change"] = change
+            logger.info(f"🎚️ Quality level {change['from']} -> {change['to']} ({change['reason']}) {self.overrides}")
+        return state
+
+    def state(self):
+        return {
+            "level": self.level,
+            "max_level": len(QUALITY_LADDER) - 1,
+            "slo_ms": self.slo_ms,
+            "p90_d_an": round(float(np.percentile(self._d_an, 90)), 2) if self._d_an else None,
+            "changes": self.changes,
+            "overrides": dict(self.overrides),
+        }
@@ -0,0 +1,55 @@
+# ai_config.py
+# AI 推理服务的部署参数 (可通过环境变量覆盖，无需改代码)
+import os
+
+# --- 推理引擎 ---
+# pytorch (Ultralytics eager) / onnx (ONNX Runtime) / onnx-int8 (INT8 量化) / openvino / torchscript
+INFER_ENGINE = os.getenv("AI_ENGINE", "pytorch")
+# 原始权重，非 pytorch 引擎首次启动时从它导出并缓存在同目录
+INFER_WEIGHTS = os.getenv("AI_WEIGHTS", "yolov8n.pt")
+INFER_IMGSZ = int(os.getenv("AI_IMGSZ", 640))
+# 额外加载的模型变体 (逗号分隔)，会话可通过 update_config({"engine": ...}) 选择，
+# 或通过 {"ab_engine": ...} 与当前引擎做 A/B 对照，例如 AI_ENGINE_VARIANTS=onnx-int8
+INFER_ENGINE_VARIANTS = [v.strip() for v in os.getenv("AI_ENGINE_VARIANTS", "").split(",") if v.strip()]
+
+# 上传视频的目录 (与 handlers/streamer.py 的上传接口一致)
+UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+# 视为视频的上传文件扩展名 (INT8 校准抽帧和视频预分析共用)
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mkv", ".mov", ".avi")
+
+# --- INT8 量化 (onnx-int8 引擎) ---
+# 校准数据：默认使用上传目录里的视频帧
+CALIBRATION_DIR = os.getenv("AI_CALIBRATION_DIR", UPLOAD_DIR)
+CALIBRATION_FRAMES = int(os.getenv("AI_CALIBRATION_FRAMES", 200))
+
+# --- 跨会话动态批处理调度器 ---
+# 一次模型前向最多合并多少帧 (来自不同会话)
+INFER_MAX_BATCH_SIZE = int(os.getenv("AI_MAX_BATCH_SIZE", 8))
+# 收到第一帧后最多再等多久凑 batch (毫秒)，0 表示只合并已经在排队的帧
+INFER_MAX_WAIT_MS = float(os.getenv("AI_MAX_WAIT_MS", 5))
+
+# --- 专用推理线程池 ---
+# 推理 worker 数 (每个 worker 持有一份模型副本，可并行执行不同的 batch)
+INFER_WORKERS = int(os.getenv("AI_INFER_WORKERS", 1))
+# 帧转换/Chunking 线程数
+INGEST_WORKERS = int(os.getenv("AI_INGEST_WORKERS", 2))
+# worker 形式: thread (同进程，共享内存) / process (独立进程，不受 GIL 影响)
+WORKER_MODE = os.getenv("AI_WORKER_MODE", "thread")
+# 每个 worker 的 torch intra-op 线程数，0 表示按 物理核心数 // worker 数 自动分配
+THREADS_PER_WORKER = int(os.getenv("AI_THREADS_PER_WORKER", 0))
+# 是否把每个 worker 绑定到各自的物理核心上 (Linux)
+PIN_CPUS = os.getenv("AI_PIN_CPUS", "0").lower() in ("1", "true", "yes")
+
+# --- 闭环自适应质量控制 ---
+# 新会话默认是否开启 (会话也可以通过 update_config({"adaptive": true}) 单独开启)
+ADAPTIVE_DEFAULT = os.getenv("AI_ADAPTIVE", "0").lower() in ("1", "true", "yes")
+# 目标延迟：滚动窗口内 d_an 的 p90 (毫秒)
+LATENCY_SLO_MS = float(os.getenv("AI_LATENCY_SLO_MS", 250))
+
+# --- 上传视频的离线预分析 ---
+# 上传后在独立进程中全速检测整个视频，结果按时间索引缓存，回放时直接查表推送 (见 video_cache.py)
+VIDEO_CACHE_ENABLED = os.getenv("AI_VIDEO_CACHE", "1").lower() in ("1", "true", "yes")
+# 预分析进程数 (每个进程加载一份模型)
+VIDEO_CACHE_WORKERS = int(os.getenv("AI_VIDEO_CACHE_WORKERS", 1))
+# 每个预分析进程的 torch 线程数，0 表示把实时推理 worker 用剩的物理核心平分给预分析进程 (至少 1 个)
+VIDEO_CACHE_THREADS = int(os.getenv("AI_VIDEO_CACHE_THREADS", 0))
@@ -1,46 +1,262 @@
 # backend/ai_processor.py (科研升级版)
 import time
+import asyncio
 import logging
+import threading
 import numpy as np
-from collections import deque
 import torch
-from ultralytics import YOLO
-import random
+
+from frame_buffer import FrameRingBuffer
+from engines import create_engine
+from box_ops import box_iou, merge_crop_detections, roi_regions, temporal_fuse
+from adaptive_controller import AdaptiveController
+from tracker import MultiObjectTracker
+from motion_gate import MotionGate
+from fault_injection import FaultInjector
 
 logger = logging.getLogger("AIProcessor")
 
+# 新会话的默认实验参数 (每个会话持有自己的副本)
+DEFAULT_SESSION_CONFIG = {
+    "chunk_size": 1,      # 默认单帧 (实时)
+    "stride": 1,          # 步长
+    # 故障注入 (见 fault_injection.py)：只在发送端异步注入，默认关闭，生产会话零开销
+    "fault_injection": False,
+    "simulate_drift": 80,           # 固定附加延迟 (毫秒)
+    "fault_jitter_ms": [30, 100],   # 随机网络抖动 (毫秒)
+    "fault_drop_rate": 0.0,         # 丢弃结果的概率
+    "fault_reorder_rate": 0.0,      # 结果被推迟、从而乱序到达的概率
+    # 取帧策略: "latest" 每次推理前跳到 track 队列里最新的一帧 (积压帧直接丢弃，延迟有界)
+    #          "throttle" 旧的限流逻辑，逐帧接收，间隔不足 1/max_fps 的帧丢弃
+    "frame_mode": "latest",
+    "max_fps": 0,          # 处理帧率上限，0 表示不限 (throttle 模式下默认 20)
+    # 模型变体 (见 AIProcessor.engines)：None 使用全局默认引擎，也可以指定已加载的变体，如 "onnx-int8"
+    "engine": None,
+    # A/B 对照：设置为另一个已加载的变体后，每帧会再用它推理一次，结果里附带两者的差异
+    "ab_engine": None,
+    "imgsz": None,         # 模型输入边长，None 使用全局 imgsz (只对动态形状的引擎生效)
+    # 闭环自适应：根据滚动延迟自动调整 stride / imgsz / max_fps，维持 d_an 的 p90 不超过 SLO
+    "adaptive": False,
+    "latency_slo_ms": 250,
+    # 多目标跟踪：为每个检测框分配跨消息稳定的 track_id
+    "tracking": True,
+    # 检测器两次调用之间，用跟踪器把框外推到每个收到的帧的 PTS 并发送 (source="tracker")
+    "track_fill": False,
+    # 静态画面门控：与上一次推理的帧相比没有明显变化时，复用上一次的检测结果 (reused=True)；
+    # 默认关闭，复用结果的 inference_time 约为 0，会改变基准测试里的平均延迟
+    "motion_gate": False,
+    "motion_threshold": 0.01,   # 灰度缩略图中变化像素的占比阈值
+    "motion_refresh_s": 2.0,    # 画面静止时也至少每隔这么多秒真正推理一次
+    # ROI 模式：只在上一次检测结果周围的裁剪区域上以更小的输入尺寸推理，定期/丢失目标时做整帧推理
+    "roi_mode": False,
+    "roi_imgsz": 320,           # 裁剪区域的模型输入边长
+    "roi_padding": 0.25,        # 区域相对框长边的外扩比例
+    "roi_max_regions": 4,       # 区域多于这个数时直接整帧推理
+    "roi_full_interval": 1.0,   # 至少每隔这么多秒做一次整帧推理 (发现新目标)
+    # 窗口推理：chunk_size > 1 时推理窗口里的哪些帧
+    #   "last" 只推理最新一帧 / "all" 整个窗口一次 batch 前向 / "subsample" 均匀抽取 chunk_samples 帧 (含最新帧)
+    # 多帧的检测结果按 temporal_fusion 聚合到最新一帧上 (见 box_ops.temporal_fuse)
+    "chunk_mode": "last",
+    "chunk_samples": 4,
+    "temporal_fusion": "vote",     # vote (多数投票) / fusion (置信度加权融合)
+    "temporal_iou": 0.5,           # 跨帧匹配同一目标的 IoU 阈值
+    "temporal_min_votes": 0.5,     # vote 模式：目标至少出现在这个比例的帧中
+    # 结果发送 (见 result_emitter.py)，默认全部关闭，行为与逐条发送完整结果一致
+    "emit_suppress": False,        # 目标没有变化时只发心跳
+    "suppress_iou": 0.9,           # 同一目标 IoU 不低于这个值、
+    "suppress_conf": 0.05,         # 且置信度变化不超过这个值，视为没有变化
+    "emit_delta": False,           # 相对最近一次完整结果只发送增量 (需要 tracking)
+    "keyframe_interval": 2.0,      # 完整结果的最长间隔 (秒)
+    "emit_coalesce": False,        # 发送积压时只发送最新的结果
+}
+
+
 class AIProcessor:
-    def __init__(self):
-        self.frame_count = 0
-        
-        # 1. 模型加载 (YOLO 仅作演示，实际可替换为手语模型)
+    """
+    进程内共享的推理引擎：只负责加载模型、预热和执行推理。
+    所有与单路视频流相关的状态 (缓冲区、计数器、配置、FPS) 都放在 AISession 中，
+    多个 Peer 并发时互不干扰。
+    """
+    def __init__(self, engine="pytorch", weights="yolov8n.pt", imgsz=640, variants=(), engine_options=None):
+        # 1. 模型配置 (YOLO 仅作演示，实际可替换为手语模型)
+        # 模型在启动后由后台线程加载并预热一次 (见 load / mark_ready)，所有会话共享
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        logger.info(f"🚀 Loading model on {self.device}...")
-        self.model = YOLO('yolov8n.pt') 
-        self.model.to(self.device)
-
-        # 2. [科研核心] 动态配置参数
-        # 这些参数现在可以通过前端或测试脚本动态修改，不用重启服务器
-        self.config = {
-            "chunk_size": 1,      # 默认单帧 (实时)
-            "stride": 1,          # 步长
-            "simulate_drift": 80   # 模拟额外耗时
+        self.weights = weights
+        self.imgsz = imgsz   # 模型输入边长，帧在 libav 中直接缩放到这个尺寸
+        # 推理后端: pytorch / onnx / onnx-int8 / openvino / torchscript (见 engines.py)，结果格式一致
+        engine_options = engine_options or {}
+        # 构造参数：进程模式的推理 worker 用它在子进程里创建同样的引擎 (见 worker_pool.py)
+        self.spec = {"engine": engine, "weights": weights, "imgsz": imgsz,
+                     "variants": list(variants), "engine_options": engine_options}
+        self.engine = create_engine(engine, weights, device=self.device, imgsz=imgsz, **engine_options)
+        # 额外加载的模型变体 (如 INT8 量化模型)，会话可以通过 config["engine"] 选择，或用于 A/B 对照
+        self.engines = {self.engine.kind: self.engine}
+        for kind in variants:
+            if kind and kind not in self.engines:
+                self.engines[kind] = create_engine(kind, weights, device=self.device, imgsz=imgsz, **engine_options)
+        self.models = {}
+        self.model = None
+        # A/B 对照的全局累计统计 (见 ABStats)
+        self.ab_stats = ABStats()
+        # 加载失败、被跳过的模型变体 {kind: error}
+        self.variant_errors = {}
+
+        # 就绪状态: idle -> loading -> warming -> ready / failed
+        self.state = "idle"
+        self.error = None
+        self.timings = {}
+        self._load_started = time.time()
+        self._ready = threading.Event()
+
+        # Ultralytics 的 predictor 内部有状态，多个线程同时调用同一个模型会互相踩踏：
+        # 推理线程池的每个 worker 持有自己的模型副本 (见 init_worker)，
+        # 其余线程 (同步 process / 预热) 共用主模型并加锁
+        self._model_lock = threading.Lock()
+        self._local = threading.local()
+
+        # 新会话的默认配置，update_config 只影响之后创建的会话
+        self.config = dict(DEFAULT_SESSION_CONFIG)
+
+    @property
+    def names(self):
+        return self.model.names
+
+    @property
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def load(self):
+        """加载主模型并预热 (阻塞，在后台线程中调用)。成功返回 True"""
+        start = self._load_started = time.time()
+        self.state = "loading"
+        logger.info(f"🚀 Loading {list(self.engines)} model(s) on {self.device}...")
+        try:
+            self.engine.prepare()
+            self.models[self.engine.kind] = self.engine.create_model()
+            self.model = self.models[self.engine.kind]
+        except Exception as e:
+            self.mark_failed(e)
+            return False
+        # 模型变体加载失败 (例如 onnx-int8 没有可用的校准帧) 只跳过这个变体，主引擎照常服务
+        for kind, engine in list(self.engines.items()):
+            if engine is self.engine:
+                continue
+            try:
+                engine.prepare()
+                self.models[kind] = engine.create_model()
+            except Exception as e:
+                logger.warning(f"⚠️ Engine variant {kind} unavailable, skipping: {e}")
+                del self.engines[kind]
+                self.variant_errors[kind] = str(e)
+                # spec 与推理 worker 子进程 / 视频预分析共享，子进程不再尝试加载这个变体
+                if kind in self.spec["variants"]:
+                    self.spec["variants"].remove(kind)
+        self.timings["load_ms"] = round((time.time() - start) * 1000, 1)
+
+        self.state = "warming"
+        warmup_start = time.time()
+        if not self.warmup():
+            self.mark_failed("warmup failed")
+            return False
+        self.timings["warmup_ms"] = round((time.time() - warmup_start) * 1000, 1)
+        return True
+
+    def mark_ready(self):
+        """所有预热步骤完成 (包括推理 worker)，之后新会话无需再等待"""
+        self.timings["total_ms"] = round((time.time() - self._load_started) * 1000, 1)
+        self.state = "ready"
+        self._ready.set()
+        logger.info(f"✅ AI Engine Ready! {self.timings}")
+
+    def mark_failed(self, error):
+        self.state = "failed"
+        self.error = str(error)
+        logger.error(f"❌ AI Engine failed to start: {error}")
+
+    async def wait_ready(self, poll_interval=0.05):
+        """会话启动时调用：引擎已就绪则立即返回，否则等待后台预热完成"""
+        while not self._ready.is_set():
+            if self.state == "failed":
+                raise RuntimeError(f"AI engine unavailable: {self.error}")
+            await asyncio.sleep(poll_interval)
+
+    def status(self):
+        """供 /health 和 /api/info 使用的引擎状态"""
+        return {
+            "state": self.state,
+            "ready": self.is_ready,
+            "device": self.device,
+            "weights": self.weights,
+            "imgsz": self.imgsz,
+            **self.engine.describe(),
+            "variants": {kind: engine.describe() for kind, engine in self.engines.items() if engine is not self.engine},
+            "variant_errors": dict(self.variant_errors),
+            "timings": dict(self.timings),
+            "error": self.error,
         }
-        
-        # 时序缓冲区
-        self.chunk_buffer = deque(maxlen=30) 
-        self.timestamp_buffer = deque(maxlen=30)
-        self.pts_buffer = deque(maxlen=30)
-        self.last_infer_time = 0
+
+    def create_session(self, session_id, config=None):
+        """为一路视频流创建独立的推理会话，只共享已加载的模型"""
+        session_config = dict(self.config)
+        if config:
+            session_config.update(config)
+        return AISession(self, session_id, session_config)
 
     def update_config(self, new_config):
-        """供测试脚本动态调整实验参数"""
+        """修改新会话的默认实验参数 (已存在的会话请调用 AISession.update_config)"""
         self.config.update(new_config)
-        # 重置缓冲区以适应新配置
-        self.chunk_buffer.clear()
-        self.timestamp_buffer.clear()
-        self.pts_buffer.clear()
-        logger.info(f"🧪 实验参数更新: {self.config}")
+        logger.info(f"🧪 默认实验参数更新: {self.config}")
+
+    def has_engine(self, kind):
+        return kind in self.engines
+
+    def init_worker(self):
+        """推理线程池的 initializer：为当前 worker 线程加载每个模型变体的独立副本并预热"""
+        dummy = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        models = {}
+        for kind, engine in self.engines.items():
+            models[kind] = engine.create_model()
+            engine.predict(models[kind], dummy)
+        self._local.models = models
+        logger.info(f"🧵 Inference worker {threading.current_thread().name} ready")
+
+    def engine_for(self, kind=None):
+        return self.engines[kind or self.engine.kind]
+
+    def infer(self, img, engine=None, imgsz=None):
+        """
+        线程安全的推理入口，img 可以是单帧，也可以是多帧 list (一次 batch 前向)。
+        engine 为模型变体名称，None 表示默认引擎；imgsz 为 None 时使用全局输入尺寸。
+        """
+        kind = engine or self.engine.kind
+        runner = self.engines[kind]
+        model = getattr(self._local, "models", {}).get(kind)
+        if model is not None:
+            return runner.predict(model, img, imgsz)
+        with self._model_lock:
+            return runner.predict(self.models[kind], img, imgsz)
+
+    def detect(self, images, engine=None, imgsz=None):
+        """批量推理并返回每帧的 (N, 6) 检测数组 (见 extract_detections)"""
+        # 静态形状的引擎 (如 TorchScript) 不支持任意 batch，按 max_batch 拆分
+        step = self.engines[engine or self.engine.kind].max_batch or max(1, len(images))
+        dets = []
+        for i in range(0, len(images), step):
+            dets.extend(extract_detections(result) for result in self.infer(images[i:i + step], engine, imgsz))
+        return dets
+
+    def detect_timed(self, images, engine=None, imgsz=None):
+        """detect 并返回 (dets, infer_start, infer_end)"""
+        infer_start = time.time()
+        dets = self.detect(images, engine, imgsz)
+        return dets, infer_start, time.time()
+
+    def run_groups(self, groups):
+        """
+        推理 worker 的入口：groups 为 [(engine, imgsz, images), ...]，每组一次 batch 前向。
+        返回每组的 (dets 列表, infer_start, infer_end)。只使用可以 pickle 的参数，线程/进程 worker 通用。
+        """
+        return [self.detect_timed(images, engine, imgsz) for engine, imgsz, images in groups]
 
     def warmup(self):
         """
@@ -51,83 +267,494 @@ class AIProcessor:
         logger.info(f"🔥 AI Engine Warming up on {self.device}...")
         try:
             # 创建一个 640x640 的全黑 dummy frame
-            dummy_input = np.zeros((640, 640, 3), dtype=np.uint8)
-            # 执行一次推理 (这次会很慢)
-            self.model(dummy_input, verbose=False)
-            logger.info("✅ AI Engine Ready! (Warmup completed)")
+            dummy_input = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+            # 每个模型变体执行一次推理 (这次会很慢)
+            for kind in self.engines:
+                self.infer(dummy_input, kind)
+            logger.info("✅ AI Engine warmed up")
         except Exception as e:
             logger.error(f"❌ Warmup failed: {e}")
             return False
         return True
 
-    def _apply_simulated_delay(self):
-        """在推理后注入额外延迟，便于模拟高负载场景"""
-        simulate_delay_ms = max(0, self.config.get("simulate_drift", 0))
-        if simulate_delay_ms:
-            time.sleep(simulate_delay_ms / 1000.0)
-        return simulate_delay_ms
+
+EMPTY_DETECTIONS = np.zeros((0, 6), dtype=np.float32)
+
+
+def extract_detections(result):
+    """
+    把一帧的 Ultralytics Results 一次性搬到 numpy。
+    返回 (N, 6) float32 数组：[x1, y1, x2, y2, conf, cls] (模型输入坐标)。
+    """
+    if result is None or result.boxes is None:
+        return EMPTY_DETECTIONS
+    data = result.boxes.data
+    data = data.cpu().numpy() if hasattr(data, "cpu") else np.asarray(data)
+    if data.shape[1] == 7:
+        # 带 track id 的格式: [x1, y1, x2, y2, id, conf, cls]
+        data = data[:, [0, 1, 2, 3, 5, 6]]
+    return data.astype(np.float32, copy=False)
+
+
+def build_objects(dets, names, scale_x=1.0, scale_y=1.0, track_ids=None):
+    """
+    由 (N, 6) 检测数组构建 ai_result 的 objects 列表 (坐标映射回原始分辨率)。
+    给出 track_ids 时每个 object 附带 track_id。返回 (objects, mean_confidence)。
+    """
+    if len(dets) == 0:
+        return [], 0.0
+    boxes = (dets[:, :4] * np.array([scale_x, scale_y, scale_x, scale_y], dtype=np.float32)).astype(int).tolist()
+    confs = np.round(dets[:, 4].astype(np.float64), 2).tolist()
+    classes = dets[:, 5].astype(int).tolist()
+    objects = [
+        {"label": names[c], "bbox": b, "confidence": conf}
+        for b, conf, c in zip(boxes, confs, classes)
+    ]
+    if track_ids is not None:
+        for obj, track_id in zip(objects, track_ids):
+            obj["track_id"] = track_id
+    return objects, float(dets[:, 4].mean())
+
+
+def detection_agreement(dets_a, dets_b, iou_threshold=0.5):
+    """A 的检测框中，能在 B 里找到同类且 IoU >= iou_threshold 的框所占的比例 (A 为空时为 1)"""
+    if len(dets_a) == 0:
+        return 1.0 if len(dets_b) == 0 else 0.0
+    if len(dets_b) == 0:
+        return 0.0
+    ious = box_iou(dets_a[:, :4], dets_b[:, :4])
+    ious[dets_a[:, 5][:, None] != dets_b[:, 5][None, :]] = 0
+    return float((ious.max(axis=1) >= iou_threshold).mean())
+
+
+class ABStats:
+    """A/B 对照的累计统计：按 (engine_a, engine_b) 汇总 B 相对 A 的平均差值"""
+    FIELDS = ("inference_time_delta", "mean_confidence_delta", "objects_delta", "agreement")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pairs = {}
+
+    def add(self, ab):
+        key = (ab["engine_a"], ab["engine_b"])
+        with self._lock:
+            totals = self._pairs.setdefault(key, dict.fromkeys(("frames",) + self.FIELDS, 0.0))
+            totals["frames"] += 1
+            for field in self.FIELDS:
+                totals[field] += ab[field]
+
+    def summary(self):
+        with self._lock:
+            return {
+                f"{a}_vs_{b}": {
+                    "frames": int(totals["frames"]),
+                    **{f"avg_{field}": round(totals[field] / totals["frames"], 4) for field in self.FIELDS},
+                }
+                for (a, b), totals in self._pairs.items()
+            }
+
+
+def model_input_size(width, height, imgsz):
+    """保持宽高比，把长边缩放到 imgsz (不放大)，返回 (w, h)"""
+    scale = min(imgsz / width, imgsz / height, 1.0)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class InferenceRequest:
+    """
+    会话交给调度器的一次推理请求。
+    image 已经是模型尺寸；scale_x/scale_y 把模型坐标映射回原始分辨率 (像素)。
+    engine 为本帧使用的模型变体 (None 表示默认引擎)；设置了 ab_engine 时，
+    推理端会把对照引擎的 (dets, infer_start, infer_end, group_size) 写入 ab_result；
+    group_size 为本请求的图像所在那一组前向的图像数 (跨会话合并)，A/B 耗时按每张图比较。
+    reused 为 True 表示画面静止，不需要推理，直接复用会话上一次的检测结果。
+    ROI 模式下 crop_images / crop_offsets 为裁剪区域及其在 image 中的左上角，推理的是裁剪区域而不是整帧。
+    窗口推理时 chunk_images 为按时间顺序排列的多帧 (最后一帧即 image)，结果按 temporal 聚合到最新一帧。
+    """
+    __slots__ = ("session_id", "image", "pts", "time_base", "frame_id", "chunk_arrival_time",
+                 "src_size", "scale_x", "scale_y", "engine", "ab_engine", "ab_result", "imgsz",
+                 "thumbnail", "reused", "crop_images", "crop_offsets", "roi_expected",
+                 "chunk_images", "temporal", "group_size")
+
+    def __init__(self, session_id, image, pts, time_base, frame_id, chunk_arrival_time, src_size,
+                 engine=None, ab_engine=None, imgsz=None):
+        self.session_id = session_id
+        self.image = image
+        self.pts = pts
+        self.time_base = time_base
+        self.frame_id = frame_id
+        self.chunk_arrival_time = chunk_arrival_time
+        self.src_size = src_size
+        self.scale_x = src_size[0] / image.shape[1]
+        self.scale_y = src_size[1] / image.shape[0]
+        self.engine = engine
+        self.ab_engine = ab_engine
+        self.ab_result = None
+        self.imgsz = imgsz
+        self.thumbnail = None
+        self.reused = False
+        self.crop_images = None
+        self.crop_offsets = None
+        self.roi_expected = 0
+        self.chunk_images = None
+        self.temporal = None
+        self.group_size = 1
+
+    @property
+    def images(self):
+        """需要送进模型的图像：整帧，ROI 模式下的各个裁剪区域，或窗口推理时窗口里的多帧"""
+        if self.crop_offsets is not None:
+            return self.crop_images
+        if self.chunk_images is not None:
+            return self.chunk_images
+        return [self.image]
+
+    def combine(self, dets_list):
+        """把 images 各自的检测结果合并成整帧 (image) 坐标下的一个 (N, 6) 数组"""
+        if self.crop_offsets is not None:
+            return merge_crop_detections(dets_list, self.crop_offsets)
+        if self.chunk_images is not None:
+            return temporal_fuse(dets_list, **self.temporal)
+        return dets_list[0]
+
+
+class AISession:
+    """
+    单个 Peer 的推理会话：持有该路视频独立的时序缓冲区、帧计数、实验配置和 FPS 统计。
+    一个会话只会被它自己的 process_ai_track 协程驱动。
+    """
+    def __init__(self, processor, session_id, config):
+        self.processor = processor
+        self.session_id = session_id
+        self.config = config
+        self.frame_count = 0
+        self.skipped_frames = 0   # 收到但没有进入推理管线的帧 (跳帧/限流)
+        self.last_convert_time = None   # 最近一次 ingest 中 bgr24 转换的耗时 (秒)，静态画面跳过转换时为 None
+        # 已提交给调度器、还没有返回的检测请求数 (由 process_ai_track 维护)。
+        # 有检测在途时不复用结果：复用结果会比更早的帧的检测结果先发出，前端看到的框会倒退
+        self.detections_in_flight = 0
+
+        # 时序缓冲区：预分配的环形缓冲区，容量 = chunk_size (帧 + 到达时间 + PTS)
+        self.frames = FrameRingBuffer(self.config['chunk_size'])
+        self.frames_since_infer = 0   # 上次推理后新进入窗口的帧数 (滑动窗口步长计数)
+        self.last_infer_time = 0
+
+        # update_config 来自事件循环线程，process 运行在线程池中：
+        # 新配置先暂存，由 process 在处理下一帧前应用，避免事件循环等待推理
+        self._lock = threading.Lock()
+        self._pending_config = None
+
+        # 发送端故障注入 (config["fault_injection"] 打开时才会使用)
+        self.faults = FaultInjector()
+
+        # 闭环自适应控制器 (config["adaptive"] 打开后在第一个结果时创建)
+        self.controller = None
+        # 多目标跟踪器：检测结果更新轨迹，两次检测之间外推 (只在事件循环线程中使用)
+        self.tracker = MultiObjectTracker()
+        # 断流重置和配置更新发生在入队线程中，只在这里记下，由事件循环在下次使用跟踪器前清空轨迹
+        self._tracker_reset = False
+
+        # 静态画面门控：上一次真正推理的检测结果 (dets, scale_x, scale_y) 和参考缩略图
+        self.motion_gate = MotionGate()
+        self.reused_frames = 0
+        self._last_detection = None
+
+        # ROI 模式：上一次整帧推理的时间，以及裁剪推理是否丢失了目标 (下一次强制整帧)
+        self._last_full_pass = 0.0
+        self._roi_lost = False
+
+    def _reset_buffers(self):
+        self.frames.clear()
+        self.frames_since_infer = 0
+        self._tracker_reset = True
+
+    def reset_tracking(self):
+        """清空所有轨迹 (只能在事件循环线程中调用，例如新的流开始时)"""
+        self._tracker_reset = False
+        self.tracker.reset()
+
+    def _sync_tracker(self):
+        if self._tracker_reset:
+            self.reset_tracking()
+
+    def update_config(self, new_config):
+        """供测试脚本动态调整实验参数 (只影响本会话)"""
+        with self._lock:
+            if self._pending_config is None:
+                self._pending_config = {}
+            self._pending_config.update(new_config)
+        logger.info(f"🧪 [{self.session_id}] 实验参数更新: {new_config}")
+
+    def _apply_pending_config(self):
+        with self._lock:
+            pending, self._pending_config = self._pending_config, None
+        if pending:
+            self.config.update(pending)
+            # 重置缓冲区以适应新配置
+            self.frames.set_capacity(self.config['chunk_size'])
+            self.frames_since_infer = 0
+            # 关闭自适应或切换引擎后恢复原始参数，重新开始控制
+            if not self.config.get("adaptive") or "engine" in pending:
+                self.controller = None
+            elif self.controller is not None and "latency_slo_ms" in pending:
+                self.controller.set_slo(self.config["latency_slo_ms"])
+            self.motion_gate.area_threshold = self.config.get("motion_threshold", 0.01)
+            self.motion_gate.refresh_interval = self.config.get("motion_refresh_s", 2.0)
+            # 换了模型后旧的检测结果不能再复用
+            if "engine" in pending or "imgsz" in pending:
+                self._last_detection = None
+                self.motion_gate.reset()
+            # 换了模型或重新打开跟踪：旧轨迹的速度和 ID 不再可信
+            if "engine" in pending or "tracking" in pending:
+                self._tracker_reset = True
+
+    def param(self, key):
+        """
+        读取实际生效的参数。自适应控制器的覆盖只会让质量更低：
+        stride 取较大值，imgsz / max_fps 取较小值 (max_fps 为 0 表示不限)。
+        """
+        value = self.config.get(key)
+        if key == "imgsz":
+            value = value or self.processor.imgsz
+        controller = self.controller
+        override = controller.overrides.get(key) if controller is not None else None
+        if override is None:
+            return value
+        if key == "stride":
+            return max(value, override)
+        return min(value, override) if value else override
+
+    def model_imgsz(self, engine=None):
+        """本会话当前的模型输入边长 (静态形状的引擎固定为全局 imgsz)"""
+        if not self.processor.engine_for(engine).dynamic:
+            return self.processor.imgsz
+        return self.param("imgsz")
+
+    def _resolve_engine(self, key):
+        """读取会话选择的模型变体，未加载的变体回退到默认引擎并只警告一次"""
+        kind = self.config.get(key)
+        if kind and not self.processor.has_engine(kind):
+            logger.warning(f"⚠️ [{self.session_id}] {key}={kind} is not loaded (AI_ENGINE_VARIANTS), using default")
+            self.config[key] = kind = None
+        return kind
 
     def process(self, frame, pts, time_base):
         """
+        同步处理一帧 (不经过批处理调度器，供脚本/单路调试使用)
         1. 输入增加了 pts (RTP时间戳) 和 time_base (时间基准)
         2. 维护两套时间轴：SystemTime 用于计算性能延迟，PTS 用于前端视觉同步
         3. 增加了 '熔断机制' 应对网络丢包
         """
+        request = self.ingest(frame, pts, time_base)
+        if request is None:
+            return None
+        if request.reused:
+            now = time.time()
+            return self.finalize(request, None, now, now)
+
+        dets, infer_start, infer_end = self.processor.detect_timed(request.images, request.engine, request.imgsz)
+        dets = [request.combine(dets)]
+        request.group_size = len(request.images)
+        if request.ab_engine:
+            dets_b, b_start, b_end = self.processor.detect_timed([request.image], request.ab_engine, request.imgsz)
+            request.ab_result = (dets_b[0], b_start, b_end, 1)
+        return self.finalize(request, dets[0], infer_start, infer_end)
+
+    def ingest(self, frame, pts, time_base):
+        """
+        帧入队 + Chunking 判断。需要推理时返回 InferenceRequest，否则返回 None。
+        推理本身交给调度器 (可能与其他会话的帧合并成一个 batch)。
+        """
+        self._apply_pending_config()
+
         # --- 1. 完整性检查 (熔断机制) ---
         # 如果当前帧和上一帧的 PTS 差值过大（例如超过 0.5秒），说明中间发生了严重丢包或卡顿
         # 此时必须清空缓冲区
-        if len(self.pts_buffer) > 0:
+        if len(self.frames) > 0:
             # 90000 是常见的视频时钟频率，0.5秒约等于 45000
             # 这里的阈值可以根据实际 fps 调整，比如 fps=30，帧间隔 3000，阈值设为 15000 (5帧丢包)
-            time_gap = pts - self.pts_buffer[-1]
-            if time_gap > 45000: 
-                logger.warning(f"⚠️ [Flow Break] 检测到时间断层 ({time_gap} ticks), 重置 Chunk")
-                self.chunk_buffer.clear()
-                self.timestamp_buffer.clear()
-                self.pts_buffer.clear()
-
-        # --- 2. 数据入队 ---
-        try:
-            img = frame.to_ndarray(format="bgr24")
-        except Exception as e:
-            logger.error(f"Frame conversion failed: {e}")
-            return None
-        
-        self.chunk_buffer.append(img)
-        self.timestamp_buffer.append(time.time()) # System Time: 用于计算 D_an (延迟)
-        self.pts_buffer.append(pts)               # RTP PTS: 用于前端 <video> 同步
-        
+            time_gap = pts - self.frames.last_pts
+            if time_gap > 45000:
+                logger.warning(f"⚠️ [Flow Break] [{self.session_id}] 检测到时间断层 ({time_gap} ticks), 重置 Chunk")
+                self._reset_buffers()
+
+        # --- 2. 静态画面门控 ---
+        # 先在 libav 中生成一张很小的灰度缩略图，与上一次推理的帧比较；
+        # 画面没有变化时跳过完整的 bgr24 转换，窗口里重复上一帧，推理时机到了直接复用上次的结果
+        arrival_time = time.time()
+        thumb = None
+        static = False
+        if self.config.get("motion_gate"):
+            try:
+                thumb = self.motion_gate.thumbnail(frame)
+                static = (self._last_detection is not None and len(self.frames) > 0
+                          and not self.motion_gate.changed(thumb, arrival_time))
+            except Exception as e:
+                logger.error(f"Thumbnail conversion failed: {e}")
+
+        # --- 3. 数据入队 ---
+        # 在 libav (swscale) 中一次完成缩放 + 转 bgr24，直接得到模型尺寸的帧：
+        # 720p 帧不再先生成全分辨率 ndarray 再由 Ultralytics 二次缩放
+        src_size = (frame.width, frame.height)
+        engine = self._resolve_engine("engine")
+        imgsz = self.model_imgsz(engine)
+        self.last_convert_time = None
+        if static:
+            img = self.frames.latest()[0]
+        else:
+            dst_w, dst_h = model_input_size(frame.width, frame.height, imgsz)
+            convert_start = time.perf_counter()
+            try:
+                img = frame.to_ndarray(width=dst_w, height=dst_h, format="bgr24")
+            except Exception as e:
+                logger.error(f"Frame conversion failed: {e}")
+                return None
+            self.last_convert_time = time.perf_counter() - convert_start
+
+        # System Time: 用于计算 D_an (延迟)；RTP PTS: 用于前端 <video> 同步
+        self.frames.append(img, arrival_time, pts)
+
         self.frame_count += 1
-        
-        # --- 3. Chunking 策略 ---
+        self.frames_since_infer += 1
+
+        # --- 4. Chunking 策略 (滑动窗口) ---
+        # 窗口始终是最近 chunk_size 帧；窗口填满后，每进入 stride 个新帧推理一次，
+        # 相邻两次推理的窗口重叠 chunk_size - stride 帧
         target_size = self.config['chunk_size']
-        stride = self.config['stride']
-        
-        should_infer = (len(self.chunk_buffer) >= target_size) and \
-                       (self.frame_count % stride == 0)
-        
-        if not should_infer:
-            return None 
+        stride = max(1, self.param('stride'))
 
-        # --- 4. 开始推理 ---
+        should_infer = (len(self.frames) >= target_size) and \
+                       (self.frames_since_infer >= stride)
 
-        # *模拟网络抖动
-        jitter = random.uniform(0.03, 0.1) 
-        time.sleep(jitter)
+        if not should_infer:
+            return None
 
+        if static:
+            if self.detections_in_flight > 0:
+                # 等在途的检测返回 (它的结果就是这个静止画面的检测结果)，这一次什么都不发
+                return None
+            self.frames_since_infer = 0
+            return self._reuse_request(time_base, target_size, src_size, imgsz)
 
-        infer_start = time.time()
-        
         # 选取最具代表性的一帧 (通常是 Chunk 的最后一帧，也就是最新的一帧)
-        target_img = self.chunk_buffer[-1] 
-        target_pts = self.pts_buffer[-1]     # <--- 关键：这是这帧画面的"身份证"
-        
-        results = self.model(target_img, verbose=False)
+        # 缓冲区保存的是 to_ndarray 返回的数组本身，不会被原地覆盖，直接交给调度器，不再拷贝
+        ab_engine = self._resolve_engine("ab_engine")
+        if ab_engine == (engine or self.processor.engine.kind):
+            ab_engine = None   # 与自己对照没有意义
 
-        # !人为注入额外延迟，用于模拟高负载/高延迟场景
-        # self._apply_simulated_delay()
-        
-        infer_end = time.time()
+        target_img, _, target_pts = self.frames.latest()
+        request = InferenceRequest(
+            session_id=self.session_id,
+            image=target_img,
+            pts=target_pts,                   # <--- 关键：这是这帧画面的"身份证"
+            time_base=time_base,
+            frame_id=self.frame_count,
+            chunk_arrival_time=self.frames.oldest_timestamp(target_size),
+            src_size=src_size,
+            engine=engine,
+            ab_engine=ab_engine,
+            imgsz=imgsz,
+        )
+        request.thumbnail = thumb
+        if self.config.get("roi_mode"):
+            self._plan_roi(request, arrival_time)
+        if request.crop_offsets is None and target_size > 1 and self.config.get("chunk_mode", "last") != "last":
+            self._plan_chunk(request, target_size)
+
+        # 推理完成后窗口不清空，只重置步长计数，下一个窗口在此基础上滑动 stride 帧
+        self.frames_since_infer = 0
+        return request
+
+    def _plan_roi(self, request, now):
+        """
+        ROI 模式：决定这一帧做整帧推理还是裁剪推理。
+        上一次的检测框 (映射到当前帧的模型坐标) 外扩后作为裁剪区域，以 roi_imgsz 推理。
+        以下情况做整帧推理：距上次整帧超过 roi_full_interval、上一次裁剪推理丢失了目标、
+        没有可用的检测结果、区域太多/太大、或引擎不支持动态输入尺寸。
+        """
+        last = self._last_detection
+        full = (
+            last is None or len(last[0]) == 0 or self._roi_lost
+            or now - self._last_full_pass >= self.config.get("roi_full_interval", 1.0)
+            or not self.processor.engine_for(request.engine).dynamic
+        )
+        regions = None
+        if not full:
+            dets, scale_x, scale_y = last
+            ratio = np.array([scale_x / request.scale_x, scale_y / request.scale_y] * 2, dtype=np.float32)
+            height, width = request.image.shape[:2]
+            regions = roi_regions(
+                dets[:, :4] * ratio, width, height,
+                padding=self.config.get("roi_padding", 0.25),
+                max_regions=self.config.get("roi_max_regions", 4),
+            )
+        if regions is None:
+            self._last_full_pass = now
+            self._roi_lost = False
+            return
+
+        # 裁剪区域是 request.image 的视图，不再额外复制
+        request.crop_offsets = [(x0, y0) for x0, y0, _, _ in regions]
+        request.crop_images = [request.image[y0:y1, x0:x1] for x0, y0, x1, y1 in regions]
+        request.imgsz = min(self.config.get("roi_imgsz", 320), request.imgsz or self.processor.imgsz)
+        request.roi_expected = len(last[0])
+        request.ab_engine = None   # A/B 对照只在整帧推理上进行
+
+    def _plan_chunk(self, request, target_size):
+        """
+        窗口推理：把窗口里的多帧 (全部或均匀抽样，始终包含最新帧) 作为一个 batch 推理，
+        检测结果在 combine 时按 temporal_fusion 聚合到最新一帧上。
+        """
+        window, _, _ = self.frames.window(target_size)
+        if self.config.get("chunk_mode") == "subsample":
+            samples = max(1, min(int(self.config.get("chunk_samples", 4)), target_size))
+            # 从最新帧往回等间隔取样，再按时间顺序排列
+            index = np.unique(np.round(np.linspace(target_size - 1, 0, samples)).astype(int))
+            window = [window[i] for i in index]
+        if len(window) < 2:
+            return
+        # 窗口里的帧都是引用 (见 FrameRingBuffer)，不复制像素
+        request.chunk_images = window
+        request.image = request.chunk_images[-1]
+        request.temporal = {
+            "mode": self.config.get("temporal_fusion", "vote"),
+            "iou_threshold": self.config.get("temporal_iou", 0.5),
+            "min_votes": self.config.get("temporal_min_votes", 0.5),
+        }
+
+    def _reuse_request(self, time_base, target_size, src_size, imgsz):
+        """静态画面：构造一个不需要推理的请求，finalize 时复用上一次的检测结果"""
+        target_img, _, target_pts = self.frames.latest()
+        request = InferenceRequest(
+            session_id=self.session_id,
+            image=target_img,
+            pts=target_pts,
+            time_base=time_base,
+            frame_id=self.frame_count,
+            chunk_arrival_time=self.frames.oldest_timestamp(target_size),
+            src_size=src_size,
+            imgsz=imgsz,
+        )
+        _, request.scale_x, request.scale_y = self._last_detection
+        request.reused = True
+        self.reused_frames += 1
+        return request
+
+    def finalize(self, request, dets, infer_start, infer_end, batch_size=1):
+        """
+        把一帧的检测数组 (见 extract_detections) 转换为 ai_result 消息。
+        request.reused 为 True 时 dets 被忽略，复用上一次的检测结果。
+        """
+        if request.reused:
+            dets = self._last_detection[0]
+            batch_size = 0
+        else:
+            # 记住这次的结果和缩略图，后续静止的帧与它比较、复用它
+            self._last_detection = (dets, request.scale_x, request.scale_y)
+            self.motion_gate.mark_inferred(request.thumbnail, infer_end)
+            # 裁剪推理找到的目标比上一次少：认为有目标丢失，下一帧做整帧推理
+            if request.crop_offsets is not None and len(dets) < request.roi_expected:
+                self._roi_lost = True
 
         fps = 0
         if self.last_infer_time > 0:
@@ -135,56 +762,139 @@ class AIProcessor:
             if delta > 0:
                 fps = 1.0 / delta
         self.last_infer_time = infer_end
-        
+
         # --- 5. 科研指标计算 ---
         # D_an: 从 Chunk 第一帧到达服务器(SystemTime) 到 推理结束(SystemTime)
         # 这代表了用户感知的"服务器处理总耗时" (含排队等待时间)
-        chunk_arrival_time = self.timestamp_buffer[0]
+        chunk_arrival_time = request.chunk_arrival_time
         d_an = (infer_end - chunk_arrival_time) * 1000
-        
-        # 收集结果
-        detections = []
-        mean_conf = 0
-        if results:
-            for box in results[0].boxes:
-                conf = float(box.conf[0].cpu().numpy())
-                mean_conf += conf
-                detections.append({
-                    "label": self.model.names[int(box.cls[0])],
-                    "bbox": box.xyxy[0].cpu().numpy().astype(int).tolist(),
-                    "confidence": round(conf, 2)
-                })
-            if len(results[0].boxes) > 0:
-                mean_conf /= len(results[0].boxes)
-
-        # 推理完成后，根据 Stride 滑动窗口
-        # 如果是实时性优先，通常推理完就清空，或者只保留后半部分
-        # 这里演示简单清空
-        self.chunk_buffer.clear()
-        self.timestamp_buffer.clear()
-        self.pts_buffer.clear()
 
+        # 跟踪：在原始分辨率坐标系中匹配轨迹 (自适应调整 imgsz 时 ID 依然连续)
+        track_ids = None
+        self._sync_tracker()
+        if self.config.get("tracking", True):
+            scale = np.array([request.scale_x, request.scale_y, request.scale_x, request.scale_y])
+            track_ids = self.tracker.update(
+                dets[:, :4] * scale, dets[:, 4], dets[:, 5], float(request.pts * request.time_base)
+            )
 
+        # 收集结果 (模型坐标 -> 原始分辨率像素坐标)
+        detections, mean_conf = build_objects(
+            dets, self.processor.names, request.scale_x, request.scale_y, track_ids
+        )
 
-
-        return {
+        time_base = request.time_base
+        result = {
             "type": "ai_result",
-            "frame_id": self.frame_count,      # 仅供调试用的计数器
+            "source": "detector",              # 检测器结果 (跟踪器外推的结果为 "tracker")
+            "frame_id": request.frame_id,      # 仅供调试用的计数器
 
-            "pts": target_pts,                 # 1. 视频身份证 (用于画框同步)
+            "pts": request.pts,                # 1. 视频身份证 (用于画框同步)
             "send_time": infer_end * 1000,     # 2. 发送时间戳 (毫秒，用于前端算延迟)
-            
+
             # --- [严谨同步的核心] ---
-            "timestamp": target_pts,           # RTP PTS (例如 23481902)
+            "timestamp": request.pts,          # RTP PTS (例如 23481902)
             "time_base_num": time_base.numerator,
             "time_base_den": time_base.denominator,
-            
+            "frame_width": request.src_size[0],  # bbox 所在的原始分辨率
+            "frame_height": request.src_size[1],
+
             # --- [科研数据] ---
             "d_an": round(d_an, 2),            # 全链路服务器延迟
             "mean_confidence": round(mean_conf, 4),
             "fps": round(fps, 1),              # 3. 补全 FPS
             "inference_time": round((infer_end - infer_start) * 1000, 2),
             "process_time": round((infer_end - chunk_arrival_time) * 1000, 2), # 总处理耗时
+            "batch_size": batch_size,          # 与本帧合并推理的帧数 (跨会话)
+            "reused": request.reused,          # 画面静止，复用了上一次的检测结果 (没有推理)
+            "reused_frames": self.reused_frames,
             "objects": detections
-            
-        }
\ No newline at end of file
+
+        }
+
+        # A/B 对照：同一帧上对照引擎 (B) 相对当前引擎 (A) 的差异
+        if request.ab_result is not None:
+            result["ab"] = self._compare_ab(request, dets, infer_end - infer_start, mean_conf)
+
+        if self.config.get("roi_mode"):
+            result["roi"] = {
+                "mode": "crop" if request.crop_offsets is not None else "full",
+                "regions": len(request.crop_offsets) if request.crop_offsets is not None else 0,
+                "imgsz": request.imgsz,
+            }
+
+        if request.chunk_images is not None:
+            result["temporal"] = {"mode": request.temporal["mode"], "frames": len(request.chunk_images)}
+
+        # 闭环自适应：每次调整都记录在 adaptive.change 里
+        if self.config.get("adaptive") and not request.reused:
+            result["adaptive"] = self._adapt(result, request)
+        return result
+
+    def track_fill(self, pts, time_base, src_size, arrival_time):
+        """
+        检测器两次调用之间的补帧：把跟踪器里的目标外推到这一帧的 PTS。
+        没有可显示的目标时返回 None。结果格式与检测结果一致，source 为 "tracker"。
+        """
+        self._sync_tracker()
+        boxes, confs, classes, track_ids = self.tracker.predict(float(pts * time_base))
+        if not track_ids:
+            return None
+        width, height = src_size
+        boxes = np.clip(boxes, 0, [width, height, width, height]).astype(int).tolist()
+        names = self.processor.names
+        objects = [
+            {"label": names[c], "bbox": b, "confidence": round(conf, 2), "track_id": track_id}
+            for b, conf, c, track_id in zip(boxes, confs, classes, track_ids)
+        ]
+        now = time.time()
+        return {
+            "type": "ai_result",
+            "source": "tracker",
+            "frame_id": self.frame_count,
+            "pts": pts,
+            "send_time": now * 1000,
+            "timestamp": pts,
+            "time_base_num": time_base.numerator,
+            "time_base_den": time_base.denominator,
+            "frame_width": width,
+            "frame_height": height,
+            "d_an": round((now - arrival_time) * 1000, 2),
+            "mean_confidence": round(float(np.mean(confs)), 4),
+            "inference_time": 0,
+            "objects": objects,
+        }
+
+    def _adapt(self, result, request):
+        controller = self.controller
+        if controller is None:
+            controller = self.controller = AdaptiveController(
+                slo_ms=self.config.get("latency_slo_ms", 250),
+                allow_imgsz=self.processor.engine_for(request.engine).dynamic,
+            )
+        state = controller.observe(result["d_an"], result["inference_time"])
+        state["imgsz"] = request.imgsz
+        state["stride"] = self.param("stride")
+        state["max_fps"] = self.param("max_fps")
+        return state
+
+    def _compare_ab(self, request, dets, infer_seconds, mean_conf):
+        dets_b, b_start, b_end, group_size_b = request.ab_result
+        mean_conf_b = float(dets_b[:, 4].mean()) if len(dets_b) else 0.0
+        # A 的前向通常包含所有会话的帧，B 的只有 A/B 请求：两边都换算成每张图的耗时再比较
+        time_a = infer_seconds * 1000 / max(1, request.group_size)
+        time_b = (b_end - b_start) * 1000 / max(1, group_size_b)
+        ab = {
+            "engine_a": request.engine or self.processor.engine.kind,
+            "engine_b": request.ab_engine,
+            "inference_time_a": round(time_a, 2),     # 每张图的耗时 (组耗时 / 组内图像数)
+            "inference_time_b": round(time_b, 2),
+            "inference_time_delta": round(time_b - time_a, 2),   # B - A，负数表示 B 更快
+            "mean_confidence_b": round(mean_conf_b, 4),
+            "mean_confidence_delta": round(mean_conf_b - mean_conf, 4),
+            "objects_b": len(dets_b),
+            "objects_delta": len(dets_b) - len(dets),
+            "agreement": round(detection_agreement(dets, dets_b), 4),  # A 的框在 B 中找到匹配的比例
+        }
+        self.processor.ab_stats.add(ab)
+        return ab
@@ -0,0 +1,157 @@
+# backend/box_ops.py
+# 检测框的向量化工具函数 (numpy)，框格式统一为 xyxy
+import numpy as np
+
+
+def box_area(boxes):
+    boxes = np.asarray(boxes, dtype=np.float32)
+    return np.clip(boxes[..., 2] - boxes[..., 0], 0, None) * np.clip(boxes[..., 3] - boxes[..., 1], 0, None)
+
+
+def box_iou(a, b):
+    """两组框两两之间的 IoU，a: (N, 4)，b: (M, 4)，返回 (N, M)"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    wh = np.clip(rb - lt, 0, None)
+    inter = wh[..., 0] * wh[..., 1]
+    union = box_area(a)[:, None] + box_area(b)[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def nms(boxes, scores, iou_threshold=0.5):
+    """贪心 NMS，返回保留的下标 (按分数从高到低)"""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    order = np.argsort(-np.asarray(scores))
+    keep = []
+    while len(order):
+        i = order[0]
+        keep.append(i)
+        if len(order) == 1:
+            break
+        ious = box_iou(boxes[i:i + 1], boxes[order[1:]])[0]
+        order = order[1:][ious < iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def merge_crop_detections(dets_list, offsets, iou_threshold=0.5):
+    """
+    把多个裁剪区域的 (N, 6) 检测结果平移回整帧坐标并合并。
+    相邻区域重叠处的重复框用按类别的 NMS 去掉。
+    """
+    shifted = []
+    for dets, (x0, y0) in zip(dets_list, offsets):
+        if len(dets):
+            dets = dets.copy()
+            dets[:, [0, 2]] += x0
+            dets[:, [1, 3]] += y0
+            shifted.append(dets)
+    if not shifted:
+        return np.zeros((0, 6), dtype=np.float32)
+    dets = np.concatenate(shifted)
+    if len(shifted) == 1:
+        return dets
+    # 按类别偏移坐标，一次 NMS 完成分类别去重
+    class_offset = dets[:, 5:6] * (dets[:, :4].max() + 1)
+    keep = nms(dets[:, :4] + class_offset, dets[:, 4], iou_threshold)
+    return dets[keep]
+
+
+def roi_regions(boxes, width, height, padding=0.25, min_size=64, max_regions=4, max_coverage=0.6):
+    """
+    由上一帧的检测框生成裁剪区域：每个框向外扩 padding (相对框的长边)，
+    相交的区域合并成一个外接框。区域过多或合计面积超过整帧的 max_coverage 时返回 None，
+    此时裁剪推理不再划算，应直接做整帧推理。返回 [(x0, y0, x1, y1), ...] 整数像素坐标。
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if len(boxes) == 0:
+        return None
+    pad = np.maximum(boxes[:, 2:] - boxes[:, :2], 0).max(axis=1, keepdims=True) * padding
+    regions = np.concatenate([boxes[:, :2] - pad, boxes[:, 2:] + pad], axis=1)
+    # 保证最小尺寸 (以中心为准向外扩)
+    center = (regions[:, :2] + regions[:, 2:]) / 2
+    half = np.maximum((regions[:, 2:] - regions[:, :2]) / 2, min_size / 2)
+    regions = np.concatenate([center - half, center + half], axis=1)
+    regions = np.clip(regions, 0, [width, height, width, height])
+
+    # 反复合并相交的区域，直到两两不相交
+    merged = [r for r in regions]
+    changed = True
+    while changed and len(merged) > 1:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                a, b = merged[i], merged[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    merged[i] = np.concatenate([np.minimum(a[:2], b[:2]), np.maximum(a[2:], b[2:])])
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+
+    if len(merged) > max_regions:
+        return None
+    merged = np.stack(merged)
+    if box_area(merged).sum() > max_coverage * width * height:
+        return None
+    return [tuple(int(v) for v in r) for r in np.round(merged)]
+
+
+def temporal_fuse(dets_list, iou_threshold=0.5, min_votes=0.5, mode="vote", min_score=0.25):
+    """
+    把一个时间窗口内各帧的 (N, 6) 检测结果聚合成最新一帧 (dets_list[-1]) 上的一组检测。
+    同类别、IoU 超过阈值的框聚成一簇，每帧最多贡献一个框；簇的种子优先取最新帧、其次按置信度。
+    - vote: 出现在至少 min_votes 比例的帧中才保留 (去掉单帧闪烁的误检、补回单帧漏检)，
+            框取簇里最新一帧的框 (位置以最新帧为准)，置信度取簇内均值
+    - fusion: 按置信度加权平均框坐标 (WBF)，置信度 = 各帧置信度之和 / 帧数 (缺席的帧记 0)，
+              低于 min_score 的丢弃
+    """
+    frames = len(dets_list)
+    if frames == 0:
+        return np.zeros((0, 6), dtype=np.float32)
+    if frames == 1:
+        return dets_list[0]
+    sizes = [len(d) for d in dets_list]
+    if sum(sizes) == 0:
+        return np.zeros((0, 6), dtype=np.float32)
+    dets = np.concatenate([d for d in dets_list if len(d)]).astype(np.float32)
+    frame_ids = np.repeat(np.arange(frames), sizes)
+
+    # 最新帧在前，其余按置信度从高到低
+    order = np.lexsort((-dets[:, 4], -frame_ids))
+    dets, frame_ids = dets[order], frame_ids[order]
+    same_class = dets[:, 5][:, None] == dets[:, 5][None, :]
+    ious = np.where(same_class, box_iou(dets[:, :4], dets[:, :4]), 0.0)
+
+    assigned = np.zeros(len(dets), dtype=bool)
+    fused = []
+    for seed in range(len(dets)):
+        if assigned[seed]:
+            continue
+        candidates = np.flatnonzero(~assigned & (ious[seed] >= iou_threshold))
+        # 每帧只取一个框 (candidates 已经按最新帧、置信度排好序，取每帧第一次出现的)
+        _, first = np.unique(frame_ids[candidates], return_index=True)
+        members = candidates[first]   # 种子下标最小，一定在其中
+        assigned[members] = True
+
+        group = dets[members]
+        votes = len(members) / frames
+        if mode == "fusion":
+            weights = group[:, 4:5]
+            box = (group[:, :4] * weights).sum(axis=0) / max(float(weights.sum()), 1e-9)
+            score = float(group[:, 4].sum()) / frames
+            if score < min_score:
+                continue
+        else:
+            if votes < min_votes:
+                continue
+            box = group[np.argmax(frame_ids[members]), :4]
+            score = float(group[:, 4].mean())
+        fused.append(np.concatenate([box, [score, group[0, 5]]]))
+    if not fused:
+        return np.zeros((0, 6), dtype=np.float32)
+    return np.stack(fused).astype(np.float32)
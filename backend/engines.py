@@ -0,0 +1,138 @@
+# backend/engines.py
+import os
+import shutil
+import logging
+from ultralytics import YOLO
+
+logger = logging.getLogger("Engines")
+
+
+class UltralyticsEngine:
+    """
+    推理引擎 (PyTorch eager)。
+    所有引擎都通过 Ultralytics 的 AutoBackend 加载，共用同一套 letterbox 预处理和 NMS 后处理，
+    只替换中间的前向计算后端，因此各引擎输出的检测结果格式完全一致。
+
+    引擎对象本身只是"模型工厂"：create_model() 每次返回一个新的模型实例，
+    主模型和每个推理 worker 的副本都由它创建。
+    """
+    kind = "pytorch"
+    export_format = None      # Ultralytics export 的 format 参数
+    export_args = {}
+    export_suffix = ""        # 导出文件 (或目录) 的后缀
+    precision = "fp32"        # 导出文件名里的精度/量化模式
+    dynamic = True            # 是否支持任意 batch 大小和输入尺寸
+    max_batch = None          # 单次前向最多多少帧，None 表示不限
+
+    def __init__(self, weights, device="cpu", imgsz=640, **options):
+        self.weights = weights
+        self.device = device
+        self.imgsz = imgsz
+        self.options = options    # 引擎特有的参数 (如 INT8 校准数据目录)
+        self.model_path = weights
+
+    def exported_path(self):
+        """
+        导出文件按 权重名 + imgsz + 精度 区分 (如 yolov8n_640_fp32.onnx)：
+        修改 AI_IMGSZ 或量化模式后不会误用旧的 (可能是固定输入尺寸的) 导出文件
+        """
+        if not self.export_format:
+            return self.weights
+        return f"{os.path.splitext(self.weights)[0]}_{self.imgsz}_{self.precision}{self.export_suffix}"
+
+    def prepare(self):
+        """导出 (如需要) 并确定实际加载的模型文件，已有导出文件时直接复用"""
+        self.model_path = self.exported_path()
+        if self.export_format and not os.path.exists(self.model_path):
+            logger.info(f"📦 Exporting {self.weights} -> {self.kind} (imgsz={self.imgsz})...")
+            source = YOLO(self.weights)
+            exported = str(source.export(
+                format=self.export_format, imgsz=self.imgsz, device=self.device, **self.export_args
+            ))
+            # Ultralytics 总是导出到 <权重名>.<格式>，移动到带 imgsz/精度的路径
+            if os.path.abspath(exported) != os.path.abspath(self.model_path):
+                shutil.move(exported, self.model_path)
+        return self.model_path
+
+    def create_model(self):
+        model = YOLO(self.model_path, task="detect")
+        if self.kind == "pytorch":
+            model.to(self.device)
+        return model
+
+    def predict(self, model, images, imgsz=None):
+        # imgsz 只对动态形状的引擎有效 (自适应控制器会按会话降低输入尺寸)
+        imgsz = imgsz if imgsz and self.dynamic else self.imgsz
+        return model(images, imgsz=imgsz, device=self.device, verbose=False)
+
+    def describe(self):
+        return {
+            "engine": self.kind,
+            "model_path": str(self.model_path),
+            "dynamic": self.dynamic,
+            "max_batch": self.max_batch,
+        }
+
+
+class OnnxRuntimeEngine(UltralyticsEngine):
+    """导出为 ONNX (动态 batch/尺寸)，使用 ONNX Runtime CPUExecutionProvider 推理"""
+    kind = "onnx"
+    export_format = "onnx"
+    export_args = {"dynamic": True, "simplify": True}
+    export_suffix = ".onnx"
+
+
+class OnnxInt8Engine(OnnxRuntimeEngine):
+    """
+    INT8 静态量化的 ONNX 模型。首次启动时先导出 fp32 ONNX，
+    再用 calibration_dir 下上传视频的帧做校准 (见 quantization.py)，量化结果缓存为 <权重名>_<imgsz>_int8.onnx
+    """
+    kind = "onnx-int8"
+    precision = "int8"
+
+    def prepare(self):
+        self.model_path = self.exported_path()
+        if os.path.exists(self.model_path):
+            return self.model_path
+
+        from quantization import collect_calibration_frames, quantize_onnx_int8
+        fp32 = OnnxRuntimeEngine(self.weights, device=self.device, imgsz=self.imgsz)
+        fp32_path = fp32.prepare()
+        frames = collect_calibration_frames(
+            self.options.get("calibration_dir"),
+            self.imgsz,
+            max_frames=self.options.get("calibration_frames", 200),
+        )
+        quantize_onnx_int8(str(fp32_path), self.model_path, frames, self.imgsz)
+        logger.info(f"📦 INT8 model saved to {self.model_path}")
+        return self.model_path
+
+
+class OpenVINOEngine(UltralyticsEngine):
+    """导出为 OpenVINO IR (动态形状)，需要安装 openvino"""
+    kind = "openvino"
+    export_format = "openvino"
+    export_args = {"dynamic": True}
+    export_suffix = "_openvino_model"
+
+
+class TorchScriptEngine(UltralyticsEngine):
+    """导出为 TorchScript。导出时固定了 batch=1 和输入尺寸，batch 推理会被拆成逐帧前向"""
+    kind = "torchscript"
+    export_format = "torchscript"
+    dynamic = False
+    max_batch = 1
+    export_suffix = ".torchscript"
+
+
+ENGINES = {
+    engine.kind: engine
+    for engine in (UltralyticsEngine, OnnxRuntimeEngine, OnnxInt8Engine, OpenVINOEngine, TorchScriptEngine)
+}
+
+
+def create_engine(kind, weights, device="cpu", imgsz=640, **options):
+    """按名称创建引擎: pytorch / onnx / onnx-int8 / openvino / torchscript"""
+    if kind not in ENGINES:
+        raise ValueError(f"Unknown inference engine '{kind}', available: {list(ENGINES)}")
+    return ENGINES[kind](weights, device=device, imgsz=imgsz, **options)
@@ -0,0 +1,51 @@
+# backend/fault_injection.py
+import random
+import asyncio
+
+
+class FaultInjector:
+    """
+    发送端的故障注入 (每个会话一个，只在 config["fault_injection"] 打开时使用)。
+    在结果发送前用 asyncio.sleep 注入延迟/抖动，按概率丢弃或打乱顺序，
+    全部发生在发送协程里，不占用推理/入队线程，也不影响 d_an 等服务端指标。
+
+    相关配置 (会话 config):
+    - simulate_drift: 固定附加延迟 (毫秒)
+    - fault_jitter_ms: [最小, 最大] 随机抖动 (毫秒)
+    - fault_drop_rate: 丢弃结果的概率
+    - fault_reorder_rate: 结果被额外推迟 fault_reorder_ms、从而被后续结果超过的概率
+    """
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.delayed = 0
+        self.dropped = 0
+        self.reordered = 0
+
+    def plan(self, config):
+        """决定这一条结果的命运：返回注入的延迟 (秒)，返回 None 表示丢弃"""
+        if self.rng.random() < config.get("fault_drop_rate", 0.0):
+            self.dropped += 1
+            return None
+        delay_ms = max(0, config.get("simulate_drift", 0))
+        jitter = config.get("fault_jitter_ms") or (0, 0)
+        delay_ms += self.rng.uniform(jitter[0], jitter[1])
+        if self.rng.random() < config.get("fault_reorder_rate", 0.0):
+            delay_ms += config.get("fault_reorder_ms", 150)
+            self.reordered += 1
+        if delay_ms > 0:
+            self.delayed += 1
+        return delay_ms / 1000.0
+
+    async def apply(self, config, result):
+        """在发送前调用：丢弃时返回 False；否则异步等待注入的延迟并在结果里记录下来"""
+        delay = self.plan(config)
+        if delay is None:
+            return False
+        if delay > 0:
+            await asyncio.sleep(delay)
+        result["fault"] = {
+            "delay_ms": round(delay * 1000, 2),
+            "dropped": self.dropped,
+            "reordered": self.reordered,
+        }
+        return True
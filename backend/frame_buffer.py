@@ -0,0 +1,74 @@
+# backend/frame_buffer.py
+import numpy as np
+
+
+class FrameRingBuffer:
+    """
+    固定容量的帧环形缓冲区 (替代三个 deque)。
+
+    帧本身不复制：frame.to_ndarray 每帧都会返回一个新分配的数组，缓冲区只保存这个数组的引用，
+    之后没有任何地方原地修改它，所以同一个数组可以直接交给调度器/推理线程 (所有权随引用移交)，
+    不需要为跨线程排队再拷贝一份。槽位被新帧占用时只是替换引用，已经交出去的旧帧不受影响。
+    到达时间和 PTS 存放在预分配的平行数组中。
+    """
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self._frames = [None] * self.capacity
+        self._timestamps = np.zeros(self.capacity, dtype=np.float64)
+        self._pts = np.zeros(self.capacity, dtype=np.int64)
+        self._head = 0    # 下一帧的写入位置，范围 [0, capacity)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        """清空内容 (释放帧引用)，保留时间戳数组"""
+        self._frames = [None] * self.capacity
+        self._head = 0
+        self._count = 0
+
+    def set_capacity(self, capacity):
+        """修改容量 (重新分配并清空)"""
+        capacity = max(1, int(capacity))
+        if capacity != self.capacity:
+            self.capacity = capacity
+            self._timestamps = np.zeros(capacity, dtype=np.float64)
+            self._pts = np.zeros(capacity, dtype=np.int64)
+        self.clear()
+
+    def append(self, img, timestamp, pts):
+        """保存帧的引用 (不复制)；调用方之后不能再原地修改 img"""
+        i = self._head
+        self._frames[i] = img
+        self._timestamps[i] = timestamp
+        self._pts[i] = pts
+        self._head = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def _indices(self, n):
+        if n <= 0 or n > self._count:
+            raise ValueError(f"window size {n} out of range (buffered {self._count})")
+        return [(self._head - n + k) % self.capacity for k in range(n)]
+
+    def window(self, n=None):
+        """最近 n 帧 (默认全部)，按时间顺序: (帧列表, timestamps, pts)，帧是引用，不复制像素"""
+        n = self._count if n is None else n
+        index = self._indices(n)
+        return [self._frames[i] for i in index], self._timestamps[index], self._pts[index]
+
+    def latest(self):
+        """最新一帧: (frame, timestamp, pts)"""
+        i = (self._head - 1) % self.capacity
+        if self._count == 0:
+            raise ValueError("frame buffer is empty")
+        return self._frames[i], float(self._timestamps[i]), int(self._pts[i])
+
+    def oldest_timestamp(self, n=None):
+        """最近 n 帧中最早一帧的到达时间"""
+        n = self._count if n is None else n
+        return float(self._timestamps[self._indices(n)[0]])
+
+    @property
+    def last_pts(self):
+        return int(self._pts[(self._head - 1) % self.capacity]) if self._count else None
@@ -8,6 +8,10 @@ from aiortc.mediastreams import MediaStreamError
 import time
 import json
 
+from result_emitter import ResultEmitter
+from result_codec import ResultCodec
+import metrics
+
 # 配置更详细的日志
 logger = logging.getLogger("AIHandler")
 logger.setLevel(logging.DEBUG)  # 开启调试日志
@@ -16,22 +20,138 @@ AI_NAMESPACE = "/ai_analysis"
 
 # AI State
 ai_pcs: Dict[str, RTCPeerConnection] = {}
+# 每个 SID 一个独立的推理会话 (缓冲区/计数器/配置互不干扰)，只共享模型
+ai_sessions: Dict[str, Any] = {}
 sid_room_map = {}
 # ICE Candidate 缓冲池
 ice_candidate_buffers: Dict[str, List[RTCIceCandidate]] = {}
+# 在 join 时协商了二进制结果格式的客户端 (见 result_codec.py)
+binary_result_sids = set()
+_result_codec = None
+# 推流端在分析连接上创建的结果 DataChannel (无序、maxRetransmits=0)，打开后该客户端的结果改走这里
+ai_result_channels: Dict[str, Any] = {}
+RESULT_CHANNEL_LABEL = "ai_results"
+# DataChannel 发送缓冲超过这个字节数时丢弃新结果 (说明链路已经拥塞，排队只会让结果更旧)
+RESULT_CHANNEL_MAX_BUFFERED = 256 * 1024
 
 # backend/handlers/ai.py
 
-async def process_ai_track(track, sid, sio, ai_processor, room_id, peer_id):
+def get_or_create_session(sid, ai_processor):
+    """取出该 SID 的推理会话，不存在则创建 (update_config 可能早于视频轨道到达)"""
+    session = ai_sessions.get(sid)
+    if session is None:
+        session = ai_processor.create_session(sid)
+        ai_sessions[sid] = session
+    return session
+
+def get_result_codec(ai_processor):
+    """二进制结果编码器 (标签表来自模型，模型就绪后才能创建)"""
+    global _result_codec
+    if _result_codec is None and ai_processor.is_ready:
+        _result_codec = ResultCodec(ai_processor.names)
+    return _result_codec
+
+def send_on_result_channel(sid, result, codec):
+    """
+    推流端自己的结果走 DataChannel：与媒体同一条连接，不经过 Engine.IO，也没有 TCP 的队头阻塞。
+    返回 True 表示已经由 DataChannel 处理 (发送或因拥塞丢弃)，False 表示通道不可用、需要回退到 Socket.IO。
+    """
+    channel = ai_result_channels.get(sid)
+    if channel is None or channel.readyState != "open":
+        return False
+    if channel.bufferedAmount > RESULT_CHANNEL_MAX_BUFFERED:
+        return True
+    try:
+        if codec is not None and sid in binary_result_sids and result.get("type", "ai_result") != "ai_delta":
+            channel.send(codec.encode(result))
+        else:
+            channel.send(json.dumps(result))
+    except Exception as e:
+        logger.warning(f"[AI] DataChannel send failed for {sid}, falling back to Socket.IO: {e}")
+        return False
+    return True
+
+async def broadcast_result(sio, ai_processor, result, sid, room_id):
+    """
+    发送一条结果：
+    - 推流端自己 (sid) 的 DataChannel 打开时优先走 DataChannel，Socket.IO 广播跳过它
+    - 协商了二进制格式的客户端收到 ai_result_bin (二进制附件)，其余客户端照旧收到 JSON 的 ai_result
+    房间里两种客户端混合时，二进制逐个发送，JSON 广播时跳过它们。增量 (ai_delta) 总是以 JSON 发送。
+    """
+    if room_id:
+        binary_sids = [s for s in binary_result_sids if sid_room_map.get(s) == room_id]
+    else:
+        binary_sids = [sid] if sid in binary_result_sids else []
+    codec = get_result_codec(ai_processor) if binary_result_sids else None
+
+    skip = [sid] if send_on_result_channel(sid, result, codec) else []
+    binary_sids = [s for s in binary_sids if s not in skip]
+    if not room_id and skip:
+        return
+
+    if codec is None or not binary_sids or result.get("type", "ai_result") not in ("ai_result", "ai_heartbeat"):
+        await sio.emit('ai_result', result, room=room_id or sid, skip_sid=skip or None, namespace=AI_NAMESPACE)
+        return
+
+    data = codec.encode(result)
+    for binary_sid in binary_sids:
+        await sio.emit('ai_result_bin', data, room=binary_sid, namespace=AI_NAMESPACE)
+    if room_id:
+        await sio.emit('ai_result', result, room=room_id, skip_sid=binary_sids + skip, namespace=AI_NAMESPACE)
+
+async def negotiate_result_format(sio, ai_processor, sid, result_format):
+    """join 时的结果格式协商：binary 时先发送一次标签表 (ai_labels)，之后的结果以二进制发送"""
+    if result_format != "binary":
+        binary_result_sids.discard(sid)
+        return
+    try:
+        await ai_processor.wait_ready()
+    except RuntimeError as e:
+        logger.error(f"[AI] Binary result format unavailable for {sid}: {e}")
+        return
+    await sio.emit('ai_labels', {"format": "binary", **get_result_codec(ai_processor).label_table()},
+                   room=sid, namespace=AI_NAMESPACE)
+    binary_result_sids.add(sid)
+    logger.info(f"[AI] SID {sid} negotiated binary ai_result format")
+
+def drain_to_latest(track, frame):
+    """
+    跳过 track 队列中已经解码、但还没被消费的旧帧，只保留最新的一帧。
+    返回 (最新帧, 跳过的帧数)。
+    """
+    queue = getattr(track, "_queue", None)
+    skipped = 0
+    if queue is None:
+        return frame, skipped
+    while not queue.empty():
+        item = queue.get_nowait()
+        if item is None:
+            # 轨道结束标记：放回去，让下一次 recv() 正常抛出 MediaStreamError
+            queue.put_nowait(None)
+            break
+        frame = item
+        skipped += 1
+    return frame, skipped
+
+async def process_ai_track(track, sid, sio, ai_processor, scheduler, room_id, peer_id):
     logger.info(f"[AI-Worker] Started processing track for SID:{sid}")
     
     # [核心修改 1] 计时起点：函数被调用意味着 WebRTC 链路已打通，数据开始流入
     # 这时候相当于用户已经完成了 ICE 握手，开始等待 AI 响应
     pipeline_start_time = time.time()
     
-    # 1. 预热 (Warmup)
+    session = get_or_create_session(sid, ai_processor)
+    # 同一个 sid 重新推流时会话会被复用：上一路流的轨迹 (PTS 时间轴不同) 不能延续到新流
+    session.reset_tracking()
+
+    # 1. 等待引擎就绪：模型在服务启动时已经在后台加载并预热过一次，
+    #    引擎就绪后新会话直接进入处理，不再为每个 track 做一次 dummy 推理
     loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, ai_processor.warmup)
+    try:
+        await ai_processor.wait_ready()
+    except RuntimeError as e:
+        logger.error(f"[AI-Worker] {e}")
+        return
     
     # 2. 物理消除积压 (Flush)
     dropped_frames = 0
@@ -43,11 +163,12 @@ async def process_ai_track(track, sid, sio, ai_processor, room_id, peer_id):
             except: break
             
     # [核心修改 2] 计算总耗时
-    # 这个时间涵盖了：模型加载 + CUDA初始化 + 冲掉积压数据的耗时
+    # 这个时间涵盖了：等待引擎就绪 (服务刚启动时) + 冲掉积压数据的耗时
     # 这就是"这7秒"里后端真正干活的时间
     actual_startup_duration = (time.time() - pipeline_start_time) * 1000
     
     logger.info(f"[AI-Worker] Ready! Total Startup: {actual_startup_duration:.0f}ms | Flushed: {dropped_frames}")
+    metrics.FRAMES_DROPPED.inc(dropped_frames, session=sid, reason="startup_flush")
 
     # 3. 发送 Ready 信号 (直接把算好的时间发给前端)
     target = room_id if room_id else sid
@@ -60,57 +181,143 @@ async def process_ai_track(track, sid, sio, ai_processor, room_id, peer_id):
 
     # [Step 4] 进入主循环
     last_process_time = 0
-    min_interval = 0.05 
     debug_last_print_time = 0
 
-    while True:
-        try:
-            frame = await track.recv()
-        except MediaStreamError:
-            logger.info(f"[AI-Worker] Track ended for {sid}")
-            break
-        
-        # 获取时间戳
-        pts = frame.pts 
-        time_base = frame.time_base
-        now = time.time()
-        
-        # 限流逻辑
-        if now - last_process_time < min_interval:
-            continue
-        last_process_time = now
-        
-        # 运行推理
+    def engine_label(request=None):
+        return (request.engine if request is not None else None) or session.config.get("engine") or ai_processor.engine.kind
+
+    async def emit_result(result):
+        # 故障注入在发送协程里异步完成 (延迟/抖动/丢弃/乱序)，不占用推理和入队线程
+        if session.config.get("fault_injection"):
+            if not await session.faults.apply(session.config, result):
+                metrics.FRAMES_DROPPED.inc(session=sid, reason="fault_injection")
+                return
+        emit_start = time.perf_counter()
+        await broadcast_result(sio, ai_processor, result, sid, room_id)
+        metrics.observe_stage("emit", sid, engine_label(), time.perf_counter() - emit_start)
+
+    # 发送阶段：变化抑制 / 增量 / 积压合并 (按会话 config 开启)，之后才是故障注入和广播
+    emitter = ResultEmitter(emit_result)
+
+    async def deliver(future, request, submitted_at):
+        """等待调度器返回结果并广播；帧被同一会话的新帧替换时直接放弃"""
+        nonlocal debug_last_print_time
         try:
-            result = await loop.run_in_executor(
-                None, 
-                ai_processor.process, 
-                frame, 
-                pts,       
-                time_base 
-            )
-            
-            if result is None: continue
+            batch_result = await future
+            if batch_result is None:
+                metrics.FRAMES_DROPPED.inc(session=sid, reason="replaced")
+                return
+
+            dets, infer_start, infer_end, batch_size = batch_result
+            engine = engine_label(request)
+            if not request.reused:
+                # 推理时间戳是 time.time() (进程 worker 里也一样)，与 submitted_at 同一时钟
+                metrics.observe_stage("queue_wait", sid, engine, max(0.0, infer_start - submitted_at))
+                metrics.observe_stage("inference", sid, engine, infer_end - infer_start)
+            finalize_start = time.perf_counter()
+            result = session.finalize(request, dets, infer_start, infer_end, batch_size)
+            if result is None: return
+            metrics.observe_stage("postprocess", sid, engine, time.perf_counter() - finalize_start)
+            metrics.observe_stage("total", sid, engine, result["d_an"] / 1000)
+            metrics.RESULTS.inc(session=sid, engine=engine, source="reused" if request.reused else "detector")
 
             result['peerId'] = peer_id 
+            result['skipped_frames'] = session.skipped_frames
+            result.update(scheduler.session_stats(sid))
             
-            # 定期打印 Debug 信息 (每5秒)
+            # 定期输出 Debug 信息 (每5秒)，完整的分阶段延迟见 /metrics
             now_ts = time.time()
             if now_ts - debug_last_print_time > 5:
-                # 简单打印关键信息
-                print(f"\n[AI Debug] Peer:{peer_id} FPS:{result.get('fps')} Delay:{result.get('d_an')}ms Obj:{len(result.get('objects',[]))}")
+                logger.debug(f"[AI Debug] Peer:{peer_id} FPS:{result.get('fps')} Delay:{result.get('d_an')}ms Obj:{len(result.get('objects',[]))} Replaced:{result.get('replaced_frames')}")
                 debug_last_print_time = now_ts
             
             # 广播结果
-            if room_id:
-                await sio.emit('ai_result', result, room=room_id, namespace=AI_NAMESPACE)
-            else:
-                await sio.emit('ai_result', result, room=sid, namespace=AI_NAMESPACE)
-                
+            emitter.submit(result, session.config)
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
             logger.error(f"[AI-Worker] Inference Error: {e}")
+        finally:
+            if not request.reused:
+                session.detections_in_flight -= 1
+
+    try:
+        while True:
+            recv_start = time.perf_counter()
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                logger.info(f"[AI-Worker] Track ended for {sid}")
+                break
+            metrics.observe_stage("recv_wait", sid, engine_label(), time.perf_counter() - recv_start)
+            
+            frame_mode = session.config.get("frame_mode", "latest")
+            # 开启自适应时 max_fps 可能被控制器临时覆盖
+            max_fps = session.param("max_fps") or 0
+
+            # 跳帧：推理比帧到达慢时，track 队列里会积压帧，直接跳到最新的一帧，
+            # 避免逐帧消费带来的 d_an 持续增长
+            if frame_mode == "latest":
+                frame, skipped = drain_to_latest(track, frame)
+                session.skipped_frames += skipped
+                metrics.FRAMES_SKIPPED.inc(skipped, session=sid, reason="stale")
+                min_interval = 1.0 / max_fps if max_fps > 0 else 0
+            else:
+                min_interval = 1.0 / max_fps if max_fps > 0 else 0.05
+
+            # 获取时间戳
+            pts = frame.pts 
+            time_base = frame.time_base
+            now = time.time()
 
-def register_ai_handlers(sio: socketio.AsyncServer, ai_processor):
+            # 跟踪补帧：每个收到的帧都把已有目标外推到它的 PTS (纯 numpy，开销很小)，
+            # 检测器低帧率运行时前端仍能以视频帧率得到经过延迟补偿的框
+            if session.config.get("track_fill") and session.config.get("tracking", True):
+                fill = session.track_fill(pts, time_base, (frame.width, frame.height), now)
+                if fill is not None:
+                    fill['peerId'] = peer_id
+                    metrics.RESULTS.inc(session=sid, engine=engine_label(), source="tracker")
+                    emitter.submit(fill, session.config)
+            
+            # 限流逻辑
+            if now - last_process_time < min_interval:
+                session.skipped_frames += 1
+                metrics.FRAMES_SKIPPED.inc(session=sid, reason="throttle")
+                continue
+            last_process_time = now
+            
+            # 入队/Chunking 在专用线程池中完成；推理交给跨会话批处理调度器，
+            # 不在这里等待结果，这样推理期间到达的新帧可以替换信箱里还没推理的旧帧
+            try:
+                request = await loop.run_in_executor(
+                    scheduler.ingest_executor, 
+                    session.ingest, 
+                    frame, 
+                    pts,       
+                    time_base 
+                )
+                if session.last_convert_time is not None:
+                    metrics.observe_stage("convert", sid, engine_label(), session.last_convert_time)
+                if request is None: continue
+
+                if request.reused:
+                    # 静态画面：直接复用上一次的检测结果，不占用推理 worker
+                    reused_at = time.time()
+                    future = loop.create_future()
+                    future.set_result((None, reused_at, reused_at, 0))
+                    submitted_at = reused_at
+                else:
+                    submitted_at = time.time()
+                    future = scheduler.submit(request)
+                    session.detections_in_flight += 1
+                asyncio.create_task(deliver(future, request, submitted_at))
+                    
+            except Exception as e:
+                logger.error(f"[AI-Worker] Ingest Error: {e}")
+    finally:
+        scheduler.discard(sid)
+
+def register_ai_handlers(sio: socketio.AsyncServer, ai_processor, scheduler):
     
     @sio.event(namespace=AI_NAMESPACE)
     async def connect(sid, environ):
@@ -123,10 +330,15 @@ def register_ai_handlers(sio: socketio.AsyncServer, ai_processor):
         if sid in ai_pcs:
             await ai_pcs[sid].close()
             del ai_pcs[sid]
+        ai_result_channels.pop(sid, None)
+        ai_sessions.pop(sid, None)
+        # 会话标签的序列随会话一起删除，/metrics 不会随连接数无限增长
+        metrics.REGISTRY.forget("session", sid)
         if sid in sid_room_map:
             del sid_room_map[sid]
         if sid in ice_candidate_buffers:
             del ice_candidate_buffers[sid]
+        binary_result_sids.discard(sid)
 
     @sio.event(namespace=AI_NAMESPACE)
     async def join(sid, data: Dict[str, Any]):
@@ -136,6 +348,9 @@ def register_ai_handlers(sio: socketio.AsyncServer, ai_processor):
             await sio.enter_room(sid, room_id, namespace=AI_NAMESPACE)
             sid_room_map[sid] = room_id
             logger.info(f"[AI] SID {sid} joined AI room {room_id}")
+        # 结果格式协商: {"resultFormat": "binary"} (默认 JSON)
+        if data.get("resultFormat"):
+            asyncio.create_task(negotiate_result_format(sio, ai_processor, sid, data.get("resultFormat")))
 
     @sio.event(namespace=AI_NAMESPACE)
     async def offer(sid, data: Dict[str, Any]):
@@ -176,11 +391,25 @@ def register_ai_handlers(sio: socketio.AsyncServer, ai_processor):
                     namespace=AI_NAMESPACE
                 )
 
+        @pc.on("datachannel")
+        def on_datachannel(channel):
+            # 客户端在 offer 前创建的结果通道 (ordered=False, maxRetransmits=0)
+            if channel.label != RESULT_CHANNEL_LABEL:
+                return
+            logger.info(f"[AI] Result DataChannel opened for {sid} (ordered={channel.ordered}, "
+                        f"maxRetransmits={channel.maxRetransmits})")
+            ai_result_channels[sid] = channel
+
+            @channel.on("close")
+            def on_close():
+                if ai_result_channels.get(sid) is channel:
+                    ai_result_channels.pop(sid, None)
+
         @pc.on("track")
         def on_track(track):
             logger.info(f"[AI] Track received: {track.kind}")
             if track.kind == "video":
-                asyncio.create_task(process_ai_track(track, sid, sio, ai_processor, room_id, peer_id))
+                asyncio.create_task(process_ai_track(track, sid, sio, ai_processor, scheduler, room_id, peer_id))
 
         try:
             logger.info(f"[AI] Setting Remote Description for {sid}...")
@@ -252,7 +481,7 @@ def register_ai_handlers(sio: socketio.AsyncServer, ai_processor):
 
     @sio.event(namespace=AI_NAMESPACE)
     async def update_config(sid, data):
-        """允许客户端动态调整 AI 参数"""
-        if hasattr(ai_processor, 'update_config'):
-            ai_processor.update_config(data)
-            await sio.emit('config_updated', data, room=sid)
\ No newline at end of file
+        """允许客户端动态调整 AI 参数 (只作用于该客户端自己的会话)"""
+        session = get_or_create_session(sid, ai_processor)
+        session.update_config(data)
+        await sio.emit('config_updated', data, room=sid, namespace=AI_NAMESPACE)
\ No newline at end of file
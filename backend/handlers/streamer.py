@@ -3,12 +3,16 @@ import asyncio
 import os
 import shutil
 import threading
+import time
 from typing import Dict, Any, Optional
 import socketio
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from pydantic import BaseModel
 from aiortc import RTCPeerConnection, RTCSessionDescription, RTCIceCandidate, VideoStreamTrack
 from aiortc.contrib.media import MediaRelay, MediaPlayer
+from aiortc.mediastreams import MediaStreamError
+
+from video_cache import cached_result
 
 logger = logging.getLogger("StreamerHandler")
 STREAMER_NAMESPACE = "/streamer"
@@ -16,8 +20,9 @@ SERVER_PUSH_NAMESPACE = "/server_push"
 
 # Shared State (Passed from main)
 class StreamerContext:
-    def __init__(self, vlc_streamer):
+    def __init__(self, vlc_streamer, video_cache=None):
         self.vlc_streamer = vlc_streamer
+        self.video_cache = video_cache  # 上传视频的预分析缓存 (VideoAnalysisCache)，可选
         self.camera_lock = threading.Lock()
         self.camera_in_use_by = None # "streamer" or "server_push_consuming_streamer"
         self.rtsp_player = None
@@ -26,6 +31,7 @@ class StreamerContext:
 # Local State
 server_push_pcs: Dict[str, RTCPeerConnection] = {}
 server_push_tracks: Dict[str, Any] = {}
+server_push_cache_tasks: Dict[str, asyncio.Task] = {}
 
 # Models
 class RTSPControlRequest(BaseModel):
@@ -39,6 +45,10 @@ async def cleanup_server_push_client(sid, context: StreamerContext, skip_lock=Fa
     logger.info(f"[ServerPush] Cleaning up client: {sid}")
     client_data = server_push_pcs.pop(sid, None)
     track = server_push_tracks.pop(sid, None)
+    cache_task = server_push_cache_tasks.pop(sid, None)
+
+    if cache_task:
+        cache_task.cancel()
 
     if track:
         track.stop()
@@ -71,6 +81,55 @@ async def cleanup_server_push_client(sid, context: StreamerContext, skip_lock=Fa
             logger.info(f"[ServerPush] Closing MediaPlayer...")
             await asyncio.to_thread(player_to_close.close)
 
+def cached_index_for_stream(context: StreamerContext):
+    """推流源是一个已完成预分析的上传视频时，返回 (文件名, DetectionIndex)；否则 (文件名或 None, None)"""
+    if not context.video_cache or not context.vlc_streamer:
+        return None, None
+    filename = context.video_cache.resolve(context.vlc_streamer.input_source)
+    if not filename:
+        return None, None
+    index = context.video_cache.get(filename)
+    if index is None:
+        # 还没分析过 (例如在启用缓存之前上传的)，补一次，下次回放即可命中
+        context.video_cache.schedule(filename)
+    return filename, index
+
+async def push_cached_results(sio: socketio.AsyncServer, sid, context: StreamerContext, track, filename, index):
+    """
+    回放已预分析的上传视频：不做推理，按每一帧在源视频中的位置查缓存，把检测结果推给这个 server_push 客户端。
+    推流经过 ffmpeg 重新编码/缩放、RTSP 重新打时间戳，PTS 与源文件不同，所以位置这样换算：
+    收到第一帧时用 (当前时间 - ffmpeg 输出首帧的时间) 定位，之后按 RTSP 帧的 PTS 差值前进，超过时长后循环。
+    """
+    logger.info(f"[ServerPush] Serving cached detections for {filename} to {sid}")
+    anchor = None
+    frame_id = 0
+    try:
+        while True:
+            frame = await track.recv()
+            arrival_time = time.time()
+            if frame.pts is None or frame.time_base is None:
+                continue
+            stamps = context.vlc_streamer.start_timestamps
+            if anchor is None:
+                started = stamps.get("first_frame") or stamps.get("start") or arrival_time
+                anchor = (max(0.0, arrival_time - started), frame.pts, stamps.get("start"))
+            elif anchor[2] != stamps.get("start"):
+                # ffmpeg 重启 (播完一遍或参数变化)，重新定位
+                anchor = None
+                continue
+            position = anchor[0] + float((frame.pts - anchor[1]) * frame.time_base)
+            result = cached_result(
+                index, position, frame.pts, frame.time_base, frame.width, frame.height, frame_id, arrival_time
+            )
+            frame_id += 1
+            await sio.emit("ai_result", result, room=sid, namespace=SERVER_PUSH_NAMESPACE)
+    except (MediaStreamError, asyncio.CancelledError):
+        pass
+    except Exception as e:
+        logger.error(f"[ServerPush] Cached detection push failed for {sid}: {e}")
+    finally:
+        track.stop()
+
 def register_streamer_handlers(app: FastAPI, sio: socketio.AsyncServer, context: StreamerContext):
     
     # --- Socket.IO: Streamer Namespace ---
@@ -158,6 +217,14 @@ def register_streamer_handlers(app: FastAPI, sio: socketio.AsyncServer, context:
             answer = await pc.createAnswer()
             await pc.setLocalDescription(answer)
             await sio.emit("answer", {"answer": {"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}}, room=sid, namespace=SERVER_PUSH_NAMESPACE)
+
+            # 推流源是已预分析的上传视频：直接从缓存推送检测结果
+            filename, index = cached_index_for_stream(context)
+            if index is not None:
+                analysis_track = context.relay.subscribe(context.rtsp_player.video)
+                server_push_cache_tasks[sid] = asyncio.create_task(
+                    push_cached_results(sio, sid, context, analysis_track, filename, index)
+                )
         except Exception as e:
             logger.error(f"Error handling offer: {e}")
             await cleanup_server_push_client(sid, context)
@@ -238,6 +305,7 @@ def register_streamer_handlers(app: FastAPI, sio: socketio.AsyncServer, context:
     # File Uploads
     UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
     os.makedirs(UPLOAD_DIR, exist_ok=True)
+    video_cache = context.video_cache
 
     @app.post("/api/upload/video")
     async def upload_video(file: UploadFile = File(...)):
@@ -245,20 +313,38 @@ def register_streamer_handlers(app: FastAPI, sio: socketio.AsyncServer, context:
         file_path = os.path.join(UPLOAD_DIR, file.filename)
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
-        return {"message": "Success", "filename": file.filename}
+        analysis = None
+        if video_cache:
+            # 同名文件覆盖时旧索引按大小/修改时间自动失效，这里直接重新分析
+            job = video_cache.schedule(file.filename, force=True)
+            analysis = job["state"] if job else None
+        return {"message": "Success", "filename": file.filename, "analysis": analysis}
 
     @app.get("/api/videos")
     async def list_videos():
         videos = []
         if os.path.exists(UPLOAD_DIR):
             for f in os.listdir(UPLOAD_DIR):
-                videos.append({"filename": f})
+                if not os.path.isfile(os.path.join(UPLOAD_DIR, f)):
+                    continue
+                entry = {"filename": f}
+                if video_cache:
+                    entry["analysis"] = video_cache.status(f).get("state")
+                videos.append(entry)
         return {"videos": videos}
 
+    @app.get("/api/videos/cache")
+    async def video_cache_status():
+        if not video_cache:
+            raise HTTPException(status_code=503, detail="Video cache disabled")
+        return {"videos": video_cache.status()}
+
     @app.delete("/api/videos/{filename}")
     async def delete_video(filename: str):
         p = os.path.join(UPLOAD_DIR, filename)
         if os.path.exists(p):
             os.remove(p)
+            if video_cache:
+                video_cache.invalidate(filename)
             return {"message": "Deleted"}
         raise HTTPException(status_code=404)
@@ -0,0 +1,249 @@
+# backend/inference_scheduler.py
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from worker_pool import create_worker_pool
+
+logger = logging.getLogger("InferenceScheduler")
+
+
+class InferenceScheduler:
+    """
+    跨会话动态批处理调度器。
+    - 每个会话只有一个深度为 1 的信箱：新帧到达时如果旧帧还没被取走推理，直接替换 (latest-frame-wins)，
+      被替换的请求以 None 结束，排队长度永远不超过会话数。
+    - 调度协程从所有空闲会话的信箱里收集帧，凑满 max_batch_size 或等到 max_wait_ms 截止后，
+      在专用的推理 worker 池中执行一次 batch 前向，再把结果送回对应会话的 Future。
+    - 同一会话同时最多只有一个 batch 在推理，保证结果按帧顺序返回。
+    推理 worker 与默认线程池 (MediaPlayer、player.close 等) 隔离，互不抢占；
+    worker 可以是线程或进程，每个 worker 的 torch 线程数按物理核心数分配 (见 worker_pool.py)。
+    """
+    def __init__(self, processor, max_batch_size=8, max_wait_ms=5.0, num_workers=1, ingest_workers=2,
+                 worker_mode="thread", threads_per_worker=0, pin_cpus=False):
+        self.processor = processor
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.num_workers = max(1, int(num_workers))
+
+        # 专用推理 worker 池：每个 worker 固定 torch 线程数 (可选绑核)，并加载自己的模型副本
+        self.pool = create_worker_pool(
+            processor, worker_mode, self.num_workers, threads_per_worker, pin_cpus
+        )
+        # 帧转换/Chunking 使用单独的小线程池，推理进行时下一帧可以同时准备好
+        self.ingest_executor = ThreadPoolExecutor(
+            max_workers=max(1, int(ingest_workers)),
+            thread_name_prefix="ai-ingest",
+        )
+
+        # 调度状态在第一次提交时创建，保证绑定到正在运行的事件循环
+        self._task = None
+        self._wakeup = None
+        self._mailboxes = OrderedDict()  # session_id -> (request, future)，按首次排队顺序公平调度
+        self._busy = set()               # 正在推理中的会话
+        self._free_workers = self.num_workers
+
+        # 统计信息
+        self.batches = 0
+        self.frames = 0
+        self.replaced_frames = 0
+        self.session_replaced = {}
+
+    def warmup(self):
+        """
+        进程级的一次性预热 (阻塞，启动时在后台线程中运行)：
+        加载并预热主模型，再让每个推理 worker 完成模型副本的加载和预热，最后标记引擎就绪。
+        """
+        if not self.processor.load():
+            return False
+
+        start = time.time()
+        try:
+            self.pool.warmup()
+        except Exception as e:
+            self.processor.mark_failed(f"worker warmup failed: {e}")
+            return False
+        self.processor.timings["workers_ms"] = round((time.time() - start) * 1000, 1)
+        self.processor.mark_ready()
+        return True
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"🧮 Batch scheduler started (workers={self.num_workers}, "
+                f"max_batch={self.max_batch_size}, max_wait={self.max_wait * 1000:.1f}ms)"
+            )
+
+    def submit(self, request):
+        """
+        把一帧放进会话信箱，立即返回 Future。
+        Future 的结果为 (dets, infer_start, infer_end, batch_size)，dets 见 AIProcessor.detect；
+        若该帧在被推理前就被同一会话的新帧替换，则结果为 None。
+        """
+        self._ensure_started()
+        session_id = request.session_id
+        future = asyncio.get_running_loop().create_future()
+
+        pending = self._mailboxes.get(session_id)
+        if pending is not None:
+            _, stale_future = pending
+            if not stale_future.done():
+                stale_future.set_result(None)
+            self.replaced_frames += 1
+            self.session_replaced[session_id] = self.session_replaced.get(session_id, 0) + 1
+
+        # 直接覆盖 (保留原位置)，被替换的会话不会因此排到队尾
+        self._mailboxes[session_id] = (request, future)
+        self._wakeup.set()
+        return future
+
+    async def infer(self, request):
+        """提交一帧并等待结果 (被替换时返回 None)"""
+        return await self.submit(request)
+
+    def discard(self, session_id):
+        """会话结束：丢弃未推理的帧并清理统计"""
+        pending = self._mailboxes.pop(session_id, None)
+        if pending is not None and not pending[1].done():
+            pending[1].cancel()
+        self.session_replaced.pop(session_id, None)
+
+    def _ready_sessions(self):
+        return [sid for sid in self._mailboxes if sid not in self._busy]
+
+    async def _wait_wakeup(self, timeout=None):
+        self._wakeup.clear()
+        if timeout is None:
+            await self._wakeup.wait()
+            return True
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 1. 等待空闲 worker 和至少一个就绪的会话
+            while self._free_workers == 0 or not self._ready_sessions():
+                await self._wait_wakeup()
+
+            # 2. 在截止时间内尽量凑满一个 batch
+            deadline = loop.time() + self.max_wait
+            while len(self._ready_sessions()) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0 or not await self._wait_wakeup(timeout):
+                    break
+
+            batch = []
+            for sid in self._ready_sessions()[:self.max_batch_size]:
+                request, future = self._mailboxes.pop(sid)
+                # 等待期间会话可能已经断开，被取消的请求不再占用推理
+                if not future.done():
+                    batch.append((request, future))
+            if not batch:
+                continue
+
+            for request, _ in batch:
+                self._busy.add(request.session_id)
+            self._free_workers -= 1
+            asyncio.create_task(self._dispatch(batch))
+
+    @staticmethod
+    def _plan_groups(requests):
+        """
+        把一个 batch 的请求整理成 worker 的输入 [(engine, imgsz, images), ...]。
+        会话可以选择不同的模型变体和输入尺寸：按 (引擎, imgsz) 分组，每组一次 batch 前向。
+        ROI 模式的请求包含多个裁剪区域，窗口推理的请求包含窗口里的多帧，每张图都作为 batch 中的一张图
+        (max_batch_size 限制的是请求数，实际前向的 batch 可能更大)。
+        A/B 对照的请求再用对照引擎推理一次整帧。
+        members[k] 记录第 k 组每张图属于哪个请求: (i, j) 为请求 i 的第 j 张图，(i, None) 为 A/B 对照。
+        """
+        groups, members = {}, {}
+        for i, request in enumerate(requests):
+            for j, image in enumerate(request.images):
+                key = (request.engine, request.imgsz, False)
+                groups.setdefault(key, []).append(image)
+                members.setdefault(key, []).append((i, j))
+        for i, request in enumerate(requests):
+            if request.ab_engine:
+                key = (request.ab_engine, request.imgsz, True)
+                groups.setdefault(key, []).append(request.image)
+                members.setdefault(key, []).append((i, None))
+        keys = list(groups)
+        return [(key[0], key[1], groups[key]) for key in keys], [members[key] for key in keys]
+
+    @staticmethod
+    def _assemble(requests, members, outputs):
+        """把 worker 返回的每组结果拆回各个请求，返回每个请求的 (dets, infer_start, infer_end)"""
+        per_image = [[None] * len(request.images) for request in requests]
+        timings = [None] * len(requests)
+        for group_members, (dets, infer_start, infer_end) in zip(members, outputs):
+            for (i, j), d in zip(group_members, dets):
+                if j is None:
+                    # A/B 对照的结果挂在请求上 (见 AISession.finalize)
+                    requests[i].ab_result = (d, infer_start, infer_end, len(group_members))
+                    continue
+                per_image[i][j] = d
+                requests[i].group_size = len(group_members)
+                start, end = timings[i] or (infer_start, infer_end)
+                timings[i] = (min(start, infer_start), max(end, infer_end))
+        return [
+            (request.combine(dets), *timings[i])
+            for i, (request, dets) in enumerate(zip(requests, per_image))
+        ]
+
+    async def _dispatch(self, batch):
+        requests = [request for request, _ in batch]
+        try:
+            groups, members = self._plan_groups(requests)
+            # 在 worker 里把张量一次性搬到 numpy，事件循环上只剩拆分结果和构建 dict
+            outputs = await asyncio.wrap_future(self.pool.submit(groups))
+            results = self._assemble(requests, members, outputs)
+        except Exception as e:
+            logger.error(f"❌ Batch inference failed ({len(batch)} frames): {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            self.batches += 1
+            self.frames += len(batch)
+            for (_, future), (dets, infer_start, infer_end) in zip(batch, results):
+                if not future.done():
+                    future.set_result((dets, infer_start, infer_end, len(batch)))
+        finally:
+            for request, _ in batch:
+                self._busy.discard(request.session_id)
+            self._free_workers += 1
+            self._wakeup.set()
+
+    def session_stats(self, session_id):
+        return {
+            "replaced_frames": self.session_replaced.get(session_id, 0),
+            "queue_depth": len(self._mailboxes),
+        }
+
+    def stats(self):
+        return {
+            "workers": self.num_workers,
+            "worker_pool": self.pool.describe(),
+            "busy_workers": self.num_workers - self._free_workers,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": len(self._mailboxes),
+            "replaced_frames": self.replaced_frames,
+            "batches": self.batches,
+            "frames": self.frames,
+            "avg_batch_size": round(self.frames / self.batches, 2) if self.batches else 0,
+        }
+
+    def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+        self.pool.shutdown()
+        self.ingest_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,329 @@
+# backend/keypoints.py
+# 手语关键点序列的向量化处理：JSON 嵌套列表 -> (frames, hands, 21, 4) 数组，多个会话的事件合并成一个 batch 计算特征
+import math
+import time
+import struct
+import asyncio
+import logging
+
+import numpy as np
+
+logger = logging.getLogger("Keypoints")
+
+MAX_HANDS = 2
+NUM_LANDMARKS = 21
+WRIST, MIDDLE_MCP = 0, 9   # 手腕、中指根部：用于平移/尺度归一化
+
+# 二进制打包格式 (payload = {"format": "packed", "data": <bytes>, ...}，data 作为 Socket.IO 二进制附件发送)
+# 布局 (小端)：
+#   header  16 字节: magic "KP", version u8, dtype u8 (1=float32, 2=int16), frames u16, hands u8, landmarks u8,
+#                    channels u8, 保留 u8, 保留 6 字节
+#   scales  float32[channels]: int16 的反量化系数 (value = q / scale)，float32 时忽略
+#   counts  uint8[frames * hands]: 每只手的关键点数 (0 表示这一帧没有这只手)，补齐到 4 字节
+#   data    dtype[frames * hands * landmarks * channels]
+PACKED_MAGIC = b"KP"
+PACKED_VERSION = 1
+PACKED_HEADER = struct.Struct("<2sBBHBBBB6x")
+PACKED_DTYPES = {1: np.float32, 2: np.int16}
+DEFAULT_FPS = 5.0
+
+
+def coerce_fps(value, default=DEFAULT_FPS):
+    """客户端上报的 fps 转成有限的正数，缺失或非法 (字符串/NaN/<=0) 时回退到 default"""
+    try:
+        fps = float(value)
+    except (TypeError, ValueError):
+        return default
+    return fps if math.isfinite(fps) and fps > 0 else default
+
+
+def _landmarks_to_array(landmarks):
+    """
+    一只手的关键点列表 -> (N, C) float32。规则的列表一次 np.asarray 完成；
+    不规则的列表 (各点通道数不同、混有无法解析的点) 逐点处理：跳过少于 3 个坐标的点，score 缺失记为 1
+    """
+    try:
+        array = np.asarray(landmarks, dtype=np.float32)
+        if array.ndim == 2:
+            return array
+    except (TypeError, ValueError):
+        pass
+    if not isinstance(landmarks, (list, tuple)):
+        return np.zeros((0, 4), dtype=np.float32)
+    rows = []
+    for point in landmarks[:NUM_LANDMARKS]:
+        try:
+            values = np.asarray(point, dtype=np.float32).ravel()
+        except (TypeError, ValueError):
+            continue
+        if len(values) < 3:
+            continue
+        rows.append(values[:4] if len(values) >= 4 else np.append(values, 1.0))
+    return np.stack(rows).astype(np.float32) if rows else np.zeros((0, 4), dtype=np.float32)
+
+
+def frames_to_array(frames):
+    """
+    把 payload["frames"] 转成 (keypoints, counts)：
+    - keypoints: (F, MAX_HANDS, 21, 4) float32，每个关键点 [x, y, z, score]，只有 [x, y, z] 时 score 记为 1
+    - counts: (F, MAX_HANDS) int32，每只手实际收到的关键点数 (0 表示这一帧没有这只手)
+    只在"手"这一层循环，每只手的 21 个点用一次 np.asarray 转换；格式不对的帧/手单独跳过，不影响其余部分。
+    """
+    keypoints = np.zeros((len(frames), MAX_HANDS, NUM_LANDMARKS, 4), dtype=np.float32)
+    counts = np.zeros((len(frames), MAX_HANDS), dtype=np.int32)
+    for i, frame in enumerate(frames):
+        hands = frame.get('hands') if isinstance(frame, dict) else None
+        if not isinstance(hands, list):
+            continue
+        for j, hand in enumerate(hands[:MAX_HANDS]):
+            if not isinstance(hand, dict):
+                continue
+            landmarks = _landmarks_to_array(hand.get('landmarks') or [])
+            if landmarks.ndim != 2 or len(landmarks) == 0 or landmarks.shape[1] < 3:
+                continue
+            n = min(len(landmarks), NUM_LANDMARKS)
+            c = min(landmarks.shape[1], 4)
+            keypoints[i, j, :n, :c] = landmarks[:n, :c]
+            if c < 4:
+                keypoints[i, j, :n, 3] = 1.0
+            counts[i, j] = n
+    return keypoints, counts
+
+
+def decode_packed(data):
+    """
+    解码二进制打包的关键点，返回 (keypoints, counts)，形状同 frames_to_array。
+    float32 且布局与服务端一致 (2 只手 x 21 点 x 4 通道) 时直接是 data 上的只读视图，不复制；
+    int16 需要反量化，其他布局补齐成标准形状。
+    """
+    buffer = memoryview(data)
+    magic, version, dtype_code, frames, hands, landmarks, channels, _ = PACKED_HEADER.unpack_from(buffer, 0)
+    if magic != PACKED_MAGIC or version != PACKED_VERSION or dtype_code not in PACKED_DTYPES:
+        raise ValueError(f"invalid packed keypoints header: {magic!r} v{version} dtype={dtype_code}")
+    if channels > 4 or landmarks > NUM_LANDMARKS:
+        raise ValueError(f"unsupported packed layout: {landmarks} landmarks x {channels} channels")
+    offset = PACKED_HEADER.size
+    scales = np.frombuffer(buffer, dtype="<f4", count=channels, offset=offset)
+    offset += 4 * channels
+    counts = np.frombuffer(buffer, dtype=np.uint8, count=frames * hands, offset=offset).reshape(frames, hands)
+    offset += (frames * hands + 3) // 4 * 4
+    dtype = np.dtype(PACKED_DTYPES[dtype_code]).newbyteorder("<")
+    values = np.frombuffer(buffer, dtype=dtype, count=frames * hands * landmarks * channels, offset=offset)
+    values = values.reshape(frames, hands, landmarks, channels)
+    if dtype_code == 2:
+        values = values / np.where(scales != 0, scales, 1.0).astype(np.float32)
+
+    counts = np.minimum(counts, landmarks).astype(np.int32)
+    if (hands, landmarks, channels) == (MAX_HANDS, NUM_LANDMARKS, 4):
+        return values.astype(np.float32, copy=False), counts
+    keypoints = np.zeros((frames, MAX_HANDS, NUM_LANDMARKS, 4), dtype=np.float32)
+    h = min(hands, MAX_HANDS)
+    keypoints[:, :h, :landmarks, :channels] = values[:, :h]
+    if channels < 4:
+        keypoints[:, :h, :landmarks, 3] = 1.0
+    full_counts = np.zeros((frames, MAX_HANDS), dtype=np.int32)
+    full_counts[:, :h] = counts[:, :h]
+    return keypoints, full_counts
+
+
+def encode_packed(keypoints, counts, dtype="float32"):
+    """frames_to_array / decode_packed 的逆操作 (测试和 Python 客户端使用)，int16 按每个通道的最大绝对值量化"""
+    keypoints = np.asarray(keypoints, dtype=np.float32)
+    frames, hands, landmarks, channels = keypoints.shape
+    if dtype == "int16":
+        peak = np.abs(keypoints).reshape(-1, channels).max(axis=0) if keypoints.size else np.zeros(channels)
+        scales = np.where(peak > 0, 32767.0 / np.maximum(peak, 1e-12), 1.0).astype("<f4")
+        values = np.round(keypoints * scales).astype("<i2")
+        code = 2
+    else:
+        scales = np.ones(channels, dtype="<f4")
+        values = keypoints.astype("<f4")
+        code = 1
+    counts_bytes = np.asarray(counts, dtype=np.uint8).tobytes()
+    counts_bytes += b"\0" * ((4 - len(counts_bytes) % 4) % 4)
+    header = PACKED_HEADER.pack(PACKED_MAGIC, PACKED_VERSION, code, frames, hands, landmarks, channels, 0)
+    return header + scales.tobytes() + counts_bytes + values.tobytes()
+
+
+def payload_to_array(payload, frames_key='frames'):
+    """
+    analysis_keypoints / analysis_keypoints_sequence 的 payload -> (keypoints, counts)。
+    format 为 "packed" 时解码 data 里的二进制，否则按 JSON 嵌套列表处理 (单帧事件传 frames_key=None，用 payload 本身作为一帧)。
+    """
+    payload = payload or {}
+    if payload.get('format') == 'packed':
+        return decode_packed(payload['data'])
+    frames = payload.get(frames_key, []) if frames_key else [payload]
+    return frames_to_array(frames)
+
+
+def stack_sequences(sequences):
+    """把长度不同的多个序列 [(keypoints, counts), ...] 补零拼成 (B, F_max, ...) 的 batch，返回 (keypoints, counts, lengths)"""
+    lengths = np.array([len(kp) for kp, _ in sequences], dtype=np.int32)
+    max_len = max(1, int(lengths.max()) if len(lengths) else 1)
+    keypoints = np.zeros((len(sequences), max_len, MAX_HANDS, NUM_LANDMARKS, 4), dtype=np.float32)
+    counts = np.zeros((len(sequences), max_len, MAX_HANDS), dtype=np.int32)
+    for b, (kp, cnt) in enumerate(sequences):
+        keypoints[b, :len(kp)] = kp
+        counts[b, :len(cnt)] = cnt
+    return keypoints, counts, lengths
+
+
+def sequence_features(keypoints, counts, lengths, fps):
+    """
+    一个 batch 的向量化特征提取 (没有 Python 层的逐帧/逐点循环)：
+    - presence: (B, F, H) 这只手是否出现；complete: 21 个点是否齐全
+    - normalized: (B, F, H, 21, 3) 以手腕为原点、按手腕到中指根部的距离缩放的坐标 (与位置和远近无关)
+    - velocity: (B, F, H, 21, 3) 相邻帧 normalized 的变化速度 (每秒)，首帧或前后帧缺手时为 0
+    - wrist_speed: (B, F, H) 手腕在画面中的移动速度 (手掌尺度/秒)
+    """
+    batch, max_len = counts.shape[:2]
+    valid = np.arange(max_len)[None, :] < lengths[:, None]                  # (B, F)
+    presence = (counts > 0) & valid[..., None]                              # (B, F, H)
+    complete = (counts >= NUM_LANDMARKS) & valid[..., None]
+
+    xyz = keypoints[..., :3]
+    wrist = xyz[..., WRIST, :]                                              # (B, F, H, 3)
+    scale = np.linalg.norm(xyz[..., MIDDLE_MCP, :] - wrist, axis=-1)        # (B, F, H)
+    scale = np.where(complete & (scale > 1e-6), scale, 1.0)
+    normalized = (xyz - wrist[..., None, :]) / scale[..., None, None]
+    normalized[~complete] = 0.0
+
+    dt = 1.0 / np.maximum(np.asarray(fps, dtype=np.float32), 1e-3)          # (B,)
+    both = complete[:, 1:] & complete[:, :-1]                               # (B, F-1, H)
+    velocity = np.zeros_like(normalized)
+    velocity[:, 1:] = (normalized[:, 1:] - normalized[:, :-1]) / dt[:, None, None, None, None]
+    velocity[:, 1:][~both] = 0.0
+    wrist_speed = np.zeros(presence.shape, dtype=np.float32)
+    wrist_speed[:, 1:] = np.linalg.norm(wrist[:, 1:] - wrist[:, :-1], axis=-1) / scale[:, 1:] / dt[:, None, None]
+    wrist_speed[:, 1:][~both] = 0.0
+
+    return {
+        "presence": presence,
+        "complete": complete,
+        "normalized": normalized,
+        "velocity": velocity,
+        "wrist_speed": wrist_speed,
+        "hand_frames": presence.any(axis=-1).sum(axis=1),                  # (B,)
+        "two_hand_frames": presence.all(axis=-1).sum(axis=1),
+        "total_keypoints": np.where(valid[..., None], counts, 0).sum(axis=(1, 2)),
+        "motion": _masked_mean(np.linalg.norm(velocity, axis=-1).mean(axis=-1), both, pad_first=True),
+        "wrist_motion": _masked_mean(wrist_speed, both, pad_first=True),
+    }
+
+
+def _masked_mean(values, mask, pad_first=False):
+    """按 mask 对 (B, F, H) 求每个序列的均值；pad_first 时 mask 只覆盖 F-1 个相邻帧对"""
+    if pad_first:
+        values = values[:, 1:]
+    total = np.where(mask, values, 0.0).sum(axis=(1, 2))
+    return total / np.maximum(mask.sum(axis=(1, 2)), 1)
+
+
+def summarize(features, b):
+    """取出 batch 中第 b 个序列的标量摘要"""
+    return {
+        "hand_frames": int(features["hand_frames"][b]),
+        "two_hand_frames": int(features["two_hand_frames"][b]),
+        "total_keypoints": int(features["total_keypoints"][b]),
+        "motion": round(float(features["motion"][b]), 3),
+        "wrist_motion": round(float(features["wrist_motion"][b]), 3),
+    }
+
+
+class KeypointBatcher:
+    """
+    跨会话的关键点事件微批处理。
+    每个 analysis_keypoints_sequence 事件先在调用方转成数组，然后放进队列；
+    批处理协程在 window_ms 内收集来自各个 sid 的事件 (最多 max_batch 个)，补零拼成一个 batch
+    一次性做特征提取，再把每个事件的摘要送回对应的 Future。
+    """
+    def __init__(self, window_ms=10.0, max_batch=128):
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+        self._task = None
+        self._wakeup = None
+        self._pending = []   # [(sequence, fps, future), ...]
+
+        # 统计信息
+        self.batches = 0
+        self.events = 0
+        self.last_batch_ms = 0.0
+
+    def _ensure_started(self):
+        # 调度状态在第一次提交时创建，保证绑定到正在运行的事件循环
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"🤟 Keypoint batcher started (window={self.window * 1000:.1f}ms, max_batch={self.max_batch})")
+
+    def submit(self, keypoints, counts, fps):
+        """
+        提交一个序列 (见 frames_to_array)，返回 Future，结果为 summarize 的摘要。
+        参数在这里校验 (ValueError 只抛给这个调用方)，进入 batch 的事件都是合法的。
+        """
+        fps = float(fps)
+        if not math.isfinite(fps) or fps <= 0:
+            raise ValueError(f"invalid fps: {fps}")
+        if keypoints.shape[1:] != (MAX_HANDS, NUM_LANDMARKS, 4) or counts.shape != keypoints.shape[:2]:
+            raise ValueError(f"invalid keypoint shape: {keypoints.shape} / {counts.shape}")
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((keypoints, counts), fps, future))
+        self._wakeup.set()
+        return future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            # 在窗口内尽量多收集一些事件
+            deadline = loop.time() + self.window
+            while len(self._pending) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            try:
+                self._compute(batch)
+            except Exception as e:
+                # 整个 batch 失败时逐个事件重新计算，只让出问题的事件失败，其他 sid 不受影响
+                logger.error(f"❌ Keypoint batch failed, retrying events one by one: {e}")
+                for item in batch:
+                    try:
+                        self._compute([item])
+                    except Exception as item_error:
+                        if not item[2].done():
+                            item[2].set_exception(item_error)
+            self.last_batch_ms = (time.perf_counter() - start) * 1000
+            self.batches += 1
+            self.events += len(batch)
+
+    @staticmethod
+    def _compute(batch):
+        keypoints, counts, lengths = stack_sequences([seq for seq, _, _ in batch])
+        features = sequence_features(keypoints, counts, lengths, [fps for _, fps, _ in batch])
+        for b, (_, _, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(summarize(features, b))
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "events": self.events,
+            "avg_batch_size": round(self.events / self.batches, 2) if self.batches else 0,
+            "last_batch_ms": round(self.last_batch_ms, 3),
+        }
@@ -8,6 +8,8 @@ from fastapi.responses import JSONResponse
 import sys
 import os
 
+from keypoints import KeypointBatcher, payload_to_array, coerce_fps
+
 # 添加VLC模块路径
 sys.path.append(os.path.join(os.path.dirname(__file__), 'VLC'))
 
@@ -41,6 +43,9 @@ rooms = {}
 # 存储客户端信息：客户端SID -> 房间ID
 client_rooms = {}
 
+# 关键点序列的跨会话微批处理 (见 keypoints.py)
+keypoint_batcher = KeypointBatcher(window_ms=10, max_batch=128)
+
 # VLC推流器实例（全局单例）
 vlc_streamer = None
 if VLC_AVAILABLE:
@@ -140,14 +145,16 @@ async def handle_analysis_keypoints(sid, payload):
       ],
       "timestamp": 1234567890
     }
+    也可以发送二进制打包格式 (见 keypoints.py)：
+    {"source": "local", "format": "packed", "data": <bytes>, "timestamp": 1234567890}
     """
     try:
-        hands = (payload or {}).get('hands', [])
         source = (payload or {}).get('source', 'local')
+        _, counts = payload_to_array(payload, frames_key=None)
 
         # 非常简化的占位逻辑：根据是否检测到手以及关键点数量，给出伪翻译
-        detected = len(hands) > 0
-        keypoint_count = sum(len(h.get('landmarks', [])) for h in hands)
+        detected = bool(counts.any())
+        keypoint_count = int(counts.sum())
 
         if detected and keypoint_count >= 21:
             text = '检测到手势，正在翻译…'
@@ -193,24 +200,23 @@ async def handle_analysis_keypoints_sequence(sid, payload):
       "started_at": 123456,
       "ended_at": 123789
     }
+    frames 也可以换成二进制打包格式 (见 keypoints.py)："format": "packed", "data": <bytes>
     """
     try:
-      frames = (payload or {}).get('frames', [])
       source = (payload or {}).get('source', 'local')
-      fps = (payload or {}).get('fps', 5)
+      # fps 来自客户端：非数值/非正数时回退到默认值，不让一个客户端的坏数据进入跨会话的 batch
+      fps = coerce_fps((payload or {}).get('fps'))
       started_at = (payload or {}).get('started_at')
       ended_at = (payload or {}).get('ended_at')
 
-      length = len(frames)
+      # 转成 (frames, hands, 21, 4) 数组 (二进制格式直接映射，不经过 Python 列表)，
+      # 和其他客户端的事件合并成一个 batch 做向量化特征提取
+      keypoints, counts = payload_to_array(payload)
+      length = len(keypoints)
       duration_ms = (ended_at - started_at) if (started_at and ended_at) else 0
-      # 简单度量：总关键点数量与帧数
-      total_keypoints = 0
-      hand_frames = 0
-      for f in frames:
-        hands = (f or {}).get('hands', [])
-        if hands:
-          hand_frames += 1
-          total_keypoints += sum(len(h.get('landmarks', [])) for h in hands)
+      features = await keypoint_batcher.submit(keypoints, counts, fps)
+      hand_frames = features['hand_frames']
+      total_keypoints = features['total_keypoints']
 
       # 占位翻译策略：帧数≥10且有连续手帧，提升置信度
       if hand_frames >= max(2, int(0.4 * length)) and length >= max(5, int(1.5 * fps)):
@@ -233,7 +239,10 @@ async def handle_analysis_keypoints_sequence(sid, payload):
           'duration_ms': duration_ms,
           'fps': fps,
           'hand_frames': hand_frames,
-          'total_keypoints': total_keypoints
+          'total_keypoints': total_keypoints,
+          'two_hand_frames': features['two_hand_frames'],
+          'motion': features['motion'],
+          'wrist_motion': features['wrist_motion']
         }
       }
 
@@ -320,6 +329,13 @@ async def handle_ice_candidate(sid, candidate):
     else:
         logging.warning(f"未找到 sid='{sid}' 的对等端，无法转发 ICE Candidate")
 
+# ==================== AI 统计API ====================
+
+@fastapi_app.get("/api/ai/stats")
+async def get_ai_stats():
+    """关键点微批处理统计：batch 数、事件数、平均 batch 大小、最近一个 batch 的耗时"""
+    return {"keypoints": keypoint_batcher.stats()}
+
 # ==================== VLC推流控制API ====================
 
 @fastapi_app.get("/api/vlc/status")
@@ -1,10 +1,12 @@
 # main_simple.py (Refactored)
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import socketio
 import uvicorn
 import logging
 import os
+import threading
 
 # Import Handlers
 from handlers.p2p import register_p2p_handlers
@@ -13,6 +15,10 @@ from handlers.streamer import register_streamer_handlers, StreamerContext
 
 # Import Core Components
 from ai_processor import AIProcessor
+from inference_scheduler import InferenceScheduler
+from video_cache import VideoAnalysisCache
+import ai_config
+import metrics
 try:
     from streaming.streamer import RTSPStreamer
     VLC_AVAILABLE = True
@@ -41,20 +47,65 @@ fastapi_app.add_middleware(
 )
 
 # Initialize Components
-ai_processor = AIProcessor()
+ai_processor = AIProcessor(
+    engine=ai_config.INFER_ENGINE,
+    weights=ai_config.INFER_WEIGHTS,
+    imgsz=ai_config.INFER_IMGSZ,
+    variants=ai_config.INFER_ENGINE_VARIANTS,
+    engine_options={
+        "calibration_dir": ai_config.CALIBRATION_DIR,
+        "calibration_frames": ai_config.CALIBRATION_FRAMES,
+    },
+)
+ai_processor.config.update({
+    "adaptive": ai_config.ADAPTIVE_DEFAULT,
+    "latency_slo_ms": ai_config.LATENCY_SLO_MS,
+})
+inference_scheduler = InferenceScheduler(
+    ai_processor,
+    max_batch_size=ai_config.INFER_MAX_BATCH_SIZE,
+    max_wait_ms=ai_config.INFER_MAX_WAIT_MS,
+    num_workers=ai_config.INFER_WORKERS,
+    ingest_workers=ai_config.INGEST_WORKERS,
+    worker_mode=ai_config.WORKER_MODE,
+    threads_per_worker=ai_config.THREADS_PER_WORKER,
+    pin_cpus=ai_config.PIN_CPUS,
+)
+
+# 上传视频的离线预分析 (独立进程池，与实时推理 worker 互不影响)
+video_cache = VideoAnalysisCache(
+    ai_config.UPLOAD_DIR,
+    ai_processor.spec,
+    max_workers=ai_config.VIDEO_CACHE_WORKERS,
+    threads_per_worker=ai_config.VIDEO_CACHE_THREADS,
+    reserved_threads=inference_scheduler.pool.num_workers * inference_scheduler.pool.threads,
+) if ai_config.VIDEO_CACHE_ENABLED else None
 
 if VLC_AVAILABLE:
     vlc_streamer = RTSPStreamer(sio_server=sio, namespace="/streamer")
-    streamer_context = StreamerContext(vlc_streamer)
+    streamer_context = StreamerContext(vlc_streamer, video_cache)
 else:
     vlc_streamer = None
-    streamer_context = StreamerContext(None)
+    streamer_context = StreamerContext(None, video_cache)
 
 # Register Handlers
 register_p2p_handlers(sio)
-register_ai_handlers(sio, ai_processor)
+register_ai_handlers(sio, ai_processor, inference_scheduler)
 register_streamer_handlers(fastapi_app, sio, streamer_context)
 
+@fastapi_app.on_event("startup")
+async def start_ai_warmup():
+    # 模型加载 + 预热只在进程启动时做一次，放到后台线程，不阻塞服务启动
+    threading.Thread(target=inference_scheduler.warmup, name="ai-warmup", daemon=True).start()
+    if video_cache:
+        # 为启用缓存之前上传的视频补做预分析
+        video_cache.schedule_all()
+
+@fastapi_app.on_event("shutdown")
+async def stop_video_cache():
+    if video_cache:
+        video_cache.shutdown()
+
 # Basic Routes
 @fastapi_app.get("/")
 async def root():
@@ -62,7 +113,7 @@ async def root():
 
 @fastapi_app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "ai_engine": ai_processor.status()}
 
 @fastapi_app.get("/api/info")
 async def server_info():
@@ -71,8 +122,20 @@ async def server_info():
         "version": "2.0.0",
         "socketio_namespaces": ["/p2p", "/streamer", "/server_push", "/ai_analysis"],
         "vlc_available": VLC_AVAILABLE,
+        "ai_engine": ai_processor.status(),
     }
 
+@fastapi_app.get("/api/ai/stats")
+async def ai_stats():
+    """推理调度器状态：排队深度、被替换的帧数、batch 统计，以及模型变体的 A/B 对照汇总"""
+    return {**inference_scheduler.stats(), "ab": ai_processor.ab_stats.summary(),
+            "latency": metrics.latency_summary()}
+
+@fastapi_app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """分阶段延迟直方图 + 跳帧/丢帧计数 (Prometheus 文本格式，p95 等用 histogram_quantile 计算)"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == "__main__":
     base_dir = os.path.dirname(os.path.abspath(__file__))
     cert_dir = os.path.abspath(os.path.join(base_dir, "..", "frontend", "certs"))
@@ -0,0 +1,195 @@
+# backend/metrics.py
+# 服务端的分阶段延迟直方图 + 计数器，以 Prometheus 文本格式在 /metrics 导出 (不依赖 prometheus_client)
+import bisect
+import threading
+
+# 延迟桶的上界 (毫秒)
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 75, 100, 150, 250, 400, 600, 1000, 2500, 5000)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if amount <= 0:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def remove(self, label, value):
+        """删除某个标签取值的所有序列 (例如会话结束)"""
+        index = self.labelnames.index(label)
+        with self._lock:
+            for key in [k for k in self._values if k[index] == str(value)]:
+                del self._values[key]
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    固定桶的直方图：每个标签组合保存各个桶的计数、总和与样本数。
+    observe 只做一次二分查找 + 加法，可以在事件循环和推理线程里直接调用。
+    """
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS_MS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def remove(self, label, value):
+        index = self.labelnames.index(label)
+        with self._lock:
+            for key in [k for k in self._series if k[index] == str(value)]:
+                del self._series[key]
+
+    def quantiles(self, qs=(0.5, 0.95, 0.99), group_by=()):
+        """
+        按 group_by 中的标签合并序列后，从桶计数估算分位数 (桶内线性插值，与 PromQL histogram_quantile 相同)。
+        返回 {group 标签取值: {"count", "mean", "p50", ...}}。
+        """
+        positions = [self.labelnames.index(name) for name in group_by]
+        merged = {}
+        with self._lock:
+            for key, series in self._series.items():
+                group = tuple(key[i] for i in positions)
+                total = merged.setdefault(group, [0] * len(series))
+                for i, v in enumerate(series):
+                    total[i] += v
+        summary = {}
+        for group, series in merged.items():
+            counts, value_sum = series[:-1], series[-1]
+            count = sum(counts)
+            if count == 0:
+                continue
+            stats = {"count": count, "mean": round(value_sum / count, 2)}
+            for q in qs:
+                stats[f"p{round(q * 100):g}"] = round(self._quantile(q, counts, count), 2)
+            summary[group] = stats
+        return summary
+
+    def _quantile(self, q, counts, count):
+        rank = q * count
+        cumulative = 0
+        for i, c in enumerate(counts):
+            if cumulative + c >= rank and c > 0:
+                if i >= len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / c
+            cumulative += c
+        return self.buckets[-1]
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += c
+                le = bound if bound == "+Inf" else _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(round(series[-1], 3))}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def forget(self, label, value):
+        """会话结束后删除带这个标签的序列，避免会话标签无限增长"""
+        for metric in self._metrics:
+            if label in metric.labelnames:
+                metric.remove(label, value)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# 分阶段延迟 (毫秒)，stage:
+#   recv_wait   等待 track.recv() 返回下一帧
+#   convert     libav 缩放 + 转 bgr24 (静态画面跳过转换时不记录)
+#   queue_wait  提交给调度器到推理开始 (含凑 batch 的等待)
+#   inference   模型前向 (一个 batch)
+#   postprocess finalize：跟踪、构建结果、自适应控制
+#   emit        发送阶段 (Socket.IO / DataChannel，不含故障注入的延迟)
+#   total       d_an：窗口第一帧到达到推理结束
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "ai_stage_latency_ms", "Per-stage latency of the AI pipeline in milliseconds",
+    ("stage", "session", "engine"),
+))
+FRAMES_SKIPPED = REGISTRY.register(Counter(
+    "ai_frames_skipped_total", "Frames received but not sent to the pipeline (stale backlog or throttling)",
+    ("session", "reason"),
+))
+FRAMES_DROPPED = REGISTRY.register(Counter(
+    "ai_frames_dropped_total", "Frames or results dropped after entering the pipeline",
+    ("session", "reason"),
+))
+RESULTS = REGISTRY.register(Counter(
+    "ai_results_total", "Results produced per session (source: detector / reused / tracker)",
+    ("session", "engine", "source"),
+))
+
+
+def observe_stage(stage, session, engine, seconds):
+    STAGE_LATENCY.observe(seconds * 1000, stage=stage, session=session, engine=engine)
+
+
+def latency_summary():
+    """各阶段按引擎合并所有会话后的 p50/p95/p99 (供 /api/ai/stats 使用)"""
+    summary = {}
+    for (stage, engine), stats in STAGE_LATENCY.quantiles(group_by=("stage", "engine")).items():
+        summary.setdefault(stage, {})[engine] = stats
+    return summary
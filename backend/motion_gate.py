@@ -0,0 +1,39 @@
+# backend/motion_gate.py
+import numpy as np
+
+
+class MotionGate:
+    """
+    静态画面门控：用一张很小的灰度缩略图判断新帧与上一次推理的帧是否有明显变化。
+    缩略图直接在 libav 中生成 (64 宽，约 2K 像素)，比一次完整的 bgr24 转换便宜得多，
+    没有变化时会话复用上一次的检测结果，不再进入模型。
+    """
+    def __init__(self, width=64, pixel_threshold=20, area_threshold=0.01, refresh_interval=2.0):
+        self.width = width
+        self.pixel_threshold = pixel_threshold    # 单个像素灰度差超过多少算"变化"
+        self.area_threshold = area_threshold      # 变化像素占比超过多少算"画面变化"
+        self.refresh_interval = refresh_interval  # 即使画面静止，也至少每隔这么多秒真正推理一次
+        self._reference = None                    # (缩略图, 推理时间)
+
+    def thumbnail(self, frame):
+        height = max(1, round(self.width * frame.height / frame.width))
+        return frame.to_ndarray(width=self.width, height=height, format="gray")
+
+    def reset(self):
+        self._reference = None
+
+    def mark_inferred(self, thumb, timestamp):
+        """一帧的检测结果返回后，把它的缩略图作为新的参考"""
+        if thumb is not None:
+            self._reference = (thumb, timestamp)
+
+    def changed(self, thumb, now):
+        """与参考缩略图相比是否有明显变化 (没有参考或需要定期刷新时也返回 True)"""
+        reference = self._reference
+        if reference is None:
+            return True
+        ref_thumb, ref_time = reference
+        if ref_thumb.shape != thumb.shape or now - ref_time >= self.refresh_interval:
+            return True
+        diff = np.abs(thumb.astype(np.int16) - ref_thumb.astype(np.int16))
+        return np.count_nonzero(diff > self.pixel_threshold) > self.area_threshold * diff.size
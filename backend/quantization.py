@@ -0,0 +1,124 @@
+# backend/quantization.py
+# ONNX 模型的 INT8 静态量化：用我们自己上传的视频帧做校准 (onnxruntime.quantization)
+import os
+import logging
+
+import av
+import numpy as np
+
+from ai_config import VIDEO_EXTENSIONS
+
+logger = logging.getLogger("Quantization")
+
+
+def letterbox(img, imgsz, color=114):
+    """与 Ultralytics 推理时相同的 letterbox：等比缩放到 imgsz 以内，居中填充成 imgsz x imgsz"""
+    import cv2
+    h, w = img.shape[:2]
+    scale = min(imgsz / h, imgsz / w)
+    new_w, new_h = round(w * scale), round(h * scale)
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    out = np.full((imgsz, imgsz, 3), color, dtype=np.uint8)
+    top, left = (imgsz - new_h) // 2, (imgsz - new_w) // 2
+    out[top:top + new_h, left:left + new_w] = img
+    return out
+
+
+def collect_calibration_frames(source_dir, imgsz, max_frames=200, frames_per_video=50):
+    """
+    从 source_dir 下的视频中均匀抽帧，返回模型尺寸的 BGR 帧列表。
+    多个视频各抽一部分，保证校准数据覆盖不同场景。
+    """
+    if not source_dir or not os.path.isdir(source_dir):
+        return []
+    videos = sorted(f for f in os.listdir(source_dir) if f.lower().endswith(VIDEO_EXTENSIONS))
+    frames = []
+    for name in videos:
+        if len(frames) >= max_frames:
+            break
+        try:
+            container = av.open(os.path.join(source_dir, name))
+        except Exception as e:
+            logger.warning(f"⚠️ Skip calibration video {name}: {e}")
+            continue
+        try:
+            stream = container.streams.video[0]
+            step = max(1, (stream.frames or frames_per_video * 10) // frames_per_video)
+            taken = 0
+            for i, frame in enumerate(container.decode(stream)):
+                if i % step:
+                    continue
+                scale = min(imgsz / frame.width, imgsz / frame.height, 1.0)
+                frames.append(frame.to_ndarray(
+                    width=max(1, round(frame.width * scale)),
+                    height=max(1, round(frame.height * scale)),
+                    format="bgr24",
+                ))
+                taken += 1
+                if taken >= frames_per_video or len(frames) >= max_frames:
+                    break
+        except Exception as e:
+            logger.warning(f"⚠️ Calibration decode failed for {name}: {e}")
+        finally:
+            container.close()
+    logger.info(f"🎞️ Collected {len(frames)} calibration frames from {len(videos)} videos in {source_dir}")
+    return frames
+
+
+def to_model_input(img, imgsz):
+    """BGR uint8 帧 -> (1, 3, imgsz, imgsz) float32 RGB [0, 1]，与导出模型的输入一致"""
+    x = letterbox(img, imgsz)[:, :, ::-1].transpose(2, 0, 1)
+    return np.ascontiguousarray(x, dtype=np.float32)[None] / 255.0
+
+
+class FrameCalibrationReader:
+    """把校准帧逐个喂给 onnxruntime 的静态量化 (CalibrationDataReader 协议)"""
+    def __init__(self, input_name, frames, imgsz):
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._frames = iter(frames)
+
+    def get_next(self):
+        img = next(self._frames, None)
+        if img is None:
+            return None
+        return {self.input_name: to_model_input(img, self.imgsz)}
+
+    def rewind(self):
+        pass
+
+
+def quantize_onnx_int8(fp32_path, int8_path, frames, imgsz):
+    """
+    对 fp32 ONNX 做 INT8 静态量化 (QDQ 格式，权重按通道量化)。
+    只量化 Conv / MatMul，检测头里的 Sigmoid / Softmax / Concat 等保持 fp32，精度损失更小。
+    Ultralytics 的元数据 (names / stride / imgsz) 会被拷贝到量化模型，AutoBackend 可以直接加载。
+    """
+    import onnx
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    if not frames:
+        raise RuntimeError("no calibration frames available")
+
+    input_name = ort.InferenceSession(fp32_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+    logger.info(f"⚖️ Calibrating INT8 model on {len(frames)} frames...")
+    quantize_static(
+        fp32_path,
+        int8_path,
+        FrameCalibrationReader(input_name, frames, imgsz),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        op_types_to_quantize=["Conv", "MatMul"],
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+
+    source = onnx.load(fp32_path, load_external_data=False)
+    quantized = onnx.load(int8_path)
+    existing = {prop.key for prop in quantized.metadata_props}
+    quantized.metadata_props.extend(prop for prop in source.metadata_props if prop.key not in existing)
+    onnx.save(quantized, int8_path)
+    return int8_path
@@ -0,0 +1,140 @@
+# backend/result_codec.py
+# ai_result 的紧凑二进制编码 (客户端在 join 时协商，作为 Socket.IO 二进制附件发送)
+import struct
+
+import numpy as np
+
+RESULT_MAGIC = b"AR"
+RESULT_VERSION = 2
+
+# 标志位
+FLAG_HEARTBEAT = 1    # 目标没有变化的心跳 (见 result_emitter.py)，不带目标
+FLAG_TRACK_IDS = 2    # 目标后面附带 track_id
+FLAG_REUSED = 4       # 画面静止，复用了上一次的检测结果
+
+SOURCES = ("detector", "tracker", "cache")
+SOURCE_IDS = {name: i for i, name in enumerate(SOURCES)}
+
+# 固定头部 (小端，80 字节):
+#   magic "AR", version u8, flags u8, source u8, 保留 u8, count u16,
+#   frame_width u16, frame_height u16, pts i64, time_base_num u32, time_base_den u32,
+#   send_time f64 (毫秒), d_an f32, inference_time f32, fps f32, mean_confidence f32,
+#   frame_id u32, keyframe u32, peer_id 长度 u8, 保留 3 字节,
+#   process_time f32, batch_size u16, queue_depth u16, skipped_frames u32, replaced_frames u32
+# 之后依次是:
+#   peer_id    utf-8 字节
+#   boxes      int16[count, 4]  x1, y1, x2, y2 按 frame_width / frame_height 归一化到 0~32767
+#   confidence uint8[count]     置信度 x 255
+#   class_id   uint8[count]     标签表 (ai_labels) 中的下标，255 表示未知标签
+#   track_id   uint32[count]    仅当 FLAG_TRACK_IDS
+RESULT_HEADER = struct.Struct("<2sBBBxHHHqIIdffffIIB3xfHHII")
+UNKNOWN_LABEL = 255
+BOX_SCALE = 32767
+
+
+class ResultCodec:
+    """
+    二进制结果编码器。标签表 (模型的类别名列表) 在协商时发给客户端一次，之后每个目标只带一个 uint8 类别号。
+    只编码完整结果和心跳；增量 (ai_delta) 仍然以 JSON 发送。
+    没有编码的字段 (与 JSON 结果相比)：ab、adaptive、temporal、emit、media_time 等调试/实验信息，
+    需要它们的客户端使用默认的 JSON 格式。
+    """
+    def __init__(self, names):
+        # names: {class_id: label} (Ultralytics model.names) 或标签列表
+        if isinstance(names, dict):
+            self.labels = [names[i] for i in sorted(names)]
+        else:
+            self.labels = list(names)
+        self.label_ids = {label: i for i, label in enumerate(self.labels) if i < UNKNOWN_LABEL}
+
+    def label_table(self):
+        return {"labels": self.labels}
+
+    def encode(self, result):
+        heartbeat = result.get("type") == "ai_heartbeat"
+        objects = [] if heartbeat else result.get("objects", [])
+        count = len(objects)
+        width = max(1, int(result.get("frame_width") or 1))
+        height = max(1, int(result.get("frame_height") or 1))
+
+        flags = FLAG_HEARTBEAT if heartbeat else 0
+        track_ids = count > 0 and all("track_id" in o for o in objects)
+        if track_ids:
+            flags |= FLAG_TRACK_IDS
+        if result.get("reused"):
+            flags |= FLAG_REUSED
+
+        peer_id = str(result.get("peerId") or "").encode("utf-8")[:255]
+        header = RESULT_HEADER.pack(
+            RESULT_MAGIC, RESULT_VERSION, flags, SOURCE_IDS.get(result.get("source"), 0), count,
+            min(width, 65535), min(height, 65535),
+            int(result.get("pts") or 0), int(result.get("time_base_num") or 0), int(result.get("time_base_den") or 0),
+            float(result.get("send_time") or 0.0), float(result.get("d_an") or 0.0),
+            float(result.get("inference_time") or 0.0), float(result.get("fps") or 0.0),
+            float(result.get("mean_confidence") or 0.0),
+            int(result.get("frame_id") or 0) & 0xFFFFFFFF, int(result.get("keyframe") or 0) & 0xFFFFFFFF,
+            len(peer_id),
+            float(result.get("process_time") or 0.0), min(int(result.get("batch_size") or 0), 65535),
+            min(int(result.get("queue_depth") or 0), 65535),
+            int(result.get("skipped_frames") or 0) & 0xFFFFFFFF, int(result.get("replaced_frames") or 0) & 0xFFFFFFFF,
+        )
+        if count == 0:
+            return header + peer_id
+
+        boxes = np.array([o["bbox"] for o in objects], dtype=np.float32)
+        boxes /= np.array([width, height, width, height], dtype=np.float32)
+        boxes = np.clip(np.round(boxes * BOX_SCALE), -32768, 32767).astype("<i2")
+        confs = np.clip(np.round(np.array([o["confidence"] for o in objects], dtype=np.float32) * 255), 0, 255)
+        classes = [self.label_ids.get(o["label"], UNKNOWN_LABEL) for o in objects]
+        parts = [header, peer_id, boxes.tobytes(), confs.astype(np.uint8).tobytes(),
+                 np.array(classes, dtype=np.uint8).tobytes()]
+        if track_ids:
+            parts.append(np.array([o["track_id"] for o in objects], dtype="<u4").tobytes())
+        return b"".join(parts)
+
+    def decode(self, data):
+        """encode 的逆操作 (测试和 Python 客户端使用)，返回与 JSON ai_result 相同结构的 dict"""
+        buffer = memoryview(data)
+        (magic, version, flags, source, count, width, height, pts, tb_num, tb_den, send_time, d_an,
+         inference_time, fps, mean_conf, frame_id, keyframe, peer_len, process_time, batch_size, queue_depth,
+         skipped_frames, replaced_frames) = RESULT_HEADER.unpack_from(buffer, 0)
+        if magic != RESULT_MAGIC or version != RESULT_VERSION:
+            raise ValueError(f"invalid binary ai_result header: {magic!r} v{version}")
+        offset = RESULT_HEADER.size
+        peer_id = bytes(buffer[offset:offset + peer_len]).decode("utf-8")
+        offset += peer_len
+        result = {
+            "type": "ai_heartbeat" if flags & FLAG_HEARTBEAT else "ai_result",
+            "source": SOURCES[source] if source < len(SOURCES) else "detector",
+            "peerId": peer_id, "frame_id": frame_id, "keyframe": keyframe,
+            "pts": pts, "timestamp": pts, "time_base_num": tb_num, "time_base_den": tb_den,
+            "frame_width": width, "frame_height": height, "send_time": send_time,
+            "d_an": round(d_an, 2), "inference_time": round(inference_time, 2), "fps": round(fps, 1),
+            "reused": bool(flags & FLAG_REUSED),
+        }
+        if flags & FLAG_HEARTBEAT:
+            # 心跳不带置信度和这些统计 (编码为 0)，客户端沿用上一条完整结果里的值
+            return result
+        result.update({
+            "mean_confidence": round(mean_conf, 4),
+            "process_time": round(process_time, 2), "batch_size": batch_size, "queue_depth": queue_depth,
+            "skipped_frames": skipped_frames, "replaced_frames": replaced_frames,
+        })
+        boxes = np.frombuffer(buffer, dtype="<i2", count=count * 4, offset=offset).reshape(count, 4)
+        offset += count * 8
+        confs = np.frombuffer(buffer, dtype=np.uint8, count=count, offset=offset)
+        offset += count
+        classes = np.frombuffer(buffer, dtype=np.uint8, count=count, offset=offset)
+        offset += count
+        scale = np.array([width, height, width, height], dtype=np.float32) / BOX_SCALE
+        boxes = np.round(boxes * scale).astype(int).tolist()
+        objects = [
+            {"label": self.labels[c] if c < len(self.labels) else "unknown", "bbox": b,
+             "confidence": round(float(conf) / 255, 2)}
+            for b, conf, c in zip(boxes, confs, classes)
+        ]
+        if flags & FLAG_TRACK_IDS:
+            for o, tid in zip(objects, np.frombuffer(buffer, dtype="<u4", count=count, offset=offset)):
+                o["track_id"] = int(tid)
+        result["objects"] = objects
+        return result
@@ -0,0 +1,149 @@
+# backend/result_emitter.py
+import time
+import asyncio
+import logging
+
+import numpy as np
+
+from box_ops import box_iou
+
+logger = logging.getLogger("ResultEmitter")
+
+# 心跳/增量消息里保留的字段 (同步和延迟统计需要的部分)，其余字段只在完整结果里发送
+HEARTBEAT_FIELDS = ("peerId", "source", "frame_id", "pts", "send_time", "timestamp", "time_base_num",
+                    "time_base_den", "frame_width", "frame_height", "d_an", "fps", "inference_time")
+
+
+def objects_changed(prev, curr, iou_threshold=0.9, conf_threshold=0.05):
+    """
+    判断两组 objects 是否有实质变化：数量不同、类别不同、任一目标的 IoU 低于阈值或置信度变化超过阈值。
+    有 track_id 时按 track_id 配对，否则按同类别 IoU 最大配对。
+    """
+    if len(prev) != len(curr):
+        return True
+    if not curr:
+        return False
+    if all("track_id" in o for o in prev) and all("track_id" in o for o in curr):
+        by_id = {o["track_id"]: o for o in prev}
+        if set(by_id) != {o["track_id"] for o in curr}:
+            return True
+        prev = [by_id[o["track_id"]] for o in curr]
+        pairs = np.arange(len(curr))
+    else:
+        ious = box_iou([o["bbox"] for o in curr], [o["bbox"] for o in prev])
+        same = np.array([[c["label"] == p["label"] for p in prev] for c in curr])
+        ious = np.where(same, ious, -1.0)
+        pairs = ious.argmax(axis=1)
+        if len(set(pairs.tolist())) != len(pairs):
+            return True
+    curr_boxes = np.array([o["bbox"] for o in curr], dtype=np.float32)
+    prev_boxes = np.array([prev[j]["bbox"] for j in pairs], dtype=np.float32)
+    ious = np.diag(box_iou(curr_boxes, prev_boxes))
+    conf_diff = np.abs(np.array([o["confidence"] for o in curr]) - np.array([prev[j]["confidence"] for j in pairs]))
+    labels_differ = any(o["label"] != prev[j]["label"] for o, j in zip(curr, pairs))
+    return bool(labels_differ or (ious < iou_threshold).any() or (conf_diff > conf_threshold).any())
+
+
+class ResultEmitter:
+    """
+    每个会话一个的结果发送阶段 (在 ai_result 交给 Socket.IO 之前)，三个行为都可以通过会话 config 单独开启：
+    - emit_suppress: 目标与上一次发出的结果相比没有超过 suppress_iou / suppress_conf 的变化时，
+                     只发送一个很小的心跳 (type "ai_heartbeat"，前端继续使用之前的框)；
+                     每隔 keyframe_interval 秒仍然发送一次完整结果
+    - emit_delta: 所有目标都有 track_id 时，相对最近一次完整结果 (关键帧) 只发送 added / removed / moved
+                  (type "ai_delta")；每隔 keyframe_interval 秒发送一次完整结果，新加入房间的观看者据此同步。
+                  增量总是相对关键帧而不是上一条增量，中间丢失/合并的消息不影响后续增量
+    - emit_coalesce: 上一次发送还没完成时，新结果只替换待发送的那一条 (latest-wins)，
+                     发送端积压时多个结果合并成一次 emit (coalesced 计数)
+    send 为异步的发送函数 send(payload)。
+    """
+    def __init__(self, send):
+        self.send = send
+        # 客户端当前看到的目标 (完整结果或增量应用之后)，用于变化抑制
+        self._shown = None
+        # 增量的基准：最近一次完整结果
+        self._keyframe = None           # {track_id: object}
+        self._keyframe_seq = 0
+        self._keyframe_time = 0.0
+        # latest-wins 的待发送结果
+        self._pending = None
+        self._task = None
+
+        # 统计信息
+        self.full = 0
+        self.deltas = 0
+        self.heartbeats = 0
+        self.coalesced = 0
+
+    def submit(self, result, config):
+        """交给发送阶段 (不等待发送完成)"""
+        if not config.get("emit_coalesce"):
+            payload = self.encode(result, config)
+            asyncio.create_task(self._send(payload))
+            return
+        if self._pending is not None:
+            self.coalesced += 1
+        self._pending = (result, config)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        # 编码放在取出待发送结果之后：合并掉的结果不做任何序列化/比较
+        while self._pending is not None:
+            result, config = self._pending
+            self._pending = None
+            await self._send(self.encode(result, config))
+
+    async def _send(self, payload):
+        try:
+            await self.send(payload)
+        except Exception as e:
+            logger.error(f"❌ Failed to emit result: {e}")
+
+    def encode(self, result, config):
+        """把一条完整结果编码成实际发送的消息：完整结果 / 增量 / 心跳"""
+        objects = result.get("objects", [])
+        now = time.time()
+        # 关键帧到期时无论画面是否变化都发送完整结果：之后加入房间的观看者只能从完整结果开始同步
+        keyframe_due = now - self._keyframe_time >= config.get("keyframe_interval", 2.0)
+        if (config.get("emit_suppress") and self._shown is not None and not keyframe_due
+                and not objects_changed(self._shown, objects,
+                                        config.get("suppress_iou", 0.9), config.get("suppress_conf", 0.05))):
+            self.heartbeats += 1
+            payload = {key: result[key] for key in HEARTBEAT_FIELDS if key in result}
+            payload["type"] = "ai_heartbeat"
+            payload["keyframe"] = self._keyframe_seq
+            return payload
+
+        self._shown = objects
+        tracked = all("track_id" in o for o in objects)
+        if config.get("emit_delta") and tracked and self._keyframe is not None and not keyframe_due:
+            return self._delta(result, objects)
+
+        # 完整结果 (关键帧)
+        self.full += 1
+        self._keyframe_seq += 1
+        self._keyframe_time = now
+        self._keyframe = {o["track_id"]: o for o in objects} if tracked else None
+        payload = dict(result)
+        payload["keyframe"] = self._keyframe_seq
+        payload["emit"] = self.stats()
+        return payload
+
+    def _delta(self, result, objects):
+        self.deltas += 1
+        keyframe = self._keyframe
+        current = {o["track_id"]: o for o in objects}
+        payload = {key: result[key] for key in HEARTBEAT_FIELDS if key in result}
+        payload.update({
+            "type": "ai_delta",
+            "keyframe": self._keyframe_seq,
+            "added": [o for tid, o in current.items() if tid not in keyframe],
+            "removed": [tid for tid in keyframe if tid not in current],
+            "moved": [o for tid, o in current.items() if tid in keyframe and o != keyframe[tid]],
+            "mean_confidence": result.get("mean_confidence"),
+        })
+        return payload
+
+    def stats(self):
+        return {"full": self.full, "deltas": self.deltas, "heartbeats": self.heartbeats, "coalesced": self.coalesced}
@@ -0,0 +1,146 @@
+# compare_engines.py
+# 推理引擎对比：在同一组固定帧上比较 pytorch / onnx / openvino / torchscript 的延迟，
+# 并以 pytorch 的检测结果作为参考，计算各引擎的 mAP 一致性 (parity)
+import os
+import sys
+import time
+import logging
+
+import av
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from ai_processor import AIProcessor, model_input_size
+from box_ops import box_iou
+
+# ================= 配置区域 =================
+VIDEO_FILE = "part1.mp4"
+NUM_FRAMES = 100                  # 从视频中均匀抽取的固定帧数
+WEIGHTS = "yolov8n.pt"
+IMGSZ = 640
+ENGINES = ["pytorch", "onnx", "torchscript", "openvino"]
+REFERENCE_ENGINE = "pytorch"
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+# NumPy 2.0 新增 np.trapezoid，np.trapz 从此弃用 (之后的版本会移除)，老版本回退到 np.trapz
+trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("EngineBench")
+
+
+def load_frames(path, count, imgsz):
+    """均匀抽取 count 帧，并按服务端同样的方式在 libav 中缩放到模型尺寸"""
+    container = av.open(path)
+    stream = container.streams.video[0]
+    total = stream.frames or 1000
+    step = max(1, total // count)
+    frames = []
+    for i, frame in enumerate(container.decode(stream)):
+        if i % step == 0:
+            w, h = model_input_size(frame.width, frame.height, imgsz)
+            frames.append(frame.to_ndarray(width=w, height=h, format="bgr24"))
+        if len(frames) >= count:
+            break
+    container.close()
+    return frames
+
+
+def average_precision(recall, precision):
+    """COCO 风格的 101 点插值 AP"""
+    mrec = np.concatenate([[0.0], recall, [1.0]])
+    mpre = np.concatenate([[1.0], precision, [0.0]])
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return float(trapezoid(np.interp(x, mrec, mpre), x))
+
+
+def map_against_reference(preds, refs, iou_thr):
+    """把参考引擎的检测当作真值，计算 preds 的 mAP (按类别平均)"""
+    classes = set()
+    for d in refs:
+        classes.update(d[:, 5].astype(int).tolist())
+    aps = []
+    for c in classes:
+        scores, hits, n_gt = [], [], 0
+        for p, r in zip(preds, refs):
+            gt = r[r[:, 5] == c]
+            det = p[p[:, 5] == c]
+            n_gt += len(gt)
+            if len(det) == 0:
+                continue
+            det = det[np.argsort(-det[:, 4])]
+            matched = np.zeros(len(gt), dtype=bool)
+            ious = box_iou(det[:, :4], gt[:, :4])
+            for k in range(len(det)):
+                scores.append(det[k, 4])
+                j = int(np.argmax(ious[k])) if len(gt) else -1
+                if j >= 0 and ious[k, j] >= iou_thr and not matched[j]:
+                    matched[j] = True
+                    hits.append(1)
+                else:
+                    hits.append(0)
+        if n_gt == 0:
+            continue
+        order = np.argsort(-np.array(scores))
+        tp = np.cumsum(np.array(hits)[order]) if hits else np.zeros(0)
+        fp = np.cumsum(1 - np.array(hits)[order]) if hits else np.zeros(0)
+        recall = tp / n_gt
+        precision = tp / np.maximum(tp + fp, 1e-9)
+        aps.append(average_precision(recall, precision))
+    return float(np.mean(aps)) if aps else 1.0
+
+
+def run_engine(kind, frames):
+    processor = AIProcessor(engine=kind, weights=WEIGHTS, imgsz=IMGSZ)
+    if not processor.load():
+        raise RuntimeError(processor.error)
+    latencies, dets = [], []
+    for img in frames:
+        start = time.perf_counter()
+        dets.append(processor.detect([img])[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies), dets
+
+
+def main():
+    if not os.path.exists(VIDEO_FILE):
+        logger.error(f"Video file not found: {VIDEO_FILE}")
+        return
+    frames = load_frames(VIDEO_FILE, NUM_FRAMES, IMGSZ)
+    logger.info(f"Loaded {len(frames)} frames ({frames[0].shape[1]}x{frames[0].shape[0]})")
+
+    outputs = {}
+    for kind in ENGINES:
+        try:
+            outputs[kind] = run_engine(kind, frames)
+        except Exception as e:
+            logger.warning(f"⚠️ Engine {kind} unavailable: {e}")
+
+    if REFERENCE_ENGINE not in outputs:
+        logger.error("Reference engine failed, cannot compute parity")
+        return
+    refs = outputs[REFERENCE_ENGINE][1]
+
+    rows = []
+    for kind, (latencies, dets) in outputs.items():
+        rows.append({
+            "engine": kind,
+            "mean_ms": round(latencies.mean(), 2),
+            "p50_ms": round(np.percentile(latencies, 50), 2),
+            "p95_ms": round(np.percentile(latencies, 95), 2),
+            "fps": round(1000 / latencies.mean(), 1),
+            "map50_vs_ref": round(map_against_reference(dets, refs, 0.5), 4),
+            "map50_95_vs_ref": round(np.mean([map_against_reference(dets, refs, t) for t in IOU_THRESHOLDS]), 4),
+            "mean_objects": round(np.mean([len(d) for d in dets]), 2),
+        })
+
+    df = pd.DataFrame(rows)
+    print(df.to_string(index=False))
+    df.to_csv("engine_comparison.csv", index=False)
+    print("\n📊 数据已保存至 engine_comparison.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# check_packed.py
+# 二进制打包关键点的往返校验：encode_packed / 前端 packKeypoints 打包 -> decode_packed 解码，
+# 覆盖 float32、int16 (量化误差在半个量化步长以内) 和 3 通道布局 (解码后 score 补 1)。
+# 前端部分用 node 直接 import keypointsLoader.js，没有 node 时跳过。
+import os
+import sys
+import json
+import base64
+import shutil
+import subprocess
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from keypoints import MAX_HANDS, NUM_LANDMARKS, encode_packed, decode_packed, frames_to_array
+
+LOADER_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..",
+                                           "frontend", "src", "utils", "keypointsLoader.js"))
+FRAMES = 7
+
+
+def make_frames(rng):
+    """随机生成 JSON 形式的关键点序列：包含缺手、不完整的手、只有 xyz 的点"""
+    frames = []
+    for f in range(FRAMES):
+        hands = []
+        for h in range(rng.integers(0, MAX_HANDS + 1)):
+            n = NUM_LANDMARKS if (f + h) % 3 else int(rng.integers(1, NUM_LANDMARKS))
+            points = rng.uniform(-1.5, 1.5, size=(n, 4)).round(4)
+            points[:, 3] = np.abs(points[:, 3])
+            landmarks = [p[:3].tolist() if h == 1 else p.tolist() for p in points]
+            hands.append({"landmarks": landmarks})
+        frames.append({"hands": hands})
+    return frames
+
+
+def int16_tolerance(keypoints):
+    """int16 反量化的最大误差：每个通道半个量化步长 (peak / 32767 / 2)"""
+    peak = np.abs(keypoints).reshape(-1, keypoints.shape[-1]).max(axis=0)
+    return peak / 32767 * 0.5 + 1e-6
+
+
+def check(name, decoded, expected_kp, expected_counts, atol=0.0):
+    keypoints, counts = decoded
+    assert keypoints.shape == expected_kp.shape, f"{name}: shape {keypoints.shape} != {expected_kp.shape}"
+    assert keypoints.dtype == np.float32, f"{name}: dtype {keypoints.dtype}"
+    np.testing.assert_array_equal(counts, expected_counts, err_msg=name)
+    if np.isscalar(atol) and atol == 0.0:
+        np.testing.assert_array_equal(keypoints, expected_kp, err_msg=name)
+    else:
+        err = np.abs(keypoints - expected_kp).reshape(-1, expected_kp.shape[-1]).max(axis=0)
+        assert np.all(err <= atol), f"{name}: max error {err} > {atol}"
+    print(f"✅ {name}")
+
+
+def check_python(expected_kp, expected_counts):
+    check("python float32", decode_packed(encode_packed(expected_kp, expected_counts)), expected_kp, expected_counts)
+    check("python int16", decode_packed(encode_packed(expected_kp, expected_counts, dtype="int16")),
+          expected_kp, expected_counts, atol=int16_tolerance(expected_kp))
+
+    # 3 通道 (只有 xyz)：解码后 score 统一为 1
+    expected_xyz = expected_kp.copy()
+    expected_xyz[..., 3] = 1.0
+    check("python float32 3-channel", decode_packed(encode_packed(expected_kp[..., :3], expected_counts)),
+          expected_xyz, expected_counts)
+    check("python int16 3-channel",
+          decode_packed(encode_packed(expected_kp[..., :3], expected_counts, dtype="int16")),
+          expected_xyz, expected_counts, atol=np.append(int16_tolerance(expected_kp[..., :3]), 0.0))
+
+    # 空序列
+    empty = np.zeros((0, MAX_HANDS, NUM_LANDMARKS, 4), dtype=np.float32)
+    check("python empty", decode_packed(encode_packed(empty, np.zeros((0, MAX_HANDS)))), empty,
+          np.zeros((0, MAX_HANDS), dtype=np.int32))
+
+
+def pack_with_node(frames, quantize):
+    """用 node 调用前端 packKeypoints，返回打包后的 bytes"""
+    script = (
+        f"import {{ packKeypoints }} from {json.dumps('file://' + LOADER_PATH)};\n"
+        "let input = '';\n"
+        "process.stdin.on('data', (chunk) => { input += chunk });\n"
+        "process.stdin.on('end', () => {\n"
+        "  const { frames, quantize } = JSON.parse(input);\n"
+        "  process.stdout.write(Buffer.from(packKeypoints(frames, { quantize })).toString('base64'));\n"
+        "});\n"
+    )
+    result = subprocess.run(["node", "--input-type=module", "-e", script], input=json.dumps(
+        {"frames": frames, "quantize": quantize}), capture_output=True, text=True, check=True)
+    return base64.b64decode(result.stdout)
+
+
+def check_frontend(frames, expected_kp, expected_counts):
+    if shutil.which("node") is None:
+        print("⚠️ node 不可用，跳过前端 packKeypoints 校验")
+        return
+    check("frontend float32", decode_packed(pack_with_node(frames, False)), expected_kp, expected_counts)
+    check("frontend int16", decode_packed(pack_with_node(frames, True)),
+          expected_kp, expected_counts, atol=int16_tolerance(expected_kp))
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    frames = make_frames(rng)
+    expected_kp, expected_counts = frames_to_array(frames)
+    check_python(expected_kp, expected_counts)
+    check_frontend(frames, expected_kp, expected_counts)
+    print("🎉 packed keypoints round-trip OK")
@@ -0,0 +1,80 @@
+# bench_frame_buffer.py
+# 微基准：帧入队 + 生成推理请求的热路径，对比镜像环形缓冲区 (旧：每帧写两次 + 每次推理拷贝一份)
+# 与引用式环形缓冲区 (新：只保存 to_ndarray 返回的数组引用，推理直接使用)。
+# 统计每帧的像素拷贝字节数 (tracemalloc 峰值) 和耗时；to_ndarray 本身的分配两者相同，用 np.empty 模拟。
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from frame_buffer import FrameRingBuffer
+
+# ================= 配置区域 =================
+FRAME_SHAPE = (360, 640, 3)       # 720p 缩放到模型尺寸后的 bgr24 帧
+FRAMES = 600
+CHUNK_SIZES = [1, 4]               # chunk_size (stride = 1，每帧推理一次)
+
+
+class MirroredRingBuffer:
+    """旧实现：预分配 (2 * capacity, H, W, 3)，每帧写入槽位 i 和镜像槽位 i + capacity"""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._frames = None
+        self._head = 0
+
+    def append(self, img):
+        if self._frames is None:
+            self._frames = np.empty((2 * self.capacity,) + img.shape, dtype=img.dtype)
+        i = self._head
+        self._frames[i] = img
+        self._frames[i + self.capacity] = img
+        self._head = (i + 1) % self.capacity
+
+    def latest(self):
+        return self._frames[(self._head - 1) % self.capacity]
+
+
+def run_legacy(chunk_size):
+    ring = MirroredRingBuffer(chunk_size)
+    requests = []
+    for _ in range(FRAMES):
+        img = np.empty(FRAME_SHAPE, dtype=np.uint8)    # frame.to_ndarray
+        ring.append(img)
+        requests.append(ring.latest().copy())           # 槽位会被覆盖，推理前拷贝
+        requests.pop(0) if len(requests) > 2 else None
+    return requests
+
+
+def run_current(chunk_size):
+    ring = FrameRingBuffer(chunk_size)
+    requests = []
+    for i in range(FRAMES):
+        img = np.empty(FRAME_SHAPE, dtype=np.uint8)    # frame.to_ndarray
+        ring.append(img, time.time(), i)
+        requests.append(ring.latest()[0])               # 直接移交引用
+        requests.pop(0) if len(requests) > 2 else None
+    return requests
+
+
+def measure(fn, chunk_size):
+    fn(chunk_size)   # 预热
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn(chunk_size)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / FRAMES * 1e6, peak
+
+
+if __name__ == "__main__":
+    frame_bytes = int(np.prod(FRAME_SHAPE))
+    print(f"frame {FRAME_SHAPE} = {frame_bytes / 1024:.0f} KB, {FRAMES} frames")
+    print(f"{'chunk':>5} | {'impl':<8} | {'us/frame':>9} | {'pixel copies/frame':>18} | {'peak MB':>8}")
+    for chunk_size in CHUNK_SIZES:
+        for name, fn, copies in (("legacy", run_legacy, 3), ("current", run_current, 0)):
+            us, peak = measure(fn, chunk_size)
+            print(f"{chunk_size:>5} | {name:<8} | {us:>9.1f} | {copies:>18} | {peak / 1e6:>8.2f}")
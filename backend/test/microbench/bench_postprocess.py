@@ -0,0 +1,78 @@
+# bench_postprocess.py
+# 微基准：对比逐框后处理 (旧) 与向量化后处理 (新) 在 0/10/50 个检测框时的单帧耗时
+import os
+import sys
+import timeit
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from ai_processor import extract_detections, build_objects
+
+# ================= 配置区域 =================
+DETECTION_COUNTS = [0, 10, 50]
+REPEAT = 2000
+ORIG_SHAPE = (360, 640)           # 模型输入尺寸的帧 (720p 缩放后)
+SCALE_X, SCALE_Y = 2.0, 2.0        # 映射回 1280x720
+NAMES = {i: f"class_{i}" for i in range(80)}
+
+
+def make_result(n, seed=0):
+    """构造一个含 n 个框的 Ultralytics Results (与真实推理输出结构一致)"""
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 300, size=(n, 2))
+    wh = rng.uniform(10, 200, size=(n, 2))
+    data = np.concatenate([
+        xy, xy + wh,
+        rng.uniform(0.25, 1.0, size=(n, 1)),
+        rng.integers(0, 80, size=(n, 1)),
+    ], axis=1).astype(np.float32)
+    img = np.zeros(ORIG_SHAPE + (3,), dtype=np.uint8)
+    return Results(img, path="", names=NAMES, boxes=torch.from_numpy(data))
+
+
+def legacy_postprocess(result):
+    """旧实现：每个框单独做张量 -> numpy 转换并逐个构建 dict"""
+    box_scale = np.array([SCALE_X, SCALE_Y, SCALE_X, SCALE_Y])
+    detections = []
+    mean_conf = 0
+    for box in result.boxes:
+        conf = float(box.conf[0].cpu().numpy())
+        mean_conf += conf
+        detections.append({
+            "label": NAMES[int(box.cls[0])],
+            "bbox": (box.xyxy[0].cpu().numpy() * box_scale).astype(int).tolist(),
+            "confidence": round(conf, 2)
+        })
+    if len(result.boxes) > 0:
+        mean_conf /= len(result.boxes)
+    return detections, mean_conf
+
+
+def vectorized_postprocess(result):
+    """新实现：一次性取出 (N, 6) 数组，numpy 计算后批量构建 objects"""
+    return build_objects(extract_detections(result), NAMES, SCALE_X, SCALE_Y)
+
+
+def main():
+    print(f"后处理微基准 (每组重复 {REPEAT} 次，单位: 微秒/帧)")
+    print(f"{'检测数':>6} | {'逐框(旧)':>10} | {'向量化(新)':>10} | {'加速比':>6}")
+    print("-" * 44)
+    for n in DETECTION_COUNTS:
+        result = make_result(n)
+
+        # 结果一致性检查
+        old_objs, old_mean = legacy_postprocess(result)
+        new_objs, new_mean = vectorized_postprocess(result)
+        assert [o["label"] for o in old_objs] == [o["label"] for o in new_objs]
+        assert abs(old_mean - new_mean) < 1e-4
+
+        t_old = timeit.timeit(lambda: legacy_postprocess(result), number=REPEAT) / REPEAT * 1e6
+        t_new = timeit.timeit(lambda: vectorized_postprocess(result), number=REPEAT) / REPEAT * 1e6
+        print(f"{n:>6} | {t_old:>10.1f} | {t_new:>10.1f} | {t_old / t_new:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
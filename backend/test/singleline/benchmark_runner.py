@@ -28,6 +28,9 @@ CONFIGS = [
     {"res": (1280, 720), "fps": 30, "duration": 20},
 ]
 
+# 会话实验参数 (连接后通过 update_config 下发)，例如 {"roi_mode": True} 对比 ROI 裁剪推理
+SESSION_CONFIG = {}
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("Benchmark")
 logging.getLogger("aioice.ice").setLevel(logging.ERROR)
@@ -84,6 +87,8 @@ class BenchmarkClient:
 
         self.running = True
         await self.sio.emit('join', {'roomId': self.room_id, 'peerId': self.peer_id}, namespace='/ai_analysis')
+        if SESSION_CONFIG:
+            await self.sio.emit('update_config', SESSION_CONFIG, namespace='/ai_analysis')
         
         track = FileVideoTrack(VIDEO_FILE, self.config['fps'])
         self.pc.addTrack(track)
@@ -111,6 +116,8 @@ class BenchmarkClient:
         @self.sio.on('ai_result', namespace='/ai_analysis')
         async def on_ai_result(data):
             if not self.running: return
+            # 只统计检测器真正推理的结果：复用 (motion_gate) / 跟踪补帧的结果没有推理耗时，会拉低平均值
+            if data.get('reused') or data.get('source', 'detector') != 'detector': return
             
             recv_time = time.time()
             send_time_ms = data.get('send_time')
@@ -105,6 +105,8 @@ class ResearchExperiment:
         @self.sio.on('ai_result', namespace='/ai_analysis')
         async def on_result(data):
             if not self.running or not hasattr(self, 'current_exp_config'): return
+            # 只统计检测器真正推理的结果：复用 (motion_gate) / 跟踪补帧的结果没有推理耗时，会拉低平均值
+            if data.get('reused') or data.get('source', 'detector') != 'detector': return
             
             recv_time = time.time()
             send_time_ms = data.get('send_time')
@@ -0,0 +1,113 @@
+# bench_worker_pool.py
+# 推理 worker 池基准：对比不同的 workers x threads 组合 (如 1x16 / 4x4 / 8x2) 在多路并发下的吞吐和延迟
+import os
+import sys
+import time
+import asyncio
+import logging
+from fractions import Fraction
+
+import av
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from ai_processor import AIProcessor, InferenceRequest, model_input_size
+from inference_scheduler import InferenceScheduler
+from worker_pool import physical_core_count
+
+# ================= 配置区域 =================
+VIDEO_FILE = "part1.mp4"
+NUM_FRAMES = 30                   # 循环使用的帧数
+SESSIONS = 8                      # 并发会话数 (每个会话收到结果后立即提交下一帧)
+DURATION = 20                     # 每组配置运行秒数
+WORKER_MODE = "thread"            # thread / process
+PIN_CPUS = True
+MAX_BATCH_SIZE = 8
+# (workers, threads_per_worker)，超过物理核心数的组合会被 worker_pool 按预算收缩
+CONFIGS = [(1, 16), (2, 8), (4, 4), (8, 2), (16, 1)]
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("WorkerBench")
+
+
+def load_frames(path, count, imgsz=640):
+    container = av.open(path)
+    frames = []
+    for frame in container.decode(video=0):
+        w, h = model_input_size(frame.width, frame.height, imgsz)
+        frames.append((frame.to_ndarray(width=w, height=h, format="bgr24"), (frame.width, frame.height)))
+        if len(frames) >= count:
+            break
+    container.close()
+    return frames
+
+
+async def run_session(scheduler, session_id, frames, deadline, latencies):
+    time_base = Fraction(1, 90000)
+    i = 0
+    while time.time() < deadline:
+        image, src_size = frames[i % len(frames)]
+        start = time.time()
+        request = InferenceRequest(session_id, image, i * 3000, time_base, i, start, src_size)
+        if await scheduler.infer(request) is not None:
+            latencies.append((time.time() - start) * 1000)
+        i += 1
+
+
+async def run_config(workers, threads, frames):
+    processor = AIProcessor()
+    scheduler = InferenceScheduler(
+        processor, max_batch_size=MAX_BATCH_SIZE, num_workers=workers,
+        worker_mode=WORKER_MODE, threads_per_worker=threads, pin_cpus=PIN_CPUS,
+    )
+    await asyncio.get_running_loop().run_in_executor(None, scheduler.warmup)
+    if not processor.is_ready:
+        raise RuntimeError(processor.error)
+
+    latencies = []
+    start = time.time()
+    deadline = start + DURATION
+    await asyncio.gather(*[
+        run_session(scheduler, f"s{k}", frames, deadline, latencies) for k in range(SESSIONS)
+    ])
+    elapsed = time.time() - start
+    stats = scheduler.stats()
+    scheduler.shutdown()
+
+    latencies = np.array(latencies)
+    return {
+        "config": f"{workers}x{threads}",
+        "workers": workers,
+        "threads_per_worker": stats["worker_pool"]["threads_per_worker"],
+        "mode": WORKER_MODE,
+        "throughput_fps": round(len(latencies) / elapsed, 2),
+        "latency_p50_ms": round(np.percentile(latencies, 50), 2),
+        "latency_p95_ms": round(np.percentile(latencies, 95), 2),
+        "avg_batch_size": stats["avg_batch_size"],
+    }
+
+
+async def main():
+    if not os.path.exists(VIDEO_FILE):
+        logger.error(f"Video file not found: {VIDEO_FILE}")
+        return
+    frames = load_frames(VIDEO_FILE, NUM_FRAMES)
+    logger.info(f"Physical cores: {physical_core_count()} | sessions: {SESSIONS} | mode: {WORKER_MODE}")
+
+    rows = []
+    for workers, threads in CONFIGS:
+        logger.info(f"   -> Testing {workers} workers x {threads} threads")
+        try:
+            rows.append(await run_config(workers, threads, frames))
+        except Exception as e:
+            logger.error(f"❌ {workers}x{threads} failed: {e}")
+
+    df = pd.DataFrame(rows)
+    print(df.to_string(index=False))
+    df.to_csv("worker_pool_benchmark.csv", index=False)
+    print("\n📊 数据已保存至 worker_pool_benchmark.csv")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+# backend/tracker.py
+import itertools
+
+import numpy as np
+
+from box_ops import box_iou
+
+
+class Track:
+    """
+    单个目标的轨迹：中心点用 alpha-beta 滤波 (简化的恒速 Kalman) 估计位置和速度，
+    宽高做指数平滑。坐标为原始分辨率像素，时间为流时间 (pts * time_base，秒)。
+    """
+    __slots__ = ("track_id", "cls", "conf", "center", "size", "velocity", "t", "hits", "misses")
+
+    def __init__(self, track_id, box, conf, cls, t):
+        self.track_id = track_id
+        self.cls = cls
+        self.conf = conf
+        self.center = (box[:2] + box[2:]) / 2
+        self.size = box[2:] - box[:2]
+        self.velocity = np.zeros(2, dtype=np.float64)
+        self.t = t
+        self.hits = 1
+        self.misses = 0
+
+    def box_at(self, t, max_dt):
+        """把框按速度外推到时间 t (外推时长不超过 max_dt 秒)"""
+        dt = min(max(t - self.t, 0.0), max_dt)
+        center = self.center + self.velocity * dt
+        half = self.size / 2
+        return np.concatenate([center - half, center + half])
+
+    def update(self, box, conf, cls, t, alpha, beta, max_dt):
+        dt = t - self.t
+        measured = (box[:2] + box[2:]) / 2
+        if 0 < dt <= max_dt:
+            predicted = self.center + self.velocity * dt
+            residual = measured - predicted
+            self.center = predicted + alpha * residual
+            self.velocity = self.velocity + beta * residual / dt
+        else:
+            # 时间倒退或间隔过长 (断流/重置)：直接采用测量值，速度清零
+            self.center = measured
+            self.velocity[:] = 0
+        self.size = alpha * (box[2:] - box[:2]) + (1 - alpha) * self.size
+        self.conf = conf
+        self.cls = cls
+        self.t = max(self.t, t)
+        self.hits += 1
+        self.misses = 0
+
+
+class MultiObjectTracker:
+    """
+    轻量级 IoU 多目标跟踪器 (每个会话一个，纯 numpy，单帧开销在微秒级)。
+    - update: 检测器给出一帧结果时调用，按 IoU 贪心匹配 (同类别)，为每个检测分配稳定的 track_id
+    - predict: 检测器两次调用之间，把已确认的轨迹按速度外推到任意时刻 (当前帧的 PTS)
+    """
+    def __init__(self, iou_threshold=0.3, max_misses=3, alpha=0.6, beta=0.2, max_predict=0.5):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses    # 连续多少次检测没匹配上就删除轨迹
+        self.alpha = alpha              # 位置修正系数 (越大越相信检测)
+        self.beta = beta                # 速度修正系数
+        self.max_predict = max_predict  # 最多外推多少秒，避免检测中断时框飞出画面
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def reset(self):
+        self.tracks = []
+
+    def update(self, boxes, confs, classes, t):
+        """
+        boxes: (N, 4) 原始分辨率的 xyxy；confs / classes: (N,)；t: 检测帧的流时间 (秒)。
+        返回与检测一一对应的 track_id 列表。
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        track_ids = [0] * len(boxes)
+        matched_tracks = set()
+
+        if self.tracks and len(boxes):
+            predicted = np.stack([track.box_at(t, self.max_predict) for track in self.tracks])
+            ious = box_iou(boxes, predicted)
+            track_classes = np.array([track.cls for track in self.tracks])
+            ious[np.asarray(classes)[:, None] != track_classes[None, :]] = 0
+            # 贪心匹配：IoU 从大到小依次配对
+            for flat in np.argsort(-ious, axis=None):
+                d, k = divmod(int(flat), len(self.tracks))
+                if ious[d, k] < self.iou_threshold:
+                    break
+                if track_ids[d] or k in matched_tracks:
+                    continue
+                track = self.tracks[k]
+                track.update(boxes[d], float(confs[d]), int(classes[d]), t, self.alpha, self.beta, self.max_predict)
+                track_ids[d] = track.track_id
+                matched_tracks.add(k)
+
+        survivors = []
+        for k, track in enumerate(self.tracks):
+            if k not in matched_tracks:
+                track.misses += 1
+            if track.misses <= self.max_misses:
+                survivors.append(track)
+        for d in range(len(boxes)):
+            if not track_ids[d]:
+                track = Track(next(self._ids), boxes[d], float(confs[d]), int(classes[d]), t)
+                survivors.append(track)
+                track_ids[d] = track.track_id
+        self.tracks = survivors
+        return track_ids
+
+    def predict(self, t):
+        """
+        外推到时间 t 的轨迹 (只包含最近一次检测中匹配上的目标)。
+        返回 (boxes (N, 4), confs, classes, track_ids)。
+        """
+        active = [track for track in self.tracks if track.misses == 0]
+        if not active:
+            return np.zeros((0, 4)), [], [], []
+        boxes = np.stack([track.box_at(t, self.max_predict) for track in active])
+        return (
+            boxes,
+            [track.conf for track in active],
+            [track.cls for track in active],
+            [track.track_id for track in active],
+        )
@@ -0,0 +1,338 @@
+# backend/video_cache.py
+# 上传视频的离线预分析：每个文件只用进程池全速检测一次，结果按时间索引存盘，回放时直接查表
+import os
+import json
+import time
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import av
+import numpy as np
+
+from ai_config import VIDEO_EXTENSIONS
+from worker_pool import configure_worker, physical_core_count
+
+logger = logging.getLogger("VideoCache")
+
+CACHE_VERSION = 1
+# 预分析进程的 nice 增量：与实时推理争抢 CPU 时让实时推理优先
+ANALYSIS_NICE = 10
+
+
+class DetectionIndex:
+    """
+    一个视频的检测索引 (从 .npz 加载)：
+    - times: (F,) 每帧的媒体时间 (秒，pts * time_base)，升序
+    - offsets: (F + 1,) 第 i 帧的检测是 dets[offsets[i]:offsets[i + 1]]
+    - dets: (M, 6) float32 [x1, y1, x2, y2, conf, cls]，坐标按画面宽高归一化到 0~1，与分辨率无关
+    """
+    def __init__(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            self.times = data["times"]
+            self.pts = data["pts"]
+            self.offsets = data["offsets"]
+            self.dets = data["dets"]
+            self.meta = json.loads(str(data["meta"]))
+        self.names = {int(k): v for k, v in self.meta["names"].items()}
+        self.duration = float(self.meta.get("duration") or (self.times[-1] if len(self.times) else 0.0))
+
+    def __len__(self):
+        return len(self.times)
+
+    def lookup(self, seconds, loop=True):
+        """离 seconds 最近且不晚于它的一帧的检测 (N, 6)，loop 为 True 时按视频时长取模"""
+        if len(self.times) == 0:
+            return self.dets[:0]
+        if loop and self.duration > 0:
+            seconds = seconds % self.duration
+        i = max(0, int(np.searchsorted(self.times, seconds + 1e-6, side="right")) - 1)
+        return self.dets[self.offsets[i]:self.offsets[i + 1]]
+
+    def objects(self, seconds, width, height, loop=True):
+        """查表并换算成 ai_result 的 objects (目标分辨率的像素坐标)，返回 (objects, mean_confidence)"""
+        dets = self.lookup(seconds, loop)
+        if len(dets) == 0:
+            return [], 0.0
+        boxes = (dets[:, :4] * np.array([width, height, width, height], dtype=np.float32)).astype(int).tolist()
+        confs = np.round(dets[:, 4].astype(np.float64), 2).tolist()
+        objects = [
+            {"label": self.names.get(int(c), str(int(c))), "bbox": b, "confidence": conf}
+            for b, conf, c in zip(boxes, confs, dets[:, 5])
+        ]
+        return objects, float(dets[:, 4].mean())
+
+
+def cached_result(index, seconds, pts, time_base, width, height, frame_id, arrival_time):
+    """用缓存的检测拼出一条 ai_result (格式与 AISession.finalize 一致，source 为 "cache")"""
+    objects, mean_conf = index.objects(seconds, width, height)
+    now = time.time()
+    return {
+        "type": "ai_result",
+        "source": "cache",
+        "frame_id": frame_id,
+        "pts": pts,
+        "send_time": now * 1000,
+        "timestamp": pts,
+        "time_base_num": time_base.numerator,
+        "time_base_den": time_base.denominator,
+        "frame_width": width,
+        "frame_height": height,
+        "media_time": round(seconds, 3),    # 在源视频中的位置 (秒)
+        "d_an": round((now - arrival_time) * 1000, 2),
+        "mean_confidence": round(mean_conf, 4),
+        "inference_time": 0,
+        "objects": objects,
+    }
+
+
+# --- 子进程中运行的分析任务 ---
+_analysis_processor = None
+
+
+def _init_analysis_worker(threads):
+    if hasattr(os, "nice"):
+        try:
+            os.nice(ANALYSIS_NICE)
+        except OSError as e:
+            logger.warning(f"⚠️ Failed to lower analysis worker priority: {e}")
+    configure_worker(threads)
+
+
+def _get_processor(spec):
+    global _analysis_processor
+    if _analysis_processor is None:
+        from ai_processor import AIProcessor
+        processor = AIProcessor(**spec)
+        if not processor.load():
+            raise RuntimeError(f"model load failed: {processor.error}")
+        _analysis_processor = processor
+    return _analysis_processor
+
+
+def analyze_video(video_path, cache_path, spec, batch_size=8):
+    """
+    逐帧检测整个视频并写入索引 (在进程池中运行)。
+    帧在 libav 中直接缩放到模型尺寸，每 batch_size 帧一次前向。返回统计信息。
+    """
+    from ai_processor import model_input_size
+    processor = _get_processor(spec)
+    start = time.time()
+    stat = os.stat(video_path)   # 分析开始前记录源文件状态，分析期间文件被覆盖时索引会被判为过期
+
+    times, pts_list, counts, all_dets = [], [], [], []
+    container = av.open(video_path)
+    try:
+        stream = container.streams.video[0]
+        time_base = stream.time_base
+        width = height = None
+        batch = []
+        for frame in container.decode(stream):
+            if width is None:
+                width, height = frame.width, frame.height
+                model_w, model_h = model_input_size(width, height, processor.imgsz)
+            frame_pts = frame.pts if frame.pts is not None else len(times) + len(batch)
+            img = frame.to_ndarray(width=model_w, height=model_h, format="bgr24")
+            batch.append((float(frame_pts * time_base), int(frame_pts), img))
+            if len(batch) >= batch_size:
+                _flush_batch(processor, batch, times, pts_list, counts, all_dets, model_w, model_h)
+        if batch:
+            _flush_batch(processor, batch, times, pts_list, counts, all_dets, model_w, model_h)
+    finally:
+        container.close()
+
+    order = np.argsort(times, kind="stable")   # B 帧：解码顺序即显示顺序，这里保险起见按时间排序
+    times = np.asarray(times, dtype=np.float64)[order]
+    pts_arr = np.asarray(pts_list, dtype=np.int64)[order]
+    counts = np.asarray(counts, dtype=np.int64)[order]
+    dets_sorted = [all_dets[i] for i in order]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    dets = np.concatenate(dets_sorted).astype(np.float32) if dets_sorted else np.zeros((0, 6), np.float32)
+    # 时长 = 最后一帧的时间 + 一帧的间隔，循环播放时按它取模
+    frame_interval = float(np.median(np.diff(times))) if len(times) > 1 else 0.0
+
+    meta = {
+        "version": CACHE_VERSION,
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "engine": spec.get("engine"),
+        "weights": spec.get("weights"),
+        "imgsz": spec.get("imgsz"),
+        "width": width,
+        "height": height,
+        "time_base": [time_base.numerator, time_base.denominator],
+        "duration": float(times[-1]) + frame_interval if len(times) else 0.0,
+        "names": {str(k): v for k, v in processor.names.items()},
+    }
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez_compressed(tmp_path, times=times, pts=pts_arr, offsets=offsets, dets=dets, meta=json.dumps(meta))
+    os.replace(tmp_path, cache_path)
+    elapsed = time.time() - start
+    return {"frames": len(times), "detections": len(dets), "elapsed_s": round(elapsed, 2),
+            "fps": round(len(times) / elapsed, 1) if elapsed > 0 else 0}
+
+
+def _flush_batch(processor, batch, times, pts_list, counts, all_dets, width, height):
+    scale = np.array([width, height, width, height], dtype=np.float32)
+    for (t, p, _), dets in zip(batch, processor.detect([img for _, _, img in batch])):
+        norm = dets.copy()
+        norm[:, :4] /= scale
+        times.append(t)
+        pts_list.append(p)
+        counts.append(len(norm))
+        all_dets.append(norm)
+    batch.clear()
+
+
+class VideoAnalysisCache:
+    """
+    上传视频的预分析任务管理 + 索引缓存。
+    - schedule(filename): 上传后提交到进程池 (spawn)，每个进程加载自己的模型，全速离线检测
+    - get(filename): 返回已完成且与源文件一致的 DetectionIndex，未完成/已过期时返回 None
+    索引文件存放在 upload_dir/.cache/<文件名>.<引擎>.npz，源文件大小或修改时间变化后自动失效。
+    预分析与实时推理 worker 同时运行：线程数默认只用实时 worker 占用 (reserved_threads) 之外的物理核心，
+    进程以较低优先级运行 (ANALYSIS_NICE)。
+    """
+    def __init__(self, upload_dir, spec, max_workers=1, threads_per_worker=0, max_loaded=8, reserved_threads=0):
+        self.upload_dir = upload_dir
+        self.cache_dir = os.path.join(upload_dir, ".cache")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.spec = spec
+        self.max_workers = max(1, int(max_workers))
+        spare = physical_core_count() - max(0, int(reserved_threads))
+        self.threads = int(threads_per_worker) or max(1, spare // self.max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._jobs = {}                 # filename -> 任务状态
+        self._loaded = OrderedDict()    # filename -> DetectionIndex (LRU)
+        self.max_loaded = max_loaded
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_analysis_worker,
+                initargs=(self.threads,),
+            )
+        return self._executor
+
+    def cache_path(self, filename):
+        return os.path.join(self.cache_dir, f"{filename}.{self.spec.get('engine', 'pytorch')}.npz")
+
+    def video_path(self, filename):
+        return os.path.join(self.upload_dir, filename)
+
+    def resolve(self, source):
+        """把任意路径/文件名解析为上传目录里的文件名，不是上传的视频时返回 None"""
+        if not source:
+            return None
+        filename = os.path.basename(source)
+        if os.path.isfile(self.video_path(filename)) and (
+            os.path.abspath(source) == os.path.abspath(self.video_path(filename)) or source == filename
+        ):
+            return filename
+        return None
+
+    def _is_fresh(self, filename, index):
+        try:
+            stat = os.stat(self.video_path(filename))
+        except OSError:
+            return False
+        meta = index.meta
+        # 检测器 (权重/输入尺寸) 变化后旧索引同样过期
+        return (meta.get("version") == CACHE_VERSION and meta.get("source_size") == stat.st_size
+                and abs(meta.get("source_mtime", 0) - stat.st_mtime) < 1e-3
+                and meta.get("weights") == self.spec.get("weights") and meta.get("imgsz") == self.spec.get("imgsz"))
+
+    def schedule(self, filename, force=False):
+        """
+        提交预分析任务 (已有新鲜的索引或任务正在进行时直接返回)。
+        force 时 (源文件被覆盖) 如果任务正在进行，它分析的是旧文件：标记 rerun，结束后再分析一次。
+        """
+        if not filename.lower().endswith(VIDEO_EXTENSIONS):
+            return None
+        with self._lock:
+            job = self._jobs.get(filename)
+            if job and job["state"] in ("queued", "running"):
+                if force:
+                    job["rerun"] = True
+                return job
+        if not force and self.get(filename) is not None:
+            return self._jobs.get(filename)
+
+        job = {"state": "queued", "submitted": time.time()}
+        with self._lock:
+            self._jobs[filename] = job
+            self._loaded.pop(filename, None)
+        future = self._get_executor().submit(
+            analyze_video, self.video_path(filename), self.cache_path(filename), self.spec
+        )
+        job["state"] = "running"
+
+        def done(f):
+            try:
+                job.update(f.result(), state="done")
+                logger.info(f"🎞️ Pre-analysis done: {filename} {job}")
+            except Exception as e:
+                job.update(state="failed", error=str(e))
+                logger.error(f"❌ Pre-analysis failed for {filename}: {e}")
+            # 分析期间源文件被覆盖 (且任务没有被 invalidate 删除)：对新文件重新分析
+            if job.get("rerun") and self._jobs.get(filename) is job:
+                logger.info(f"🎞️ {filename} changed during analysis, re-analyzing")
+                self.schedule(filename, force=True)
+        future.add_done_callback(done)
+        logger.info(f"🎞️ Pre-analysis scheduled: {filename}")
+        return job
+
+    def schedule_all(self):
+        """启动时为上传目录里还没有索引的视频补做预分析"""
+        if not os.path.isdir(self.upload_dir):
+            return
+        for filename in sorted(os.listdir(self.upload_dir)):
+            if os.path.isfile(self.video_path(filename)):
+                self.schedule(filename)
+
+    def get(self, filename):
+        with self._lock:
+            index = self._loaded.get(filename)
+            if index is not None:
+                self._loaded.move_to_end(filename)
+        if index is None:
+            path = self.cache_path(filename)
+            if not os.path.exists(path):
+                return None
+            try:
+                index = DetectionIndex(path)
+            except Exception as e:
+                logger.warning(f"⚠️ Broken cache for {filename}: {e}")
+                return None
+            with self._lock:
+                self._loaded[filename] = index
+                while len(self._loaded) > self.max_loaded:
+                    self._loaded.popitem(last=False)
+        return index if self._is_fresh(filename, index) else None
+
+    def invalidate(self, filename):
+        with self._lock:
+            self._loaded.pop(filename, None)
+            self._jobs.pop(filename, None)
+        path = self.cache_path(filename)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def status(self, filename=None):
+        if filename is not None:
+            job = dict(self._jobs.get(filename) or {})
+            if not job.get("state"):
+                job["state"] = "done" if self.get(filename) is not None else "missing"
+            return job
+        files = [f for f in os.listdir(self.upload_dir) if os.path.isfile(self.video_path(f))] \
+            if os.path.isdir(self.upload_dir) else []
+        return {f: self.status(f) for f in sorted(files) if f.lower().endswith(VIDEO_EXTENSIONS)}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,215 @@
+# backend/worker_pool.py
+import os
+import logging
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+logger = logging.getLogger("WorkerPool")
+
+
+def physical_cpu_ids():
+    """
+    每个物理核心取一个逻辑 CPU 编号 (跳过超线程的兄弟核)，只包含本进程允许使用的 CPU。
+    读取 Linux sysfs 拓扑；其他平台退化为全部逻辑 CPU。
+    """
+    allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    seen = set()
+    cpus = []
+    for cpu in allowed:
+        base = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(f"{base}/physical_package_id") as f:
+                package = f.read().strip()
+            with open(f"{base}/core_id") as f:
+                core = f.read().strip()
+        except OSError:
+            return allowed
+        if (package, core) not in seen:
+            seen.add((package, core))
+            cpus.append(cpu)
+    return cpus or allowed
+
+
+def physical_core_count():
+    try:
+        import psutil
+        count = psutil.cpu_count(logical=False)
+    except ImportError:
+        count = None
+    return min(count or len(physical_cpu_ids()), len(physical_cpu_ids())) or 1
+
+
+def plan_workers(num_workers, threads_per_worker=0, pin_cpus=False):
+    """
+    按物理核心数分配线程预算：workers x threads 不超过物理核心数。
+    threads_per_worker 为 0 时自动取 物理核心数 // workers。
+    返回 (threads_per_worker, 每个 worker 绑定的 CPU 列表 (不绑核时为 None))。
+    """
+    cores = physical_core_count()
+    num_workers = max(1, int(num_workers))
+    auto = max(1, cores // num_workers)
+    threads = int(threads_per_worker) or auto
+    if num_workers * threads > cores and threads > auto:
+        logger.warning(
+            f"⚠️ {num_workers} workers x {threads} threads exceeds {cores} physical cores, "
+            f"using {auto} threads per worker"
+        )
+        threads = auto
+    if num_workers > cores:
+        logger.warning(f"⚠️ {num_workers} workers on {cores} physical cores, workers will share cores")
+    cpu_sets = [None] * num_workers
+    if pin_cpus and hasattr(os, "sched_setaffinity"):
+        cpus = physical_cpu_ids()
+        # 下标按核心数取模：超出末尾时从头绕回，每个 worker 都绑定 threads 个核心 (核心不够时为全部核心)
+        per_worker = min(threads, len(cpus))
+        cpu_sets = [
+            [cpus[(i * threads + k) % len(cpus)] for k in range(per_worker)]
+            for i in range(num_workers)
+        ]
+    return threads, cpu_sets
+
+
+def configure_worker(threads, cpus=None):
+    """
+    在 worker (线程或进程) 内调用：固定 torch 的 intra-op 线程数，可选绑定 CPU。
+    Linux 上 sched_setaffinity(0) 只作用于调用线程，之后它创建的 OpenMP 线程继承这个亲和性。
+    线程数只通过 torch.set_num_threads 设置：torch 已经加载后再改 OMP_NUM_THREADS 不起作用，
+    线程模式下还会改动整个进程的环境变量。
+    """
+    import torch
+    torch.set_num_threads(threads)
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            logger.warning(f"⚠️ CPU pinning failed ({cpus}): {e}")
+
+
+class ThreadWorkerPool:
+    """
+    线程模式：所有 worker 在同一进程内，每个 worker 线程持有自己的模型副本 (见 AIProcessor.init_worker)。
+    模型权重共享一份内存，但 GIL 下的 Python 前后处理会互相排队。
+    """
+    mode = "thread"
+
+    def __init__(self, processor, num_workers, threads_per_worker=0, pin_cpus=False):
+        self.processor = processor
+        self.num_workers = num_workers
+        self.threads, self.cpu_sets = plan_workers(num_workers, threads_per_worker, pin_cpus)
+        self._slots = itertools.count()
+        self._slot_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=num_workers,
+            thread_name_prefix="ai-infer",
+            initializer=self._init_worker,
+        )
+
+    def _init_worker(self):
+        with self._slot_lock:
+            slot = next(self._slots) % self.num_workers
+        configure_worker(self.threads, self.cpu_sets[slot])
+        self.processor.init_worker()
+
+    def warmup(self):
+        # 每个任务都在 barrier 上等待其他任务，迫使线程池把 num_workers 个线程全部创建出来，
+        # 每个新线程先执行 initializer (设置线程数/绑核 + 加载并预热模型副本)
+        barrier = threading.Barrier(self.num_workers)
+        futures = [self.executor.submit(barrier.wait, 600) for _ in range(self.num_workers)]
+        for future in futures:
+            future.result()
+
+    def submit(self, groups):
+        return self.executor.submit(self.processor.run_groups, groups)
+
+    def describe(self):
+        return {"mode": self.mode, "workers": self.num_workers, "threads_per_worker": self.threads,
+                "cpu_sets": self.cpu_sets}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- 进程模式：每个子进程里的推理引擎 ---
+_worker_processor = None
+
+
+def _init_process_worker(spec, threads, cpus):
+    global _worker_processor
+    configure_worker(threads, cpus)
+    from ai_processor import AIProcessor
+    processor = AIProcessor(**spec)
+    if not processor.load():
+        raise RuntimeError(f"worker model load failed: {processor.error}")
+    _worker_processor = processor
+
+
+def _process_ping():
+    return os.getpid()
+
+
+def _process_run_groups(groups):
+    return _worker_processor.run_groups(groups)
+
+
+class ProcessWorkerPool:
+    """
+    进程模式：每个 worker 是一个独立进程 (spawn)，加载自己的模型，不受 GIL 影响。
+    每个进程单独一个 ProcessPoolExecutor，这样每个 worker 可以有自己的线程数和 CPU 集合。
+    帧数据通过 pickle 传给子进程 (一帧 640x360 约 0.7MB)。
+    """
+    mode = "process"
+
+    def __init__(self, processor, num_workers, threads_per_worker=0, pin_cpus=False):
+        self.processor = processor
+        self.num_workers = num_workers
+        self.threads, self.cpu_sets = plan_workers(num_workers, threads_per_worker, pin_cpus)
+        context = multiprocessing.get_context("spawn")
+        self.executors = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=_init_process_worker,
+                initargs=(processor.spec, self.threads, cpus),
+            )
+            for cpus in self.cpu_sets
+        ]
+        self._idle = list(range(num_workers))
+        self._lock = threading.Lock()
+
+    def warmup(self):
+        # 每个进程执行一次空任务，触发 initializer (加载 + 预热模型)
+        pids = [executor.submit(_process_ping) for executor in self.executors]
+        for future in pids:
+            future.result()
+
+    def submit(self, groups):
+        # 调度器保证同时在推理的 batch 不超过 num_workers，这里总能取到一个空闲进程
+        with self._lock:
+            index = self._idle.pop(0) if self._idle else 0
+        future = self.executors[index].submit(_process_run_groups, groups)
+
+        def release(_):
+            with self._lock:
+                self._idle.append(index)
+        future.add_done_callback(release)
+        return future
+
+    def describe(self):
+        return {"mode": self.mode, "workers": self.num_workers, "threads_per_worker": self.threads,
+                "cpu_sets": self.cpu_sets}
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_worker_pool(processor, mode="thread", num_workers=1, threads_per_worker=0, pin_cpus=False):
+    """按模式创建推理 worker 池: thread / process"""
+    pools = {"thread": ThreadWorkerPool, "process": ProcessWorkerPool}
+    if mode not in pools:
+        raise ValueError(f"Unknown worker mode '{mode}', available: {list(pools)}")
+    pool = pools[mode](processor, num_workers, threads_per_worker, pin_cpus)
+    logger.info(f"🧵 Inference worker pool: {pool.describe()}")
+    return pool
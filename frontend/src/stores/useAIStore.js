@@ -2,6 +2,7 @@ import { ref, reactive, onUnmounted } from 'vue'
 import { defineStore } from 'pinia'
 import { useSocketStore } from './useSocketStore'
 import { ElMessage } from 'element-plus'
+import { decodeResult } from '../utils/resultCodec'
 
 const AI_NAMESPACE = '/ai_analysis'
 
@@ -35,6 +36,14 @@ export const useAIStore = defineStore('ai', () => {
   const isReceiving = ref(false)
 
   const resultsMap = reactive({})
+  // 每个 peer 最近一次完整结果 (关键帧) 的目标，ai_delta 相对它应用 (不需要响应式)
+  const keyframes = {}
+  // 结果格式：默认 'json'；设为 'binary' 时在 join 时与服务端协商二进制 ai_result (见 backend/result_codec.py)
+  const resultFormat = ref('json')
+  let resultLabels = []
+  // 本端推流的结果通道：'datachannel' (与媒体同路的无序、不重传 DataChannel) / 'socketio' (回退)
+  const resultTransport = ref('socketio')
+  let resultChannel = null
 
   const netStats = reactive({ rtt: 0, bitrate: 0, fps: 0, packetLoss: 0 })
   let statsTimer = null
@@ -106,26 +115,70 @@ export const useAIStore = defineStore('ai', () => {
 
     // 同时也监听结果，为了通用
     socket.off('ai_result');
-    socket.on('ai_result', (data) => {
-      if (data && data.peerId) {
-        resultsMap[data.peerId] = data;
-
-        if (!startupTimesMap[data.peerId]) {
-          const startTS = pendingStartupMap[data.peerId]
-          let totalTime = startTS ? Date.now() - startTS : 0
-          if (!totalTime && data.send_time) {
-            totalTime = Date.now() - data.send_time
-          }
+    socket.on('ai_result', handleResultMessage);
 
-          if (totalTime > 0) {
-            recordStartupDuration(data.peerId, totalTime)
-            ElMessage.success(`AI 首帧返回 (${data.peerId})：${Math.round(totalTime)}ms`)
-          }
-        }
+    // 二进制结果：标签表在协商时收到一次，之后每条结果只带类别号
+    socket.off('ai_labels');
+    socket.on('ai_labels', (data) => { resultLabels = data.labels || [] });
+    socket.off('ai_result_bin');
+    socket.on('ai_result_bin', (buffer) => {
+      try {
+        handleResultMessage(decodeResult(buffer, resultLabels))
+      } catch (err) {
+        console.error('Failed to decode binary ai_result:', err)
       }
     });
   }
 
+  function handleResultMessage(message) {
+    const data = applyResultMessage(message)
+    if (data && data.peerId) {
+      resultsMap[data.peerId] = data;
+
+      if (!startupTimesMap[data.peerId]) {
+        const startTS = pendingStartupMap[data.peerId]
+        let totalTime = startTS ? Date.now() - startTS : 0
+        if (!totalTime && data.send_time) {
+          totalTime = Date.now() - data.send_time
+        }
+
+        if (totalTime > 0) {
+          recordStartupDuration(data.peerId, totalTime)
+          ElMessage.success(`AI 首帧返回 (${data.peerId})：${Math.round(totalTime)}ms`)
+        }
+      }
+    }
+  }
+
+  // 服务端开启变化抑制/增量发送后 (见 backend/result_emitter.py)，把心跳和增量还原成完整结果
+  function applyResultMessage(message) {
+    if (!message || !message.peerId) return message
+    const peerId = message.peerId
+    const type = message.type || 'ai_result'
+    if (type === 'ai_result') {
+      keyframes[peerId] = { seq: message.keyframe, objects: message.objects || [] }
+      return message
+    }
+    const previous = resultsMap[peerId]
+    if (!previous) return null
+    if (type === 'ai_heartbeat') {
+      // 目标没有变化：沿用上一次的框，只更新时间戳和延迟
+      return { ...previous, ...message, type: 'ai_result', objects: previous.objects }
+    }
+    if (type === 'ai_delta') {
+      const keyframe = keyframes[peerId]
+      // 关键帧丢失 (例如被丢弃)：忽略增量，等待下一次完整结果
+      if (!keyframe || keyframe.seq !== message.keyframe) return null
+      const removed = new Set(message.removed || [])
+      const changed = new Map([...(message.moved || []), ...(message.added || [])].map((o) => [o.track_id, o]))
+      const objects = keyframe.objects
+        .filter((o) => !removed.has(o.track_id) && !changed.has(o.track_id))
+        .concat([...changed.values()])
+      return { ...previous, ...message, type: 'ai_result', objects }
+    }
+    return message
+  }
+
   const joinAIRoomOnly = async (roomId) => {
     if (!roomId) return
     aiSocket.value = socketStore.getSocket(AI_NAMESPACE)
@@ -133,7 +186,7 @@ export const useAIStore = defineStore('ai', () => {
       await ensureSocketConnected(aiSocket.value)
       setupCommonListeners(aiSocket.value)
 
-      aiSocket.value.emit('join', { roomId })
+      aiSocket.value.emit('join', { roomId, resultFormat: resultFormat.value })
       isReceiving.value = true
     } catch (err) {
       console.error(err)
@@ -166,7 +219,7 @@ export const useAIStore = defineStore('ai', () => {
       await ensureSocketConnected(aiSocket.value)
       setupCommonListeners(aiSocket.value)
 
-      aiSocket.value.emit('join', { roomId })
+      aiSocket.value.emit('join', { roomId, resultFormat: resultFormat.value })
       isReceiving.value = true
 
       pc.value = new RTCPeerConnection({
@@ -181,6 +234,22 @@ export const useAIStore = defineStore('ai', () => {
         if (pc.value && data.candidate) await pc.value.addIceCandidate(data.candidate)
       })
 
+      // 结果 DataChannel：无序 + 不重传，过时的结果直接丢弃而不是排队；通道没打开前服务端仍用 Socket.IO 发送
+      resultChannel = pc.value.createDataChannel('ai_results', { ordered: false, maxRetransmits: 0 })
+      resultChannel.binaryType = 'arraybuffer'
+      resultChannel.onopen = () => { resultTransport.value = 'datachannel' }
+      resultChannel.onclose = () => { resultTransport.value = 'socketio' }
+      resultChannel.onmessage = (event) => {
+        try {
+          const message = typeof event.data === 'string'
+            ? JSON.parse(event.data)
+            : decodeResult(event.data, resultLabels)
+          handleResultMessage(message)
+        } catch (err) {
+          console.error('Failed to handle DataChannel ai_result:', err)
+        }
+      }
+
       pc.value.onicecandidate = (event) => {
         if (event.candidate) aiSocket.value.emit('candidate', { candidate: event.candidate.toJSON() })
         else aiSocket.value.emit('candidate', { candidate: null })
@@ -279,6 +348,11 @@ export const useAIStore = defineStore('ai', () => {
       clearInterval(statsTimer)
       statsTimer = null
     }
+    if (resultChannel) {
+      resultChannel.close()
+      resultChannel = null
+    }
+    resultTransport.value = 'socketio'
     if (pc.value) {
       pc.value.close()
       pc.value = null
@@ -296,10 +370,13 @@ export const useAIStore = defineStore('ai', () => {
 
     // 再停接收
     for (const key in resultsMap) delete resultsMap[key];
+    for (const key in keyframes) delete keyframes[key];
     isReceiving.value = false
 
     if (aiSocket.value) {
       aiSocket.value.off('ai_result')
+      aiSocket.value.off('ai_result_bin')
+      aiSocket.value.off('ai_labels')
       aiSocket.value.off('answer')
       aiSocket.value.off('candidate')
       aiSocket.value.off('ai_status')
@@ -311,7 +388,7 @@ export const useAIStore = defineStore('ai', () => {
   onUnmounted(() => { disconnectAll() })
 
   return {
-    isConnected, isSending, isReceiving, resultsMap, netStats,
+    isConnected, isSending, isReceiving, resultsMap, netStats, resultFormat, resultTransport,
     connectAI, joinAIRoomOnly, disconnectAll, stopStreaming,
     isAIReady, aiStartupTime, startupTimesMap
   }
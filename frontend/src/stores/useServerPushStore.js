@@ -13,6 +13,8 @@ export const useServerPushStore = defineStore('serverPush', () => {
   const remoteStream = ref(null);
   const connectionState = ref('disconnected'); // 保持 'disconnected' 为初始状态
   const connectionStats = ref({});
+  // 推流源是已预分析的上传视频时，服务端从缓存推送的检测结果 (source: "cache")
+  const aiResult = ref(null);
 
   const isConnected = computed(() => connectionState.value === 'connected');
 
@@ -136,6 +138,7 @@ export const useServerPushStore = defineStore('serverPush', () => {
       pushSocket.value.on('answer', (data) => handleSignal({ type: 'answer', ...data }));
       pushSocket.value.on('candidate', (data) => handleSignal({ type: 'ice-candidate', ...data }));
       pushSocket.value.on('error', (data) => handleSignal({ type: 'error', ...data }));
+      pushSocket.value.on('ai_result', (data) => { aiResult.value = data; });
 
       // 创建并发送 Offer
       const offer = await peerConnection.value.createOffer();
@@ -156,6 +159,7 @@ export const useServerPushStore = defineStore('serverPush', () => {
       peerConnection.value = null;
     }
     remoteStream.value = null;
+    aiResult.value = null;
     
     // [V19-FIX] 只有在未断开时才设置为 'disconnected'
     if (connectionState.value !== 'disconnected') {
@@ -166,6 +170,7 @@ export const useServerPushStore = defineStore('serverPush', () => {
       pushSocket.value.off('answer');
       pushSocket.value.off('candidate');
       pushSocket.value.off('error');
+      pushSocket.value.off('ai_result');
       // 不调用 disconnect()，让 socketStore 管理
       pushSocket.value = null;
     }
@@ -178,6 +183,7 @@ export const useServerPushStore = defineStore('serverPush', () => {
     remoteStream,
     connectionState,
     connectionStats,
+    aiResult,
     isConnected,
     startConnection,
     stopConnection,
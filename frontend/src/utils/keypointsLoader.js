@@ -32,4 +32,57 @@ export function toPlainHandData(predictions) {
     landmarks: (p.landmarks || []).map((lm) => [lm[0], lm[1], lm[2]]),
     handedness: 'unknown'
   }))
-}
\ No newline at end of file
+}
+// 二进制打包关键点 (与 backend/keypoints.py 的 decode_packed 对应)，作为 Socket.IO 二进制附件发送：
+// socket.emit('analysis_keypoints_sequence', { source, fps, format: 'packed', data: packKeypoints(frames) })
+// frames: [{ hands: [{ landmarks: [[x,y,z(,score)], ...] }] }]，quantize 为 true 时用 int16 (体积再减半)
+const MAX_HANDS = 2
+const NUM_LANDMARKS = 21
+const CHANNELS = 4
+const HEADER_BYTES = 16
+
+export function packKeypoints(frames, { quantize = false } = {}) {
+  const numFrames = frames.length
+  const slots = numFrames * MAX_HANDS
+  const values = new Float32Array(slots * NUM_LANDMARKS * CHANNELS)
+  const counts = new Uint8Array(slots)
+  const peak = new Float32Array(CHANNELS)
+
+  frames.forEach((frame, f) => {
+    ;(frame?.hands || []).slice(0, MAX_HANDS).forEach((hand, h) => {
+      const landmarks = (hand.landmarks || []).slice(0, NUM_LANDMARKS)
+      counts[f * MAX_HANDS + h] = landmarks.length
+      landmarks.forEach((lm, i) => {
+        const base = ((f * MAX_HANDS + h) * NUM_LANDMARKS + i) * CHANNELS
+        for (let c = 0; c < CHANNELS; c++) {
+          const v = c < lm.length ? lm[c] : (c === 3 ? 1 : 0)
+          values[base + c] = v
+          peak[c] = Math.max(peak[c], Math.abs(v))
+        }
+      })
+    })
+  })
+
+  const countsBytes = Math.ceil(slots / 4) * 4
+  const dataOffset = HEADER_BYTES + CHANNELS * 4 + countsBytes
+  const buffer = new ArrayBuffer(dataOffset + values.length * (quantize ? 2 : 4))
+  const view = new DataView(buffer)
+  view.setUint8(0, 0x4b) // 'K'
+  view.setUint8(1, 0x50) // 'P'
+  view.setUint8(2, 1) // version
+  view.setUint8(3, quantize ? 2 : 1) // 1=float32, 2=int16
+  view.setUint16(4, numFrames, true)
+  view.setUint8(6, MAX_HANDS)
+  view.setUint8(7, NUM_LANDMARKS)
+  view.setUint8(8, CHANNELS)
+
+  const scales = peak.map((p) => (quantize && p > 0 ? 32767 / p : 1))
+  scales.forEach((s, c) => view.setFloat32(HEADER_BYTES + c * 4, s, true))
+  new Uint8Array(buffer, HEADER_BYTES + CHANNELS * 4, slots).set(counts)
+
+  values.forEach((v, i) => {
+    if (quantize) view.setInt16(dataOffset + i * 2, Math.round(v * scales[i % CHANNELS]), true)
+    else view.setFloat32(dataOffset + i * 4, v, true)
+  })
+  return buffer
+}
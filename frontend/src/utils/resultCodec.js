@@ -0,0 +1,78 @@
+// 二进制 ai_result 解码 (与 backend/result_codec.py 对应)
+// 头部 80 字节 (小端) + peerId + int16 归一化框 + uint8 置信度 + uint8 类别号 (+ uint32 track_id)
+// ab / adaptive / temporal / emit 等调试字段不在二进制格式里，需要时使用 JSON 格式
+const RESULT_VERSION = 2
+const HEADER_BYTES = 80
+const BOX_SCALE = 32767
+const FLAG_HEARTBEAT = 1
+const FLAG_TRACK_IDS = 2
+const FLAG_REUSED = 4
+const SOURCES = ['detector', 'tracker', 'cache']
+
+// 与 ResultCodec.decode 相同的取整：float32 还原出的 12.34000015258789 显示为 12.34
+const round = (value, digits) => Math.round(value * 10 ** digits) / 10 ** digits
+
+export function decodeResult(buffer, labels = []) {
+  const bytes = buffer instanceof ArrayBuffer ? new Uint8Array(buffer) : new Uint8Array(buffer.buffer, buffer.byteOffset, buffer.byteLength)
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength)
+  if (bytes[0] !== 0x41 || bytes[1] !== 0x52 || bytes[2] !== RESULT_VERSION) throw new Error('invalid binary ai_result')
+
+  const flags = bytes[3]
+  const count = view.getUint16(6, true)
+  const width = view.getUint16(8, true)
+  const height = view.getUint16(10, true)
+  const pts = Number(view.getBigInt64(12, true))
+  const peerLen = bytes[60]
+  const peerId = new TextDecoder().decode(bytes.subarray(HEADER_BYTES, HEADER_BYTES + peerLen))
+
+  const result = {
+    type: flags & FLAG_HEARTBEAT ? 'ai_heartbeat' : 'ai_result',
+    source: SOURCES[bytes[4]] || 'detector',
+    peerId,
+    pts,
+    timestamp: pts,
+    time_base_num: view.getUint32(20, true),
+    time_base_den: view.getUint32(24, true),
+    send_time: view.getFloat64(28, true),
+    d_an: round(view.getFloat32(36, true), 2),
+    inference_time: round(view.getFloat32(40, true), 2),
+    fps: round(view.getFloat32(44, true), 1),
+    frame_id: view.getUint32(52, true),
+    keyframe: view.getUint32(56, true),
+    frame_width: width,
+    frame_height: height,
+    reused: Boolean(flags & FLAG_REUSED)
+  }
+  // 心跳不带置信度和这些统计，沿用上一条完整结果里的值
+  if (flags & FLAG_HEARTBEAT) return result
+  result.mean_confidence = round(view.getFloat32(48, true), 4)
+  result.process_time = round(view.getFloat32(64, true), 2)
+  result.batch_size = view.getUint16(68, true)
+  result.queue_depth = view.getUint16(70, true)
+  result.skipped_frames = view.getUint32(72, true)
+  result.replaced_frames = view.getUint32(76, true)
+
+  let offset = HEADER_BYTES + peerLen
+  const objects = []
+  for (let i = 0; i < count; i++) {
+    const base = offset + i * 8
+    objects.push({
+      bbox: [
+        Math.round((view.getInt16(base, true) * width) / BOX_SCALE),
+        Math.round((view.getInt16(base + 2, true) * height) / BOX_SCALE),
+        Math.round((view.getInt16(base + 4, true) * width) / BOX_SCALE),
+        Math.round((view.getInt16(base + 6, true) * height) / BOX_SCALE)
+      ]
+    })
+  }
+  offset += count * 8
+  objects.forEach((o, i) => { o.confidence = Math.round((bytes[offset + i] / 255) * 100) / 100 })
+  offset += count
+  objects.forEach((o, i) => { o.label = labels[bytes[offset + i]] ?? 'unknown' })
+  offset += count
+  if (flags & FLAG_TRACK_IDS) {
+    objects.forEach((o, i) => { o.track_id = view.getUint32(offset + i * 4, true) })
+  }
+  result.objects = objects
+  return result
+}